@@ -3,10 +3,12 @@
 
 """
 使用多轮工具调用实现具有连续函数调用能力的财务计算代理
+plan 模式下模型一次返回完整的计算计划（步骤列表或一个表达式），由本地执行，每个公式只需一次LLM往返
 """
 
 import json
 import os
+import sys
 import re
 import time
 import asyncio
@@ -15,14 +17,17 @@ from typing import List, Dict, Any, Optional
 
 # 引入必要的第三方库
 import httpx
-from openai import AsyncOpenAI  # 使用OpenAI兼容接口
+
+# 公式编译器等公共模块位于 src/ 目录
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from formula_compiler import compile_formula, FormulaError
+import llm_client
+import calculator_tools
 
 # 加载API密钥
 def load_api_keys():
     """加载API密钥配置"""
-    api_keys_path = "/home/super/linchen/000000-api-keys/api_keys.json"
-    with open(api_keys_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return llm_client.load_api_keys()
 
 class DeepSeekLLM:
     """DeepSeek LLM客户端封装类"""
@@ -33,10 +38,6 @@ class DeepSeekLLM:
         self.model_name = model_name
         self.temperature = 0.1  # 降低温度，使模型更倾向于使用工具
         self.max_tokens = 2048
-        self.client = AsyncOpenAI(
-            base_url=base_url,
-            api_key=api_key
-        )
     
     async def call_with_tools(self, messages, tools, tool_choice="auto"):
         """
@@ -50,74 +51,50 @@ class DeepSeekLLM:
         """
         try:
             print(f"发送API请求...")
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                tools=tools,
-                tool_choice=tool_choice
+            payload = {
+                "model": self.model_name,
+                "messages": messages,
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+                "tools": tools,
+                "tool_choice": tool_choice
+            }
+            # 使用共享的异步连接池，响应本身就是OpenAI兼容的字典格式
+            response_dict = await llm_client.achat_completion(
+                payload, base_url=self.base_url, api_key=self.api_key
             )
             
-            # 将OpenAI客户端响应转换为字典格式
-            response_dict = {
-                "choices": [{
-                    "message": {
-                        "content": response.choices[0].message.content,
-                        "role": response.choices[0].message.role,
-                        "tool_calls": []
-                    },
-                    "finish_reason": response.choices[0].finish_reason,
-                    "index": response.choices[0].index
-                }],
-                "created": response.created,
-                "id": response.id,
-                "model": response.model,
-                "object": response.object,
-                "usage": {
-                    "completion_tokens": response.usage.completion_tokens,
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-            }
-            
-            # 处理工具调用
-            if hasattr(response.choices[0].message, 'tool_calls') and response.choices[0].message.tool_calls:
-                tool_calls = []
-                for tool_call in response.choices[0].message.tool_calls:
-                    tool_calls.append({
-                        "id": tool_call.id,
-                        "type": tool_call.type,
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments
-                        }
-                    })
-                response_dict["choices"][0]["message"]["tool_calls"] = tool_calls
+            # 统一tool_calls字段：没有工具调用时为空列表
+            for choice in response_dict.get("choices", []):
+                message = choice.setdefault("message", {})
+                if not message.get("tool_calls"):
+                    message["tool_calls"] = []
             
             return response_dict
         except Exception as e:
             print(f"API调用失败: {str(e)}")
             raise
+    
+    async def close(self):
+        """关闭当前事件循环中的共享HTTP客户端"""
+        await llm_client.aclose_clients()
 
 # 定义计算工具函数
 def add(a: float, b: float) -> float:
-    """加法运算"""
-    return float(a) + float(b)
+    """加法运算（十进制精确计算）"""
+    return calculator_tools.add(a, b)
 
 def subtract(a: float, b: float) -> float:
-    """减法运算"""
-    return float(a) - float(b)
+    """减法运算（十进制精确计算）"""
+    return calculator_tools.subtract(a, b)
 
 def multiply(a: float, b: float) -> float:
-    """乘法运算"""
-    return float(a) * float(b)
+    """乘法运算（十进制精确计算）"""
+    return calculator_tools.multiply(a, b)
 
 def divide(a: float, b: float) -> float:
-    """除法运算"""
-    if float(b) == 0:
-        raise ValueError("除数不能为零")
-    return float(a) / float(b)
+    """除法运算（十进制精确计算）"""
+    return calculator_tools.divide(a, b)
 
 # 定义要提供给LLM的工具
 CALCULATOR_TOOLS = [
@@ -181,7 +158,56 @@ CALCULATOR_TOOLS = [
             }
         }
     }
-]
+] + calculator_tools.AGGREGATE_TOOLS
+
+# 计划模式的工具：一次提交全部计算步骤
+PLAN_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_plan",
+        "description": "一次性提交完整的计算计划，由计算器在本地按顺序执行。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "steps": {
+                    "type": "array",
+                    "description": "按顺序执行的计算步骤，编号从1开始",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "tool": {"type": "string", "enum": ["add", "subtract", "multiply", "divide"],
+                                     "description": "使用的计算工具"},
+                            "a": {"type": ["number", "string"],
+                                  "description": "第一个操作数：数值，或引用前面步骤结果的 \"#步骤编号\"，如 \"#1\""},
+                            "b": {"type": ["number", "string"],
+                                  "description": "第二个操作数：数值，或引用前面步骤结果的 \"#步骤编号\""}
+                        },
+                        "required": ["tool", "a", "b"]
+                    }
+                },
+                "expression": {"type": "string",
+                               "description": "不提供steps时，可直接给出只含数值和 + - * / 括号的完整算式"},
+                "result": {"type": "string", "description": "作为最终结果的步骤引用，如 \"#3\"，省略时取最后一步"}
+            }
+        }
+    }
+}
+
+# 计算模式：plan 一次返回完整计划后本地执行；tools 每步一次LLM往返
+CALC_MODES = ("plan", "tools")
+CALC_MODE = "plan"
+
+# 计划模式的系统消息
+PLAN_SYSTEM_PROMPT = """你是一个专业的财务计算助手。你不自己计算，而是制定计算计划，由计算器执行。
+请只调用一次 submit_plan，一次性给出完成整个计算所需的全部步骤：
+1. 每个步骤使用 add、subtract、multiply、divide 之一，操作数为题目中的数值，或用 "#步骤编号" 引用前面步骤的结果。
+2. 多项求和时依次累加，例如 a+b+c：步骤1 add(a, b)，步骤2 add("#1", c)。
+3. 公式较长时也可以不写steps，直接在 expression 中给出代入数值后的完整算式，如 "(381236.73+257026.09)/2"。
+4. 数值必须完整照抄，保留负号和全部小数位。
+
+示例："年平均应付账款=([应付账款]+[应付账款_T-1])/2"，应付账款是8000，应付账款_T-1是7000：
+steps = [{"tool": "add", "a": 8000, "b": 7000}, {"tool": "divide", "a": "#1", "b": 2}]
+"""
 
 # 定义系统消息，强调多步骤计算和函数调用链
 SYSTEM_PROMPT = """你是一个专业的财务计算助手，擅长处理会计和财务领域的计算任务。
@@ -191,8 +217,10 @@ SYSTEM_PROMPT = """你是一个专业的财务计算助手，擅长处理会计
 2. 对于多步骤计算，你会分解问题并按顺序调用多个函数。
 3. 当涉及诸如"(a+b)/2"这样的复合公式时，你会先调用add(a,b)，然后用结果调用divide(结果,2)。
 4. 面对财务变动额计算时，通常使用subtract(当期值, 上期值)公式。
-5. 计算平均值时，先使用add计算总和，再使用divide计算平均值。
+5. 计算平均值时，先使用add计算总和，再使用divide计算平均值；也可以直接调用average。
 6. 最重要的是，你必须返回计算的完整结果，不要省略整数部分或负号。
+7. 多项合计（如十几项明细相加的小计）请用一次 sum 或 weighted_sum（相减的项权重取-1）完成，
+   复杂公式可以用 evaluate 一次算出整条表达式，不要逐项调用 add。
 
 示例思路：
 - 对于"(381236.73+257026.09)/2"计算：
@@ -220,14 +248,15 @@ SYSTEM_PROMPT = """你是一个专业的财务计算助手，擅长处理会计
 class FinancialCalculator:
     """财务计算代理，使用DeepSeek模型进行多步骤计算"""
     
-    def __init__(self):
-        """初始化计算代理"""
+    def __init__(self, mode=CALC_MODE):
+        """
+        初始化计算代理
+        参数:
+            mode: 计算模式，"plan" 一次往返提交完整计划；"tools" 逐步工具调用
+        """
         # 加载API配置
-        api_keys = load_api_keys()
-        volcano_config = api_keys.get("volcano_engine", {})
-        
-        self.api_key = volcano_config.get("api_key")
-        self.base_url = volcano_config.get("base_url")
+        # 可通过环境变量 LLM_BASE_URL/LLM_API_KEY 指向本地模拟服务（src/mock_llm_server.py）
+        self.api_key, self.base_url = llm_client.load_llm_config()
         
         if not self.api_key or not self.base_url:
             raise ValueError("无法获取API密钥配置")
@@ -235,6 +264,10 @@ class FinancialCalculator:
         # 初始化DeepSeek LLM
         self.llm = DeepSeekLLM(self.api_key, self.base_url)
         
+        if mode not in CALC_MODES:
+            raise ValueError(f"未知的计算模式: {mode}")
+        self.mode = mode
+        
         # 创建工具映射
         self.tools_map = {
             "add": add,
@@ -242,6 +275,7 @@ class FinancialCalculator:
             "multiply": multiply,
             "divide": divide
         }
+        self.tools_map.update(calculator_tools.TOOL_FUNCTIONS)
     
     async def execute_tool(self, name, args):
         """执行工具函数"""
@@ -254,6 +288,120 @@ class FinancialCalculator:
         except Exception as e:
             return {"status": "error", "error": str(e)}
     
+    async def run(self, question):
+        """按计算模式运行计算代理"""
+        if self.mode == "plan":
+            return await self.run_calc_with_plan(question)
+        return await self.run_calc_with_tools(question)
+    
+    @staticmethod
+    def _resolve_operand(value, results):
+        """解析计划中的操作数：数值或 "#步骤编号" 引用"""
+        if isinstance(value, str):
+            text = value.strip()
+            if text.startswith("#"):
+                index = int(text[1:])
+                if index not in results:
+                    raise ValueError(f"引用了不存在或尚未执行的步骤: {text}")
+                return results[index]
+            return float(text.replace(",", ""))
+        return float(value)
+    
+    async def execute_plan(self, plan):
+        """
+        在本地执行计算计划
+        参数:
+            plan: submit_plan 的参数字典（steps 或 expression，可选 result）
+        返回:
+            (计算步骤列表, 最终结果)；计划无效时抛出 ValueError
+        """
+        steps = plan.get("steps") or []
+        if not steps:
+            expression = plan.get("expression")
+            if not expression:
+                raise ValueError("计划中既没有steps也没有expression")
+            try:
+                compiled = compile_formula(expression)
+                if compiled.variables:
+                    raise ValueError(f"表达式中含有未代入的变量: {', '.join(compiled.variables)}")
+                value = compiled.evaluate({})
+            except FormulaError as e:
+                raise ValueError(f"表达式无法计算: {str(e)}")
+            step_info = {
+                "step": 1,
+                "tool": "evaluate",
+                "arguments": {"expression": expression},
+                "result": {"status": "success", "result": value}
+            }
+            return [step_info], value
+        
+        results = {}
+        calculation_steps = []
+        for index, step in enumerate(steps, 1):
+            name = step.get("tool")
+            arguments = {
+                "a": self._resolve_operand(step.get("a"), results),
+                "b": self._resolve_operand(step.get("b"), results)
+            }
+            tool_result = await self.execute_tool(name, arguments)
+            calculation_steps.append({
+                "step": index,
+                "tool": name,
+                "arguments": {"a": step.get("a"), "b": step.get("b")},
+                "result": tool_result
+            })
+            if tool_result["status"] != "success":
+                raise ValueError(f"步骤 {index} 执行失败: {tool_result['error']}")
+            results[index] = tool_result["result"]
+        
+        final_ref = plan.get("result")
+        final_result = self._resolve_operand(final_ref, results) if final_ref else results[len(steps)]
+        return calculation_steps, final_result
+    
+    async def run_calc_with_plan(self, question):
+        """
+        计划模式：一次LLM调用取得完整计算计划，本地执行全部步骤
+        计划无效时退回逐步工具调用
+        参数:
+            question: 用户问题
+        返回:
+            计算结果
+        """
+        messages = [
+            {"role": "system", "content": PLAN_SYSTEM_PROMPT},
+            {"role": "user", "content": question}
+        ]
+        response = await self.llm.call_with_tools(
+            messages, [PLAN_TOOL],
+            tool_choice={"type": "function", "function": {"name": "submit_plan"}}
+        )
+        
+        try:
+            tool_calls = response["choices"][0]["message"]["tool_calls"]
+            calculation_steps = []
+            final_result = None
+            # 模型可能把计划拆成多个并行的 submit_plan 调用，逐个执行，取最后一个的结果
+            for tool_call in tool_calls:
+                if tool_call["function"]["name"] != "submit_plan":
+                    continue
+                plan = json.loads(tool_call["function"]["arguments"])
+                print(f"收到计算计划: {plan}")
+                steps, final_result = await self.execute_plan(plan)
+                for step_info in steps:
+                    step_info["step"] = len(calculation_steps) + 1
+                    calculation_steps.append(step_info)
+            if not calculation_steps:
+                raise ValueError("响应中没有 submit_plan 调用")
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            print(f"计算计划无效（{str(e)}），改为逐步工具调用")
+            return await self.run_calc_with_tools(question)
+        
+        return {
+            "question": question,
+            "steps": calculation_steps,
+            "final_result": final_result
+        }
+    
     async def run_calc_with_tools(self, question, max_steps=5):
         """
         运行计算代理，支持多步骤工具调用
@@ -303,37 +451,37 @@ class FinancialCalculator:
                             print(f"无法将 {numbers[-1]} 转换为数字")
                     break
                 
-                # 处理工具调用
+                # 处理工具调用：同一响应中的多个（并行）工具调用全部执行
                 if tool_calls:
-                    tool_call = tool_calls[0]  # 获取第一个工具调用
-                    function_name = tool_call["function"]["name"]
-                    arguments = json.loads(tool_call["function"]["arguments"])
-                    
-                    print(f"调用工具: {function_name}({arguments})")
-                    
-                    # 执行工具调用
-                    tool_result = await self.execute_tool(function_name, arguments)
-                    
-                    # 记录计算步骤
-                    step_info = {
-                        "step": step + 1,
-                        "tool": function_name,
-                        "arguments": arguments,
-                        "result": tool_result
-                    }
-                    calculation_steps.append(step_info)
-                    
-                    # 将工具调用结果添加到消息历史
                     messages.append({
                         "role": "assistant",
                         "content": None,
-                        "tool_calls": [tool_call]
-                    })
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call["id"],
-                        "content": json.dumps(tool_result)
+                        "tool_calls": tool_calls
                     })
+                    for tool_call in tool_calls:
+                        function_name = tool_call["function"]["name"]
+                        arguments = json.loads(tool_call["function"]["arguments"])
+                        
+                        print(f"调用工具: {function_name}({arguments})")
+                        
+                        # 执行工具调用
+                        tool_result = await self.execute_tool(function_name, arguments)
+                        
+                        # 记录计算步骤
+                        step_info = {
+                            "step": len(calculation_steps) + 1,
+                            "tool": function_name,
+                            "arguments": arguments,
+                            "result": tool_result
+                        }
+                        calculation_steps.append(step_info)
+                        
+                        # 将工具调用结果添加到消息历史
+                        messages.append({
+                            "role": "tool",
+                            "tool_call_id": tool_call["id"],
+                            "content": json.dumps(tool_result)
+                        })
                     
                     # 如果这是最后一步，保存最终结果
                     if step == max_steps - 1 or "finish_reason" in choice and choice["finish_reason"] != "tool_calls":
@@ -383,29 +531,15 @@ async def process_formula_file(calculator, formula_file):
         print(f"问题: {question}")
         
         # 获取计算结果
-        calculation_result = await calculator.run_calc_with_tools(question)
+        calculation_result = await calculator.run(question)
         
         # 获取预期结果（用于比较）
+        # 编译公式（按文本缓存）后直接对变量求值，末尾说明文字由编译器去除
         expected_result = None
-        if "(" in original_formula and ")" in original_formula:
-            # 处理复杂公式
-            expr = original_formula
-            for var_name, var_value in variables.items():
-                placeholder = f"[{var_name}]"
-                if placeholder in expr:
-                    expr = expr.replace(placeholder, str(var_value))
-            
-            # 清理公式（移除注释等）
-            expr = re.sub(r'(/\d+)\(.*?\)', r'\1', expr)
-            
-            # 安全计算表达式
-            expected_result = eval(expr, {"__builtins__": {}})
-        else:
-            # 处理简单公式
-            if "-" in original_formula:
-                var_names = re.findall(r'\[(.*?)\]', original_formula)
-                if len(var_names) >= 2 and var_names[0] in variables and var_names[1] in variables:
-                    expected_result = variables[var_names[0]] - variables[var_names[1]]
+        try:
+            expected_result = compile_formula(original_formula).evaluate(variables)
+        except FormulaError as e:
+            print(f"无法计算预期结果: {str(e)}")
         
         # 判断结果是否正确
         is_correct = False
@@ -451,13 +585,17 @@ async def process_all_formulas(formulas_dir):
     
     print(f"找到 {len(formula_files)} 个公式文件，开始处理...")
     
-    # 创建处理任务
-    tasks = [process_formula_file(calculator, f) for f in formula_files]
-    
-    # 等待所有任务完成
-    results = await asyncio.gather(*tasks)
-    
-    return results
+    try:
+        # 创建处理任务
+        tasks = [process_formula_file(calculator, f) for f in formula_files]
+        
+        # 等待所有任务完成
+        results = await asyncio.gather(*tasks)
+        
+        return results
+    finally:
+        # 确保客户端关闭
+        await calculator.llm.close()
 
 def format_results(results):
     """格式化结果为可读的输出"""
@@ -8,6 +8,7 @@
 
 import json
 import os
+import sys
 import glob
 import re
 import asyncio
@@ -15,31 +16,34 @@ import time
 from typing import List, Dict, Any, Tuple, Optional
 import httpx
 
+# 公式编译器等公共模块位于 src/ 目录
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from formula_compiler import (compile_formula, strip_annotations, FormulaError,
+                              PRIOR_FALLBACK_PATTERN, PRIOR_SUFFIX)
+import llm_client
+import calculator_tools
+
 # 加载API密钥
 def load_api_keys():
     """加载API密钥配置"""
-    api_keys_path = "/home/super/linchen/000000-api-keys/api_keys.json"
-    with open(api_keys_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return llm_client.load_api_keys()
 
 # 定义四个基础运算函数
 def add(a, b):
-    """加法运算"""
-    return float(a) + float(b)
+    """加法运算（十进制精确计算）"""
+    return calculator_tools.add(a, b)
 
 def subtract(a, b):
-    """减法运算"""
-    return float(a) - float(b)
+    """减法运算（十进制精确计算）"""
+    return calculator_tools.subtract(a, b)
 
 def multiply(a, b):
-    """乘法运算"""
-    return float(a) * float(b)
+    """乘法运算（十进制精确计算）"""
+    return calculator_tools.multiply(a, b)
 
 def divide(a, b):
-    """除法运算"""
-    if float(b) == 0:
-        raise ValueError("除数不能为零")
-    return float(a) / float(b)
+    """除法运算（十进制精确计算）"""
+    return calculator_tools.divide(a, b)
 
 # 执行函数调用的处理器
 def function_call_handler(function_name, args):
@@ -58,6 +62,10 @@ def function_call_handler(function_name, args):
         "divide": divide
     }
     
+    # 聚合工具（sum、average、evaluate 等）的参数为字典
+    if function_name in calculator_tools.TOOL_FUNCTIONS:
+        return calculator_tools.call_tool(function_name, args)
+    
     if function_name not in functions:
         raise ValueError(f"未知的函数: {function_name}")
     
@@ -77,6 +85,26 @@ def clean_formula(formula):
     # 如果还有其他注释形式，可以继续添加清理规则
     return formula
 
+def apply_prior_fallback_values(formula, variables):
+    """
+    按公式的上期回退规则 "(若无T-1数据，T-1年取T年值)" 补全变量：缺少 X_T-1 时取 X 的值
+    参数:
+        formula: 原始公式
+        variables: 变量字典（键不带中括号）
+    返回:
+        补全后的变量字典（没有回退规则时原样返回）
+    """
+    annotation = strip_annotations(formula)[1]
+    if annotation is None or not PRIOR_FALLBACK_PATTERN.search(annotation):
+        return variables
+    filled = dict(variables)
+    for name in re.findall(r'\[([^\[\]]+)\]', formula):
+        if name.endswith(PRIOR_SUFFIX) and filled.get(name) in (None, ''):
+            current = filled.get(name[:-len(PRIOR_SUFFIX)])
+            if current not in (None, ''):
+                filled[name] = current
+    return filled
+
 def evaluate_expression(expr):
     """
     安全地计算数学表达式
@@ -85,14 +113,13 @@ def evaluate_expression(expr):
     返回:
         计算结果
     """
-    # 使用正则表达式确保表达式只包含数字、运算符和括号
-    if not re.match(r'^[\d\s\+\-\*\/\(\)\.]+$', expr):
-        raise ValueError(f"不安全的表达式: {expr}")
-    
-    # 安全地计算表达式
+    # 使用公式编译器解析表达式（只接受数字、运算符和括号，不再经过eval）
     try:
-        return eval(expr, {"__builtins__": {}})
-    except Exception as e:
+        compiled = compile_formula(expr)
+        if compiled.variables:
+            raise ValueError(f"不安全的表达式: {expr}")
+        return compiled({})
+    except FormulaError as e:
         raise ValueError(f"表达式计算错误: {expr}, 错误: {str(e)}")
 
 def parse_formula(formula, variables):
@@ -107,7 +134,8 @@ def parse_formula(formula, variables):
         expression: 完整表达式
         calculation_steps: 计算步骤描述
     """
-    # 清理公式
+    # 清理公式（上期回退规则先用于补全变量，再随说明文字一起去掉）
+    variables = apply_prior_fallback_values(formula, variables)
     cleaned_formula = clean_formula(formula)
     
     # 替换所有变量
@@ -184,7 +212,6 @@ class DeepSeekLLM:
         self.model_name = model_name
         self.temperature = 0.1  # 降低温度，使模型更倾向于使用工具
         self.max_tokens = 2048
-        self.client = httpx.AsyncClient(timeout=60.0)  # 使用异步HTTP客户端
     
     async def call_function(self, question: str, calculator_functions: List[Dict]) -> Dict:
         """
@@ -195,13 +222,6 @@ class DeepSeekLLM:
         返回:
             模型响应，包含函数调用信息
         """
-        url = f"{self.base_url}/chat/completions"
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         # 构建工具列表（按照火山引擎文档格式）
         tools = []
         for func in calculator_functions:
@@ -220,8 +240,14 @@ class DeepSeekLLM:
 - subtract(a, b): 计算a - b
 - multiply(a, b): 计算a * b
 - divide(a, b): 计算a / b，b不能为0
+- sum(values): 多项求和
+- weighted_sum(values, weights): 加权求和，相减的项权重取-1
+- average(values): 求平均值
+- ratio(numerator, denominator): 计算比率
+- delta(current, prior): 计算变动额 current - prior
+- evaluate(expression, variables): 计算整条表达式
 
-用户将提供计算问题，请分析公式并选择合适的函数进行计算。"""
+用户将提供计算问题，请分析公式并选择合适的函数进行计算。多项合计的公式请用一次 sum、weighted_sum 或 evaluate 调用完成。"""
         
         # 构建请求体
         payload = {
@@ -238,14 +264,13 @@ class DeepSeekLLM:
         
         try:
             print(f"发送函数调用请求: {question}")
-            print(f"API调用: {url}")
-            print(f"请求头: {headers}")
+            print(f"API调用: {self.base_url}/chat/completions")
             print(f"请求体: {json.dumps(payload, ensure_ascii=False, indent=2)}")
             
-            response = await self.client.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            
-            response_data = response.json()
+            # 使用共享的异步连接池
+            response_data = await llm_client.achat_completion(
+                payload, base_url=self.base_url, api_key=self.api_key
+            )
             print(f"API响应: {json.dumps(response_data, ensure_ascii=False, indent=2)}")
             
             return response_data
@@ -257,8 +282,8 @@ class DeepSeekLLM:
             raise
     
     async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
+        """关闭当前事件循环中的共享HTTP客户端"""
+        await llm_client.aclose_clients()
 
 # 定义我们要提供给LLM的函数
 CALCULATOR_FUNCTIONS = [
@@ -310,7 +335,7 @@ CALCULATOR_FUNCTIONS = [
             "required": ["a", "b"]
         }
     }
-]
+] + calculator_tools.AGGREGATE_FUNCTIONS
 
 async def process_formula_with_llm(llm: DeepSeekLLM, formula_file: str) -> Dict:
     """
@@ -359,15 +384,16 @@ async def process_formula_with_llm(llm: DeepSeekLLM, formula_file: str) -> Dict:
                         args = {"error": "无法解析参数JSON"}
                     
                     # 计算结果
-                    if function_name in ["add", "subtract", "multiply", "divide"]:
-                        # 处理常规函数调用
-                        result = function_call_handler(function_name, [float(args["a"]), float(args["b"])])
-                        
-                        # 计算预期结果（以供比较）
-                        if expected_function_name == "complex":
-                            expected_result = evaluate_expression(expression)
+                    if function_name in ["add", "subtract", "multiply", "divide"] or function_name in calculator_tools.TOOL_FUNCTIONS:
+                        if function_name in calculator_tools.TOOL_FUNCTIONS:
+                            # 聚合工具一次完成整条公式
+                            result = function_call_handler(function_name, args)
                         else:
-                            expected_result = function_call_handler(expected_function_name, expected_args)
+                            # 处理常规函数调用
+                            result = function_call_handler(function_name, [float(args["a"]), float(args["b"])])
+                        
+                        # 计算预期结果（以供比较）：直接对编译后的公式求值
+                        expected_result = compile_formula(original_formula).evaluate(all_variables)
                         
                         # 比较结果
                         is_correct = abs(result - expected_result) < 1e-6
@@ -412,11 +438,8 @@ async def process_formula_with_llm(llm: DeepSeekLLM, formula_file: str) -> Dict:
                     if numbers:
                         extracted_result = float(numbers[-1])  # 使用最后一个数字作为结果
                     
-                    # 计算预期结果（以供比较）
-                    if expected_function_name == "complex":
-                        expected_result = evaluate_expression(expression)
-                    else:
-                        expected_result = function_call_handler(expected_function_name, expected_args)
+                    # 计算预期结果（以供比较）：直接对编译后的公式求值
+                    expected_result = compile_formula(original_formula).evaluate(all_variables)
                     
                     # 判断提取的结果是否与预期接近
                     is_correct = False
@@ -471,11 +494,8 @@ async def process_all_formulas(formulas_dir: str) -> List[Dict]:
         所有处理结果的列表
     """
     # 加载API配置
-    api_keys = load_api_keys()
-    volcano_config = api_keys.get("volcano_engine", {})
-    
-    api_key = volcano_config.get("api_key")
-    base_url = volcano_config.get("base_url")
+    # 可通过环境变量 LLM_BASE_URL/LLM_API_KEY 指向本地模拟服务（src/mock_llm_server.py）
+    api_key, base_url = llm_client.load_llm_config()
     
     if not api_key or not base_url:
         raise ValueError("无法从API密钥文件获取火山引擎配置")
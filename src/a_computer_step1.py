@@ -10,6 +10,20 @@ import os
 import shutil
 import sys
 
+def load_element(original_json_path='/home/super/linchen/250418-accountant-agent/input.json'):
+    """
+    读取原始元素JSON
+    参数:
+        original_json_path: 原始input.json路径
+    返回:
+        元素字典
+    """
+    with open(original_json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    
+    print("A计算机：从原始JSON读取内容完成")
+    return data
+
 def a_step1():
     """
     A计算机初始化步骤：
@@ -19,14 +33,9 @@ def a_step1():
     # 确保exp目录存在
     os.makedirs('/home/super/linchen/250418-accountant-agent/exp', exist_ok=True)
     
-    # 从原始input.json读取内容
-    original_json_path = '/home/super/linchen/250418-accountant-agent/input.json'
-    
     try:
-        with open(original_json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        print("A计算机：从原始JSON读取内容完成")
+        # 从原始input.json读取内容
+        data = load_element()
         
         # 将数据写入exp目录下的input.json
         exp_input_json_path = '/home/super/linchen/250418-accountant-agent/exp/input.json'
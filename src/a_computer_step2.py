@@ -8,8 +8,27 @@ A计算机第二步：解析B发来的JSON，提取公式变量并注入测试
 
 import json
 import os
-import re
 import sys
+from functools import lru_cache
+
+from formula_compiler import compile_formula, strip_key, FormulaError, COMPILE_CACHE_SIZE
+from formula_catalog import BRACKET_VARIABLE_PATTERN
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def formula_variable_keys(formula):
+    """
+    公式中的变量键（按出现顺序去重），按公式文本缓存，同一公式只解析一次
+    参数:
+        formula: 计算公式字符串
+    返回:
+        变量键元组，中括号变量保留中括号，如 ("[货币资金]", "[其他应收款-应收利息]")
+    """
+    try:
+        names = compile_formula(formula).variables
+    except FormulaError:
+        # 无法解析的公式（如含文字说明）只取中括号变量
+        return tuple(f"[{name}]" for name in dict.fromkeys(BRACKET_VARIABLE_PATTERN.findall(formula)))
+    return tuple(f"[{name}]" if f"[{name}]" in formula else name for name in names)
 
 def extract_variables(formula):
     """
@@ -17,15 +36,9 @@ def extract_variables(formula):
     参数:
         formula: 计算公式字符串
     返回:
-        变量名列表
+        变量名列表（去重，中括号变量整体保留，不会在 "-" 处被拆开）
     """
-    # 简单的变量提取逻辑，可以根据实际公式格式调整
-    # 这里假设变量没有嵌套在中括号内的复杂结构
-    variables = re.findall(r'([^-+*/(),\s]+)', formula)
-    # 过滤掉可能的数字和操作符
-    variables = [var for var in variables if not var.replace('.', '', 1).isdigit() 
-                and var not in ['', '-', '+', '*', '/', '(', ')', ',']]
-    return variables
+    return list(formula_variable_keys(formula))
 
 def check_empty_variables(variables_dict):
     """
@@ -42,6 +55,134 @@ def check_empty_variables(variables_dict):
     
     return len(empty_variables) > 0, empty_variables
 
+def _test_data(compute_formula, variables):
+    """生成测试数据（未指定数据源时使用）"""
+    test_data = {}
+    # 使 test_data 与公式变量一一对应，全部赋值为 1
+    if compute_formula == "([货币资金]+[结算备付金]+[拆出资金]+[交易性金融资产]+[衍生金融资产]+[应收票据]+[应收账款]+[应收款项融资]+[预付款项]+[应收保费]+[应收分保账款]+[应收分保合同准备金]+[其他应收款]+[其他应收款-应收利息]+[其他应收款-应收股利]+[买入返售金融资产]+[存货]+[合同资产]+[持有待售资产]+[一年内到期的非流动资产]+[其他流动资产])-[其他应收款-应收利息]-[其他应收款-应收股利]":
+        for var in variables:
+            test_data[var] = 1
+    else:
+        # 为其他公式生成随机测试数据
+        for var in variables:
+            test_data[var] = "0.01"  # 示例值，实际应根据业务逻辑设置
+    return test_data
+
+def _source_values(variables, values):
+    """按变量键从数据源结果中取值，数据源中没有的变量记为空字符串"""
+    test_data = {}
+    for var in variables:
+        value = values.get(strip_key(var))
+        test_data[var] = "" if value is None else value
+    return test_data
+
+def required_empty_variables(formula, test_data, empty_vars):
+    """
+    空值变量中确实无法计算的部分：coalesce（如上期回退规则）中有可用参数时，其余参数为空不影响计算
+    参数:
+        formula: 计算公式
+        test_data: 注入的变量字典
+        empty_vars: 值为空的变量键
+    返回:
+        无法计算所缺的变量键列表
+    """
+    try:
+        compiled = compile_formula(formula)
+    except FormulaError:
+        return empty_vars
+    empty = set(empty_vars)
+    present = {strip_key(key) for key in test_data if key not in empty}
+    missing = set(compiled.missing_variables(present))
+    return [key for key in empty_vars if strip_key(key) in missing]
+
+def _apply_values(data, test_data, source=None):
+    """把变量值写入元素并检查空值"""
+    # 检查是否有变量值为空（可由回退规则替代的空值不算）
+    has_empty_vars, empty_vars = check_empty_variables(test_data)
+    if has_empty_vars:
+        formula = data['element_fill_source'].get('compute_formula', '')
+        empty_vars = required_empty_variables(formula, test_data, empty_vars)
+        has_empty_vars = len(empty_vars) > 0
+    data['element_fill_source']['data_source_list'][0]['content'] = test_data
+    if source is not None:
+        data['element_fill_source']['data_source_list'][0]['source'] = source
+    if has_empty_vars:
+        empty_vars_str = ", ".join([f"{var}" for var in empty_vars])
+        print(f"A计算机：检测到空值变量: {empty_vars_str}")
+        print(f"缺少{{ {empty_vars_str} }}无法计算结果")
+    else:
+        print(f"A计算机：已注入数据: {test_data}")
+    return empty_vars
+
+def inject_variables(data, data_source=None, period=None):
+    """
+    解析元素的compute_formula，提取变量并注入数据
+    参数:
+        data: 元素字典
+        data_source: data_sources.DataSource，省略时注入测试数据
+        period: 报告期，省略时使用数据源的默认期间
+    返回:
+        (dict, list): 更新后的元素字典和空值变量列表
+    """
+    # 获取计算公式
+    compute_formula = data.get('element_fill_source', {}).get('compute_formula', '')
+    print(f"A计算机：收到计算公式 '{compute_formula}'，正在解析变量...")
+    
+    empty_vars = []
+    if compute_formula:
+        # 提取公式中的变量
+        variables = extract_variables(compute_formula)
+        print(f"A计算机：提取的变量: {variables}")
+        
+        if data_source is None:
+            empty_vars = _apply_values(data, _test_data(compute_formula, variables))
+        else:
+            values = data_source.fetch(variables, data.get('entname') or None, period)
+            empty_vars = _apply_values(data, _source_values(variables, values), data_source.name)
+    
+    return data, empty_vars
+
+def inject_variables_batch(elements, data_source, period=None):
+    """
+    为一批元素注入数据：全部元素的变量去重后，每个公司只查询一次数据源（本期与上期同一次取回）
+    参数:
+        elements: 元素字典列表（已由B计算机填入compute_formula）
+        data_source: data_sources.DataSource
+        period: 报告期，省略时使用数据源的默认期间
+    返回:
+        [(元素字典, 空值变量列表或异常)]，顺序与 elements 相同；某个公司查询失败时，该公司的元素对应该异常
+    """
+    # 按公司汇总所需变量，保持首次出现的顺序
+    plans = []
+    names_by_company = {}
+    for data in elements:
+        compute_formula = data.get('element_fill_source', {}).get('compute_formula', '')
+        variables = list(formula_variable_keys(compute_formula)) if compute_formula else []
+        company = data.get('entname') or None
+        names_by_company.setdefault(company, {}).update(dict.fromkeys(variables))
+        plans.append((data, variables, company))
+    
+    fetched = {}
+    for company, names in names_by_company.items():
+        try:
+            fetched[company] = data_source.fetch(list(names), company, period)
+        except Exception as e:
+            # 一个公司查询失败（如缺少公司、期间无法识别）只影响该公司的元素
+            print(f"A计算机：查询数据源失败（公司 {company}）: {str(e)}")
+            fetched[company] = e
+    print(f"A计算机：{len(elements)} 个元素共需 "
+          f"{sum(len(names) for names in names_by_company.values())} 个变量，查询数据源 {len(fetched)} 次")
+    
+    results = []
+    for data, variables, company in plans:
+        empty_vars = []
+        if isinstance(fetched[company], Exception):
+            empty_vars = fetched[company]
+        elif variables:
+            empty_vars = _apply_values(data, _source_values(variables, fetched[company]), data_source.name)
+        results.append((data, empty_vars))
+    return results
+
 def a_step2():
     """
     A计算机第二步处理:
@@ -59,38 +200,7 @@ def a_step2():
         with open(b1_json_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        # 获取计算公式
-        compute_formula = data.get('element_fill_source', {}).get('compute_formula', '')
-        print(f"A计算机：收到计算公式 '{compute_formula}'，正在解析变量...")
-        
-        if compute_formula:
-            # 提取公式中的变量
-            variables = extract_variables(compute_formula)
-            print(f"A计算机：提取的变量: {variables}")
-            
-            # 生成测试数据（在实际系统中，这些数据可能来自数据库或用户输入）
-            test_data = {}
-            # 使 test_data 与公式变量一一对应，全部赋值为 1
-            if compute_formula == "([货币资金]+[结算备付金]+[拆出资金]+[交易性金融资产]+[衍生金融资产]+[应收票据]+[应收账款]+[应收款项融资]+[预付款项]+[应收保费]+[应收分保账款]+[应收分保合同准备金]+[其他应收款]+[其他应收款-应收利息]+[其他应收款-应收股利]+[买入返售金融资产]+[存货]+[合同资产]+[持有待售资产]+[一年内到期的非流动资产]+[其他流动资产])-[其他应收款-应收利息]-[其他应收款-应收股利]":
-                for var in variables:
-                    test_data[var] = 1
-            else:
-                # 为其他公式生成随机测试数据
-                for var in variables:
-                    test_data[var] = "0.01"  # 示例值，实际应根据业务逻辑设置
-            
-            # 检查是否有变量值为空
-            has_empty_vars, empty_vars = check_empty_variables(test_data)
-            if has_empty_vars:
-                empty_vars_str = ", ".join([f"{var}" for var in empty_vars])
-                print(f"A计算机：检测到空值变量: {empty_vars_str}")
-                print(f"缺少{{ {empty_vars_str} }}无法计算结果")
-                # 仍然更新JSON以便于检查
-                data['element_fill_source']['data_source_list'][0]['content'] = test_data
-            else:
-                # 更新JSON
-                data['element_fill_source']['data_source_list'][0]['content'] = test_data
-                print(f"A计算机：已注入测试数据: {test_data}")
+        data, empty_vars = inject_variables(data)
         
         # 保存为A2.json
         a2_json_path = '/home/super/linchen/250418-accountant-agent/exp/a2.json'
@@ -100,7 +210,7 @@ def a_step2():
         print(f"A计算机：已将更新后的JSON保存到: {a2_json_path}")
         
         # 如果有空值变量，则不发送给B计算机
-        if 'has_empty_vars' in locals() and has_empty_vars:
+        if empty_vars:
             print("A计算机：由于存在空值变量，不发送JSON数据到B计算机")
             return None
         else:
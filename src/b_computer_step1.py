@@ -10,6 +10,48 @@ import os
 import csv
 import sys
 
+from formula_catalog import get_catalog
+
+# 公式目录CSV路径
+CSV_PATH = '/home/super/linchen/250418-accountant-agent/填报说明115之后_公式两列.csv'
+
+def fill_formula(data):
+    """
+    为元素查找公式并写入compute_formula字段
+    参数:
+        data: 元素字典
+    返回:
+        更新后的元素字典
+    """
+    # 提取element_content内容 - 注意JSON结构变更
+    element_content = data.get('element_info', {}).get('element_content', '')
+    print(f"B计算机：收到元素内容 '{element_content}'，正在查找对应公式...")
+    
+    # 在CSV公式目录中查找对应公式（目录常驻内存，CSV修改后自动重新加载）
+    catalog = get_catalog(CSV_PATH)
+    compute_formula = catalog.get_formula(element_content)
+    if compute_formula is not None:
+        print(f"B计算机：在公式目录中找到公式: '{compute_formula}'")
+    else:
+        # 目录中没有该元素时，沿用元素自带的公式
+        compute_formula = data.get('element_fill_source', {}).get('compute_formula', '')
+        print(f"B计算机：公式目录中未找到 '{element_content}'，沿用元素自带公式: '{compute_formula}'")
+    # 初始化element_fill_source字段，如果不存在
+    if 'element_fill_source' not in data:
+        data['element_fill_source'] = {
+            "data_source_list": [
+                {
+                    "content": "",
+                    "source": ""
+                }
+            ],
+            "compute_formula": ""
+        }
+    # 更新JSON中的compute_formula字段
+    data['element_fill_source']['compute_formula'] = compute_formula
+    
+    return data
+
 def b_step1():
     """
     B计算机处理步骤：
@@ -26,28 +68,7 @@ def b_step1():
         with open(input_json_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        # 提取element_content内容 - 注意JSON结构变更
-        element_content = data.get('element_info', {}).get('element_content', '')
-        print(f"B计算机：收到元素内容 '{element_content}'，正在查找对应公式...")
-        
-        # 在CSV中查找对应公式
-        csv_path = '/home/super/linchen/250418-accountant-agent/填报说明115之后_公式两列.csv'
-        # 强制覆盖 compute_formula 为指定公式
-        compute_formula = "([货币资金]+[结算备付金]+[拆出资金]+[交易性金融资产]+[衍生金融资产]+[应收票据]+[应收账款]+[应收款项融资]+[预付款项]+[应收保费]+[应收分保账款]+[应收分保合同准备金]+[其他应收款]+[其他应收款-应收利息]+[其他应收款-应收股利]+[买入返售金融资产]+[存货]+[合同资产]+[持有待售资产]+[一年内到期的非流动资产]+[其他流动资产])-[其他应收款-应收利息]-[其他应收款-应收股利]"
-        print(f"B计算机：强制设置公式: '{compute_formula}'")
-        # 初始化element_fill_source字段，如果不存在
-        if 'element_fill_source' not in data:
-            data['element_fill_source'] = {
-                "data_source_list": [
-                    {
-                        "content": "",
-                        "source": ""
-                    }
-                ],
-                "compute_formula": ""
-            }
-        # 更新JSON中的compute_formula字段
-        data['element_fill_source']['compute_formula'] = compute_formula
+        data = fill_formula(data)
         
         # 保存为B1.json
         b1_json_path = '/home/super/linchen/250418-accountant-agent/exp/b1.json'
@@ -2,36 +2,44 @@
 # -*- coding: utf-8 -*-
 
 """
-B计算机第二步：使用LLM API计算公式结果并写入最终值
+B计算机第二步：计算公式结果并写入最终值
+公式完整且变量齐全时直接用本地公式引擎计算，否则调用LLM API
 """
 
 import json
 import os
 import sys
-import requests
 import time
 import ast
 
-def call_llm_api(formula, variables):
+import llm_client
+from formula_compiler import compile_formula, evaluate_formula, values_array, FormulaError, MissingVariableError
+
+# 计算模式：auto 先用本地公式引擎计算，无法解析或变量映射不明确时才调用LLM
+EVALUATION_MODES = ("auto", "local", "llm")
+EVALUATION_MODE = "auto"
+
+def call_llm_api(formula, variables, base_url=None, api_key=None):
     """
     通用计算器 function call 实现：只暴露一个 evaluate_expression 函数，支持任意表达式计算。
     参数:
         formula: 计算表达式（字符串）
         variables: 变量键值对（dict）
+        base_url: 服务地址，省略时读取API密钥文件
+        api_key: API密钥，省略时读取API密钥文件
     返回:
         计算结果
     """
-    import ast
-    # 读取API密钥
-    try:
-        with open('/home/super/linchen/000000-api-keys/api_keys.json', 'r', encoding='utf-8') as f:
-            api_keys = json.load(f)
-            api_key = api_keys.get('volcano_engine', {}).get('api_key', '')
-            base_url = api_keys.get('volcano_engine', {}).get('base_url', 'https://ark.cn-beijing.volces.com/api/v3')
-    except Exception as e:
-        print(f"读取API密钥出错: {str(e)}")
-        api_key = "6bb3037a-57e8-4b46-9dc2-db53252849e8"
-        base_url = "https://ark.cn-beijing.volces.com/api/v3"
+    # 读取API密钥（读取成功后缓存）
+    if base_url is None or api_key is None:
+        try:
+            config_key, config_url = llm_client.load_llm_config()
+        except Exception as e:
+            print(f"读取API密钥出错: {str(e)}")
+            config_key = "6bb3037a-57e8-4b46-9dc2-db53252849e8"
+            config_url = "https://ark.cn-beijing.volces.com/api/v3"
+        base_url = base_url or config_url
+        api_key = api_key if api_key is not None else config_key
 
     # 通用计算器 function call schema
     tools = [
@@ -60,10 +68,6 @@ def call_llm_api(formula, variables):
     user_prompt = f"表达式: {formula}\n变量: {json.dumps(variables, ensure_ascii=False)}\n请计算结果。"
 
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
         payload = {
             "model": "deepseek-v3-250324",
             "messages": [
@@ -74,11 +78,8 @@ def call_llm_api(formula, variables):
             "tool_choice": {"type": "function", "function": {"name": "evaluate_expression"}},
             "temperature": 0.1
         }
-        response = requests.post(
-            f"{base_url}/chat/completions", headers=headers, data=json.dumps(payload), timeout=60
-        )
-        response.raise_for_status()
-        result = response.json()
+        # 通过共享连接池发送请求，复用keep-alive连接
+        result = llm_client.chat_completion(payload, base_url=base_url, api_key=api_key)
         print("[DEBUG] volcengine API 原始返回：", json.dumps(result, ensure_ascii=False, indent=2))
         # 检查 tool_calls
         tool_calls = None
@@ -97,12 +98,8 @@ def call_llm_api(formula, variables):
                         args = json.loads(arguments)
                         expr = args.get("expression", "")
                         vars_dict = args.get("variables", {})
-                        # 用变量值安全替换表达式变量
-                        expr_eval = expr
-                        for k, v in vars_dict.items():
-                            expr_eval = expr_eval.replace(str(k), str(v))
-                        # 只允许安全表达式
-                        result_value = eval(expr_eval, {"__builtins__": {}})
+                        # 编译表达式（按文本缓存）后直接对变量字典求值，不再替换字符串和eval
+                        result_value = evaluate_formula(expr, vars_dict)
                         return result_value
                     except Exception as e:
                         print(f"本地计算表达式出错: {e}")
@@ -116,12 +113,94 @@ def call_llm_api(formula, variables):
         print(f"调用LLM API出错: {e}")
         return None
 
+def evaluate_locally(formula, variables):
+    """
+    使用本地公式引擎直接计算公式
+    参数:
+        formula: 计算公式
+        variables: 变量键值对（键可带中括号，值可为字符串）
+    返回:
+        (结果, 原因, 是否交给LLM): 能确定性计算时原因为None；
+        公式无法解析或变量映射不明确时结果为None，需要交给LLM处理；
+        变量值不是数值、除数为零等确定性的计算错误结果为None，交给LLM也无法得到结果
+    """
+    try:
+        compiled = compile_formula(formula)
+    except FormulaError as e:
+        return None, f"公式无法解析: {str(e)}", True
+    
+    try:
+        # 变量按驻留ID放入扁平数组，公式按编译时记录的ID取值
+        values = values_array(variables)
+    except ValueError as e:
+        return None, f"变量值不是数值: {str(e)}", False
+    
+    try:
+        # 按配置的算术后端（默认十进制精确计算）求值
+        return compiled.compute_array(values), None, False
+    except MissingVariableError as e:
+        # 公式中的变量必须都能在变量字典中找到，否则视为映射不明确
+        return None, f"变量映射不明确，缺少: {', '.join(e.names)}", True
+    except FormulaError as e:
+        return None, f"本地计算出错: {str(e)}", False
+
+def evaluate_formula_value(formula, variables, mode=EVALUATION_MODE):
+    """
+    按计算模式求公式结果
+    参数:
+        formula: 计算公式
+        variables: 变量键值对
+        mode: "auto" 先本地计算、公式无法解析或变量映射不明确时调用LLM；"local" 只本地计算；"llm" 只调用LLM
+    返回:
+        (结果, 实际使用的计算方式 "local"/"llm")；本地计算出错（如除数为零）时为 (None, "local")
+    """
+    if mode not in EVALUATION_MODES:
+        raise ValueError(f"未知的计算模式: {mode}")
+    
+    if mode != "llm":
+        result, reason, fallback = evaluate_locally(formula, variables)
+        if reason is None:
+            return result, "local"
+        print(f"B计算机：本地计算未完成（{reason}）")
+        if mode == "local" or not fallback:
+            return None, "local"
+        print("B计算机：改为调用LLM API计算")
+    
+    return call_llm_api(formula, variables), "llm"
+
+def compute_result(data, mode=EVALUATION_MODE):
+    """
+    计算元素公式结果并写入element_final_value字段
+    参数:
+        data: 元素字典
+        mode: 计算模式，见 evaluate_formula_value
+    返回:
+        更新后的元素字典
+    """
+    # 获取计算公式和变量
+    compute_formula = data.get('element_fill_source', {}).get('compute_formula', '')
+    variables = data.get('element_fill_source', {}).get('data_source_list', [{}])[0].get('content', {})
+    
+    print(f"B计算机：收到计算公式 '{compute_formula}' 和变量 {variables}")
+    
+    if compute_formula and variables:
+        # 公式完整时本地计算，必要时才调用LLM API
+        result, method = evaluate_formula_value(compute_formula, variables, mode)
+        
+        # 更新JSON的element_final_value字段
+        data['element_final_value'] = result
+        print(f"B计算机：已将计算结果 '{result}' 写入JSON（计算方式: {method}）")
+    else:
+        print("B计算机：未找到计算公式或变量，无法计算")
+    
+    return data
+
 def b_step2():
     """
     B计算机第二步处理：
     1. 读取A2.json
     2. 提取计算公式和变量值
-    3. 调用LLM API计算结果
+    3. 本地计算结果（必要时调用LLM API）
     4. 将结果写入element_final_value
     5. 保存为B2.json并"发送"回A计算机
     """
@@ -132,21 +211,7 @@ def b_step2():
         with open(a2_json_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        # 获取计算公式和变量
-        compute_formula = data.get('element_fill_source', {}).get('compute_formula', '')
-        variables = data.get('element_fill_source', {}).get('data_source_list', [{}])[0].get('content', {})
-        
-        print(f"B计算机：收到计算公式 '{compute_formula}' 和变量 {variables}")
-        
-        if compute_formula and variables:
-            # 调用LLM API计算结果
-            result = call_llm_api(compute_formula, variables)
-            
-            # 更新JSON的element_final_value字段
-            data['element_final_value'] = result
-            print(f"B计算机：已将计算结果 '{result}' 写入JSON")
-        else:
-            print("B计算机：未找到计算公式或变量，无法计算")
+        data = compute_result(data)
         
         # 保存为B2.json
         b2_json_path = '/home/super/linchen/250418-accountant-agent/exp/b2.json'
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+算术后端基准测试：用公式目录中的全部可解析公式和随机金额（两位小数），
+比较 float 与 decimal 后端的单次求值耗时，并统计两者结果不一致（float出现二进制误差）的次数
+"""
+
+import time
+import random
+import argparse
+
+from formula_catalog import get_catalog, DEFAULT_CSV_PATH
+import formula_compiler
+from formula_compiler import FormulaError
+
+def make_samples(catalog, rows, shared=False, seed=0):
+    """
+    为每个公式生成随机变量
+    参数:
+        catalog: FormulaCatalog
+        rows: 样本行数
+        shared: True 时模拟填报报告：每行一份数据，目录中的全部公式共用；
+                False 时每个公式每行单独生成数据（最坏情况，数值从不重复）
+    返回:
+        [(CompiledFormula, env)] 列表
+    """
+    rng = random.Random(seed)
+    compiled = [entry.compiled for entry in catalog if entry.compiled is not None]
+    names = sorted({name for formula in compiled for name in formula.variables})
+    samples = []
+    for _ in range(rows):
+        if shared:
+            env = {name: round(rng.uniform(-1e9, 1e9), 2) for name in names}
+            samples.extend((formula, env) for formula in compiled)
+        else:
+            for formula in compiled:
+                env = {name: round(rng.uniform(-1e9, 1e9), 2) for name in formula.variables}
+                samples.append((formula, env))
+    return samples
+
+def time_backend(samples, backend, repeat):
+    """
+    计时
+    返回:
+        (每次求值的平均微秒数, 结果列表)
+    """
+    results = []
+    best = None
+    for _ in range(repeat):
+        results = []
+        # 每次计时前清空float到Decimal的转换缓存，避免上一轮的结果被复用
+        formula_compiler._float_decimals.clear()
+        started = time.perf_counter()
+        for compiled, env in samples:
+            try:
+                results.append(compiled.compute(env, backend))
+            except FormulaError:
+                results.append(None)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(samples) * 1e6, results
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="比较 float 与 decimal 算术后端")
+    parser.add_argument("--csv", default=DEFAULT_CSV_PATH, help="公式目录CSV路径")
+    parser.add_argument("--rows", type=int, default=200, help="每个公式的随机样本数")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数（取最快一次）")
+    args = parser.parse_args()
+
+    catalog = get_catalog(args.csv)
+    for shared, label in ((False, "每个公式独立数据"), (True, "整份报告共用数据")):
+        samples = make_samples(catalog, args.rows, shared)
+        float_us, float_results = time_backend(samples, "float", args.repeat)
+        decimal_us, decimal_results = time_backend(samples, "decimal", args.repeat)
+
+        # 与十进制结果（已按最短表示转为float）不同，即float累积了二进制误差
+        differ = sum(1 for a, b in zip(float_results, decimal_results) if a is not None and a != b)
+        print(f"== {label}，样本数: {len(samples)}")
+        print(f"float:   {float_us:.2f} 微秒/次, {1e6 / float_us:,.0f} 次/秒")
+        print(f"decimal: {decimal_us:.2f} 微秒/次, {1e6 / decimal_us:,.0f} 次/秒")
+        print(f"decimal/float 耗时比: {decimal_us / float_us:.2f}")
+        print(f"float结果与精确结果不一致: {differ}/{len(samples)}")
+
+if __name__ == "__main__":
+    main()
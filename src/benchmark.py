@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+可重复的回归与基准测试：
+对同一份语料（formula.csv 与 separated_formulas/*.json）依次运行各计算后端
+（local 本地公式引擎、llm 单次LLM调用、adk 多步工具调用代理、mock 指向模拟LLM服务的单次调用），
+未指定 --mock-url 时 mock 后端自动启动内置的模拟服务（mock_llm_server），可离线测量并发与重试开销；
+输出吞吐量、p50/p95/p99延迟、每个公式的LLM往返次数和正确率，结果为JSON，便于在不同提交之间比较
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import asyncio
+import argparse
+import contextlib
+import subprocess
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+import llm_client
+from formula_compiler import compile_formula, FormulaError
+from formula_csv import iter_records, DEFAULT_FORMULA_CSV_PATH
+from b_computer_step2 import call_llm_api
+from mock_llm_server import MockLLMServer
+
+PROJECT_DIR = "/home/super/linchen/250418-accountant-agent"
+DEFAULT_FORMULAS_DIR = os.path.join(PROJECT_DIR, "separated_formulas")
+DEFAULT_OUTPUT_PATH = os.path.join(PROJECT_DIR, "exp", "benchmark.json")
+
+BACKENDS = ("local", "llm", "adk", "mock")
+
+class BenchmarkCase:
+    """语料中的一个计算用例"""
+
+    __slots__ = ("source", "name", "formula", "variables", "expected", "places")
+
+    def __init__(self, source, name, formula, variables, expected, places=None):
+        self.source = source
+        self.name = name
+        self.formula = formula
+        self.variables = variables
+        self.expected = expected
+        # 预期值的小数位数；None表示按相对误差比较
+        self.places = places
+
+    def question(self):
+        """按 adk_calculator/llm_function_call 的方式生成自然语言问题"""
+        variables_text = "".join(f"{name}是{value}，" for name, value in self.variables.items())
+        return (f"{variables_text}为了计算出{self.name}，应该遵守\"formula\": \"{self.formula}\"，"
+                f"请问{self.name}是多少？")
+
+def load_corpus(csv_path=DEFAULT_FORMULA_CSV_PATH, formulas_dir=DEFAULT_FORMULAS_DIR, limit=None):
+    """
+    加载语料
+    参数:
+        csv_path: formula.csv 路径，None表示不使用
+        formulas_dir: separated_formulas 目录，None表示不使用
+        limit: 最多加载的用例数
+    返回:
+        BenchmarkCase 列表
+    """
+    cases = []
+    if formulas_dir:
+        for path in sorted(glob.glob(os.path.join(formulas_dir, "*.json"))):
+            with open(path, 'r', encoding='utf-8') as f:
+                formula_data = json.load(f)
+            name = os.path.splitext(os.path.basename(path))[0]
+            variables = {}
+            formula = ""
+            for data in formula_data.values():
+                formula = data.get("formula", "")
+                for key, value in data.items():
+                    if key not in ("name", "formula", "T"):
+                        variables[key] = value
+            # 这些文件没有预期值：只测量耗时与往返次数，不计入正确率
+            # （用本地引擎的结果作预期值等于让local后端与自己比较）
+            cases.append(BenchmarkCase("separated_formulas", name, formula, variables, None))
+    if csv_path:
+        for record in iter_records(csv_path, numbers="decimal"):
+            exponent = record.expected.as_tuple().exponent if record.expected is not None else 0
+            variables = {name: float(value) for name, value in record.variables.items() if value is not None}
+            cases.append(BenchmarkCase(
+                f"formula.csv:{record.line_no}", record.formula, record.formula, variables,
+                record.expected, -exponent if exponent < 0 else 0
+            ))
+    return cases[:limit] if limit else cases
+
+def is_correct(case, result):
+    """按预期值的精度判断结果是否正确"""
+    if case.expected is None or result is None:
+        return False
+    if case.places is not None:
+        quantum = Decimal(1).scaleb(-case.places)
+        return Decimal(repr(float(result))).quantize(quantum) == Decimal(case.expected).quantize(quantum)
+    expected = float(case.expected)
+    return abs(float(result) - expected) <= 1e-6 * max(1.0, abs(expected))
+
+def percentile(values, percent):
+    """最近秩法分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def _run_local(cases):
+    outcomes = []
+    for case in cases:
+        started = time.perf_counter()
+        try:
+            result = compile_formula(case.formula).evaluate(case.variables)
+            error = None
+        except FormulaError as e:
+            result, error = None, str(e)
+        outcomes.append((result, time.perf_counter() - started, error))
+    return outcomes
+
+def _run_llm(cases, concurrency, base_url=None, api_key=None):
+    def run_case(case):
+        started = time.perf_counter()
+        try:
+            result = call_llm_api(case.formula, case.variables, base_url=base_url, api_key=api_key)
+            error = None if result is not None else "LLM未返回结果"
+        except Exception as e:
+            result, error = None, str(e)
+        return result, time.perf_counter() - started, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(run_case, cases))
+
+def _run_adk(cases, concurrency, adk_mode):
+    # adk_calculator 位于项目根目录
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from adk_calculator import FinancialCalculator
+
+    async def run_all():
+        calculator = FinancialCalculator(mode=adk_mode)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_case(case):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    result = (await calculator.run(case.question()))["final_result"]
+                    error = None if result is not None else "未得到最终结果"
+                except Exception as e:
+                    result, error = None, str(e)
+                return result, time.perf_counter() - started, error
+
+        try:
+            return await asyncio.gather(*[run_case(case) for case in cases])
+        finally:
+            await calculator.llm.close()
+
+    return asyncio.run(run_all())
+
+def run_backend(backend, cases, concurrency=8, adk_mode="plan", mock_url=None, mock_options=None):
+    """
+    用一个后端计算全部用例
+    参数:
+        backend: local/llm/adk/mock
+        cases: BenchmarkCase 列表
+        concurrency: LLM后端的并发数
+        adk_mode: adk 后端的计算模式（plan/tools）
+        mock_url: mock 后端的服务地址，None表示启动内置的模拟服务
+        mock_options: 内置模拟服务的参数（延迟分布、错误率等，见 MockLLMServer）
+    返回:
+        统计结果字典
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的后端: {backend}")
+    llm_client.reset_request_stats()
+    started = time.perf_counter()
+    if backend == "local":
+        outcomes = _run_local(cases)
+    elif backend == "llm":
+        outcomes = _run_llm(cases, concurrency)
+    elif backend == "mock":
+        if mock_url:
+            outcomes = _run_llm(cases, concurrency, base_url=mock_url, api_key="mock")
+        else:
+            with MockLLMServer(**(mock_options or {})) as server:
+                outcomes = _run_llm(cases, concurrency, base_url=server.base_url, api_key="mock")
+    else:
+        outcomes = _run_adk(cases, concurrency, adk_mode)
+    elapsed = time.perf_counter() - started
+    stats = llm_client.get_request_stats()
+
+    latencies = [latency for _, latency, _ in outcomes]
+    # 正确率只统计有预期值的用例
+    graded = sum(1 for case in cases if case.expected is not None)
+    correct = sum(1 for case, (result, _, _) in zip(cases, outcomes) if is_correct(case, result))
+    errors = sum(1 for _, _, error in outcomes if error is not None)
+    failures = [
+        {"case": case.source, "name": case.name, "result": result,
+         "expected": None if case.expected is None else float(case.expected), "error": error}
+        for case, (result, _, error) in zip(cases, outcomes)
+        if error is not None or (case.expected is not None and not is_correct(case, result))
+    ]
+    return {
+        "backend": backend,
+        "cases": len(cases),
+        "elapsed_sec": elapsed,
+        "throughput_per_sec": len(cases) / elapsed if elapsed else None,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) * 1000 if latencies else None,
+            "p50": (percentile(latencies, 50) or 0) * 1000,
+            "p95": (percentile(latencies, 95) or 0) * 1000,
+            "p99": (percentile(latencies, 99) or 0) * 1000
+        },
+        "round_trips_per_formula": stats["requests"] / len(cases) if cases else 0,
+        "retries": stats["retries"],
+        "hedges": stats["hedges"],
+        "cache_hits": stats["cache_hits"],
+        "graded": graded,
+        "correct": correct,
+        "errors": errors,
+        "accuracy": correct / graded if graded else None,
+        "failures": failures
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare_reports(old, new):
+    """打印两次基准结果的主要指标对比"""
+    print(f"对比 {old.get('commit')} -> {new.get('commit')}")
+    for backend, current in new["backends"].items():
+        previous = old.get("backends", {}).get(backend)
+        if previous is None:
+            continue
+        print(f"[{backend}]")
+        for label, key in (("吞吐量/秒", "throughput_per_sec"), ("正确率", "accuracy"),
+                           ("往返/公式", "round_trips_per_formula")):
+            print(f"  {label}: {previous.get(key)} -> {current.get(key)}")
+        for key in ("p50", "p95", "p99"):
+            print(f"  {key}(ms): {previous['latency_ms'].get(key)} -> {current['latency_ms'].get(key)}")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="公式计算后端的回归与基准测试")
+    parser.add_argument("--backends", default="local", help=f"逗号分隔的后端列表，可选 {','.join(BACKENDS)}")
+    parser.add_argument("--csv", default=DEFAULT_FORMULA_CSV_PATH, help="formula.csv路径，传空字符串表示不使用")
+    parser.add_argument("--formulas-dir", default=DEFAULT_FORMULAS_DIR, help="separated_formulas目录，传空字符串表示不使用")
+    parser.add_argument("--limit", type=int, default=None, help="最多使用的用例数")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="LLM后端的并发数")
+    parser.add_argument("--adk-mode", default="plan", help="adk后端的计算模式（plan/tools）")
+    parser.add_argument("--mock-url", default=None, help="mock后端的服务地址，省略时启动内置的模拟服务")
+    parser.add_argument("--mock-latency", default="none", help="内置模拟服务的延迟分布，如 lognormal:-3,0.5")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0, help="内置模拟服务返回500的比例")
+    parser.add_argument("--mock-rate-limit-rate", type=float, default=0.0, help="内置模拟服务返回429的比例")
+    parser.add_argument("--use-cache", action="store_true", help="允许使用LLM响应缓存（默认关闭以测量真实往返）")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="结果JSON输出路径")
+    parser.add_argument("--compare", default=None, help="与之前的结果JSON对比")
+    parser.add_argument("--verbose", action="store_true", help="显示各后端的过程输出")
+    parser.add_argument("--requests-per-second", type=float, default=None,
+                        help="LLM请求速率上限（每秒请求数），省略时不限制")
+    parser.add_argument("--tokens-per-minute", type=float, default=None,
+                        help="LLM token速率上限（每分钟token数，按请求体估算），省略时不限制")
+    args = parser.parse_args()
+
+    if not args.use_cache:
+        llm_client.configure_cache(enabled=False)
+    if args.requests_per_second or args.tokens_per_minute:
+        llm_client.configure_rate_limit(requests_per_second=args.requests_per_second,
+                                        tokens_per_minute=args.tokens_per_minute)
+
+    mock_options = {
+        "latency": args.mock_latency,
+        "error_rate": args.mock_error_rate,
+        "rate_limit_rate": args.mock_rate_limit_rate,
+        "retry_after": 0.1
+    }
+    cases = load_corpus(args.csv or None, args.formulas_dir or None, args.limit)
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "corpus": {"cases": len(cases), "csv": args.csv or None, "formulas_dir": args.formulas_dir or None},
+        "backends": {}
+    }
+
+    for backend in [name.strip() for name in args.backends.split(",") if name.strip()]:
+        if args.verbose:
+            result = run_backend(backend, cases, args.concurrency, args.adk_mode, args.mock_url, mock_options)
+        else:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = run_backend(backend, cases, args.concurrency, args.adk_mode, args.mock_url, mock_options)
+        report["backends"][backend] = result
+        # 没有可评分的用例时正确率为None，耗时为0时吞吐量为None
+        accuracy = "-" if result['accuracy'] is None else f"{result['accuracy']:.2%}"
+        throughput = "-" if result['throughput_per_sec'] is None else f"{result['throughput_per_sec']:.1f}"
+        print(f"[{backend}] {result['cases']} 个用例, 吞吐量 {throughput}/秒, "
+              f"p50 {result['latency_ms']['p50']:.2f}ms, p95 {result['latency_ms']['p95']:.2f}ms, "
+              f"p99 {result['latency_ms']['p99']:.2f}ms, 往返/公式 {result['round_trips_per_formula']:.2f}, "
+              f"正确率 {accuracy}（{result['graded']} 个用例有预期值）")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_reports(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
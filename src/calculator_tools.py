@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多元与聚合计算工具：sum、weighted_sum、average、ratio、delta、evaluate。
+十几到二十几项的合计公式（如经营活动现金流入小计、流动负债合计）一次工具调用即可完成，
+不必逐项调用二元的 add/subtract。
+所有工具（包括二元的 add/subtract/multiply/divide）都按十进制精确计算（Decimal），
+精度与舍入方式使用 formula_compiler 的算术配置，结果以 float 返回
+"""
+
+from decimal import Decimal
+
+import formula_compiler
+from formula_compiler import compile_formula, to_decimal, decimal_context
+
+def _to_decimals(values, name="values"):
+    if not isinstance(values, (list, tuple)):
+        raise ValueError(f"{name} 必须是数值列表")
+    return [to_decimal(value) for value in values]
+
+def _result(value):
+    """按算术配置舍入（配置了 places 时）后转为float"""
+    places = formula_compiler.ARITHMETIC_CONFIG["places"]
+    if places is not None:
+        value = value.quantize(Decimal(1).scaleb(-places))
+    return float(value)
+
+def add(a, b):
+    """加法：a + b"""
+    with decimal_context():
+        return _result(to_decimal(a) + to_decimal(b))
+
+def subtract(a, b):
+    """减法：a - b"""
+    with decimal_context():
+        return _result(to_decimal(a) - to_decimal(b))
+
+def multiply(a, b):
+    """乘法：a * b"""
+    with decimal_context():
+        return _result(to_decimal(a) * to_decimal(b))
+
+def divide(a, b):
+    """除法：a / b"""
+    denominator = to_decimal(b)
+    if denominator == 0:
+        raise ValueError("除数不能为零")
+    with decimal_context():
+        return _result(to_decimal(a) / denominator)
+
+def sum_values(values):
+    """求和：values 中全部数值相加"""
+    values = _to_decimals(values)
+    with decimal_context():
+        total = Decimal(0)
+        for value in values:
+            total += value
+        return _result(total)
+
+def weighted_sum(values, weights):
+    """加权求和：Σ values[i] * weights[i]，权重取 1/-1 即为带符号的加减合计"""
+    values = _to_decimals(values)
+    weights = _to_decimals(weights, "weights")
+    if len(values) != len(weights):
+        raise ValueError(f"values 与 weights 长度不一致: {len(values)} != {len(weights)}")
+    with decimal_context():
+        total = Decimal(0)
+        for value, weight in zip(values, weights):
+            total += value * weight
+        return _result(total)
+
+def average(values):
+    """平均值：values 的算术平均"""
+    values = _to_decimals(values)
+    if not values:
+        raise ValueError("values 不能为空")
+    with decimal_context():
+        total = Decimal(0)
+        for value in values:
+            total += value
+        return _result(total / len(values))
+
+def ratio(numerator, denominator):
+    """比率：numerator / denominator"""
+    return divide(numerator, denominator)
+
+def delta(current, prior):
+    """变动额：本期值 - 上期值"""
+    return subtract(current, prior)
+
+def evaluate(expression, variables=None):
+    """
+    计算含变量的表达式，如 "[货币资金]+[应收账款]-[坏账准备]"
+    参数:
+        expression: 表达式，变量可写作 [变量名] 或直接写变量名
+        variables: {变量名: 数值}，键可带中括号
+    返回:
+        计算结果；表达式无法解析、缺少变量或除数为零时抛出 ValueError（FormulaError）
+    """
+    return compile_formula(expression).evaluate(variables or {}, "decimal")
+
+# 工具名到实现的映射，参数按关键字传入
+TOOL_FUNCTIONS = {
+    "sum": sum_values,
+    "weighted_sum": weighted_sum,
+    "average": average,
+    "ratio": ratio,
+    "delta": delta,
+    "evaluate": evaluate
+}
+
+_NUMBER_LIST = {"type": "array", "items": {"type": "number"}}
+
+# "functions" 格式的工具描述（llm_function_call 使用）
+AGGREGATE_FUNCTIONS = [
+    {
+        "name": "sum",
+        "description": "多项求和。一次传入公式中所有需要相加的数值，如流动资产合计的全部明细项。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "values": dict(_NUMBER_LIST, description="需要相加的全部数值")
+            },
+            "required": ["values"]
+        }
+    },
+    {
+        "name": "weighted_sum",
+        "description": "加权求和 Σ values[i]*weights[i]。有加有减的合计公式可用权重 1 和 -1 一次算完。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "values": dict(_NUMBER_LIST, description="数值列表"),
+                "weights": dict(_NUMBER_LIST, description="与 values 一一对应的权重，相减的项取 -1")
+            },
+            "required": ["values", "weights"]
+        }
+    },
+    {
+        "name": "average",
+        "description": "求平均值，如年平均应付账款 = (本期 + 上期) / 2。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "values": dict(_NUMBER_LIST, description="需要求平均的数值")
+            },
+            "required": ["values"]
+        }
+    },
+    {
+        "name": "ratio",
+        "description": "计算比率 numerator / denominator，如流动比率、资产负债率。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "numerator": {"type": "number", "description": "分子"},
+                "denominator": {"type": "number", "description": "分母，不能为零"}
+            },
+            "required": ["numerator", "denominator"]
+        }
+    },
+    {
+        "name": "delta",
+        "description": "计算变动额 current - prior，如 [存货]-[存货_T-1]。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "current": {"type": "number", "description": "本期值"},
+                "prior": {"type": "number", "description": "上期值"}
+            },
+            "required": ["current", "prior"]
+        }
+    },
+    {
+        "name": "evaluate",
+        "description": "计算任意四则运算表达式，变量写作 [变量名] 并在 variables 中给出数值。整条公式可一次算完。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "expression": {"type": "string", "description": "表达式，如 ([应付账款]+[应付账款_T-1])/2"},
+                "variables": {"type": "object", "description": "变量键值对，如 {\"应付账款\": 8000}"}
+            },
+            "required": ["expression"]
+        }
+    }
+]
+
+# "tools" 格式的工具描述（adk_calculator 使用）
+AGGREGATE_TOOLS = [{"type": "function", "function": function} for function in AGGREGATE_FUNCTIONS]
+
+def call_tool(name, arguments):
+    """
+    执行聚合工具
+    参数:
+        name: 工具名
+        arguments: 参数字典
+    返回:
+        计算结果（float）
+    """
+    if name not in TOOL_FUNCTIONS:
+        raise ValueError(f"未知的函数: {name}")
+    return TOOL_FUNCTIONS[name](**arguments)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+财务数据源适配层：A计算机为公式变量注入数据时，从数据源批量取值。
+一批元素需要的全部变量先去重，本期(T)与上期(T-1，变量名带 _T-1 后缀)的值在同一次查询中取回，
+注入一份报告不再是每个元素、每个变量各查一次。
+数据源：
+    StaticDataSource   固定测试数据（默认，与原先注入的示例值相同）
+    SqliteDataSource   本地SQLite中的资产负债表、利润表科目（一次 SELECT ... WHERE item IN (...)）
+    ParquetDataSource  Parquet文件（需要安装pyarrow）
+    StatementDataSource  内存映射的列式报表存储（statement_store.py）
+存储格式（SQLite表与Parquet列相同）：company, period, item, value
+"""
+
+import re
+import csv
+import sqlite3
+import calendar
+import argparse
+import threading
+
+from formula_compiler import strip_key, PRIOR_SUFFIX
+
+# 默认的本地数据库
+DEFAULT_SQLITE_PATH = "/home/super/linchen/250418-accountant-agent/exp/financial_data.sqlite"
+DEFAULT_TABLE = "line_items"
+
+# 一条 IN (...) 查询最多使用的参数个数（低于SQLite的默认上限999）
+SQLITE_MAX_PARAMS = 900
+
+# 期间中的年份，如 "2023"、"2023-12-31"、"2023Q4"
+YEAR_PATTERN = re.compile(r'^(\d{4})')
+# 年份之后的2月29日，如 "-02-29"、"0229"、"/2/29"
+LEAP_DAY_PATTERN = re.compile(r'^([-/.]?)0?2\1(29)$')
+
+def prior_period(period):
+    """
+    上一期的期间（年份减一，其余部分不变），如 "2023-12-31" → "2022-12-31"，
+    闰年的2月29日对应上年的2月28日，如 "2024-02-29" → "2023-02-28"
+    参数:
+        period: 期间字符串或年份整数
+    返回:
+        上期期间字符串
+    """
+    text = str(period).strip()
+    match = YEAR_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"无法识别的期间: {period!r}")
+    year = int(match.group(1)) - 1
+    rest = text[4:]
+    leap_day = LEAP_DAY_PATTERN.match(rest)
+    if leap_day is not None and not calendar.isleap(year):
+        rest = rest[:leap_day.start(2)] + "28"
+    return f"{year:04d}{rest}"
+
+def split_prior(name):
+    """
+    拆分上期变量名
+    返回:
+        (科目名, 是否上期)，如 "存货_T-1" → ("存货", True)
+    """
+    if name.endswith(PRIOR_SUFFIX):
+        return name[:-len(PRIOR_SUFFIX)], True
+    return name, False
+
+class DataSource:
+    """数据源接口：子类实现 _query，按科目名批量取本期和上期的值"""
+
+    # 写入元素 data_source_list[0].source 的说明
+    name = "data_source"
+
+    def __init__(self, company=None, period=None):
+        """
+        参数:
+            company: 默认公司（元素中没有 entname 时使用）
+            period: 默认报告期（本期）
+        """
+        self.company = company
+        self.period = period
+        self.queries = 0
+
+    def fetch(self, names, company=None, period=None):
+        """
+        批量取变量值
+        参数:
+            names: 变量名（可带中括号，带 _T-1 后缀的取上期值），重复的名称只查询一次
+            company: 公司，省略时使用默认公司
+            period: 本期期间，省略时使用默认期间
+        返回:
+            {变量名(不带中括号): 值}，数据源中没有的变量不出现在结果中
+        """
+        wanted = {}
+        for key in names:
+            name = strip_key(key)
+            wanted.setdefault(name, split_prior(name))
+        if not wanted:
+            return {}
+        company = company if company is not None else self.company
+        period = period if period is not None else self.period
+        items = sorted({item for item, _ in wanted.values()})
+        with_prior = any(prior for _, prior in wanted.values())
+        self.queries += 1
+        rows = self._query(company, period, items, with_prior)
+
+        values = {}
+        for name, (item, prior) in wanted.items():
+            value = rows.get((item, prior))
+            if value is not None:
+                values[name] = value
+        return values
+
+    def _query(self, company, period, items, with_prior):
+        """
+        子类实现：一次取回本期（以及 with_prior 时的上期）科目值
+        返回:
+            {(科目名, 是否上期): 值}
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class StaticDataSource(DataSource):
+    """固定值数据源：指定了值的变量取该值，其余变量取默认值（测试用）"""
+
+    name = "static"
+
+    def __init__(self, values=None, default="0.01"):
+        """
+        参数:
+            values: {变量名: 值}，键可带中括号，上期值写作 "X_T-1"
+            default: 未指定变量的值，None表示视为缺失
+        """
+        super().__init__()
+        self.values = {}
+        for key, value in (values or {}).items():
+            self.values[split_prior(strip_key(key))] = value
+        self.default = default
+
+    def _query(self, company, period, items, with_prior):
+        rows = {}
+        for item in items:
+            for prior in ((False, True) if with_prior else (False,)):
+                value = self.values.get((item, prior), self.default)
+                if value is not None:
+                    rows[(item, prior)] = value
+        return rows
+
+class SqliteDataSource(DataSource):
+    """本地SQLite科目数据源，表结构: company, period, item, value"""
+
+    name = "sqlite"
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, table=DEFAULT_TABLE, company=None, period=None):
+        """
+        参数:
+            path: SQLite文件路径
+            table: 表名
+            company: 默认公司
+            period: 默认报告期
+        """
+        super().__init__(company, period)
+        if not re.match(r'^\w+$', table):
+            raise ValueError(f"无效的表名: {table}")
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "company TEXT NOT NULL, period TEXT NOT NULL, item TEXT NOT NULL, value, "
+            "PRIMARY KEY (company, period, item))"
+        )
+
+    def _query(self, company, period, items, with_prior):
+        if company is None or period is None:
+            raise ValueError("SQLite数据源需要指定公司和期间")
+        period = str(period)
+        periods = {period: False}
+        if with_prior:
+            periods[prior_period(period)] = True
+        rows = {}
+        # 本期与上期在同一条查询中取回；科目很多时按参数上限分段
+        chunk_size = SQLITE_MAX_PARAMS - len(periods) - 1
+        with self._lock:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                sql = (f"SELECT item, period, value FROM {self.table} "
+                       f"WHERE company = ? AND period IN ({','.join('?' * len(periods))}) "
+                       f"AND item IN ({','.join('?' * len(chunk))})")
+                for item, row_period, value in self._conn.execute(sql, [company, *periods, *chunk]):
+                    rows[(item, periods[row_period])] = value
+        return rows
+
+    def load_rows(self, rows):
+        """
+        写入科目数据（已存在的记录被覆盖）
+        参数:
+            rows: (company, period, item, value) 迭代器
+        返回:
+            写入的行数
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (company, period, item, value) VALUES (?, ?, ?, ?)",
+                ((str(company), str(period), str(item).strip(), value) for company, period, item, value in rows)
+            )
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ParquetDataSource(DataSource):
+    """Parquet科目数据源（列: company, period, item, value），需要安装pyarrow"""
+
+    name = "parquet"
+
+    def __init__(self, path, company=None, period=None):
+        super().__init__(company, period)
+        try:
+            import pyarrow.dataset  # noqa: F401
+        except ImportError:
+            raise ValueError("读取Parquet数据源需要安装pyarrow")
+        self.path = path
+
+    def _query(self, company, period, items, with_prior):
+        import pyarrow.dataset as ds
+
+        if company is None or period is None:
+            raise ValueError("Parquet数据源需要指定公司和期间")
+        period = str(period)
+        periods = {period: False}
+        if with_prior:
+            periods[prior_period(period)] = True
+        # 谓词下推：只读取需要的公司、期间和科目
+        condition = ((ds.field("company") == company) & ds.field("period").isin(list(periods))
+                     & ds.field("item").isin(items))
+        table = ds.dataset(self.path, format="parquet").to_table(
+            columns=["item", "period", "value"], filter=condition
+        )
+        rows = {}
+        for item, row_period, value in zip(*(table.column(name).to_pylist()
+                                             for name in ("item", "period", "value"))):
+            rows[(item, periods[row_period])] = value
+        return rows
+
+# 数据源类型
+DATA_SOURCE_TYPES = ("static", "sqlite", "parquet", "store")
+# 按 (公司, 期间) 查询、需要指定公司和期间的数据源类型
+LOCATED_SOURCE_TYPES = ("sqlite", "parquet", "store")
+
+def open_data_source(spec, company=None, period=None):
+    """
+    按描述打开数据源
+    参数:
+        spec: "static"、"sqlite:路径"（路径省略时使用默认数据库）、"parquet:路径"
+              或 "store:目录"（目录省略时使用默认的报表存储）
+        company: 默认公司
+        period: 默认报告期
+    返回:
+        DataSource实例
+    """
+    kind, _, path = spec.partition(":")
+    if kind not in DATA_SOURCE_TYPES:
+        raise ValueError(f"未知的数据源类型: {kind}")
+    if kind == "static":
+        return StaticDataSource()
+    if kind == "sqlite":
+        return SqliteDataSource(path or DEFAULT_SQLITE_PATH, company=company, period=period)
+    if kind == "store":
+        # statement_store 依赖本模块，在此延迟导入
+        from statement_store import StatementDataSource, DEFAULT_STORE_DIR
+        return StatementDataSource(path or DEFAULT_STORE_DIR, company=company, period=period)
+    if not path:
+        raise ValueError("Parquet数据源需要指定路径，如 parquet:/data/line_items.parquet")
+    return ParquetDataSource(path, company=company, period=period)
+
+def main():
+    """导入科目CSV到SQLite，或查询科目值"""
+    parser = argparse.ArgumentParser(description="财务科目数据源（SQLite）")
+    parser.add_argument("--path", default=DEFAULT_SQLITE_PATH, help="SQLite文件路径")
+    parser.add_argument("--import-csv", default=None, help="导入CSV（列: company, period, item, value，首行为表头）")
+    parser.add_argument("--company", default=None, help="查询的公司")
+    parser.add_argument("--period", default=None, help="查询的期间（本期）")
+    parser.add_argument("items", nargs="*", help="查询的科目，上期写作 X_T-1")
+    args = parser.parse_args()
+
+    source = SqliteDataSource(args.path, company=args.company, period=args.period)
+    if args.import_csv:
+        with open(args.import_csv, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            count = source.load_rows(row[:4] for row in reader if len(row) >= 4)
+        print(f"已导入 {count} 行到 {args.path}")
+    if args.items:
+        for name, value in source.fetch(args.items).items():
+            print(f"{name}: {value}")
+    source.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+公式目录：从 填报说明115之后_公式两列.csv 加载“元素名称 → 公式”的映射
+CSV只在首次使用或文件修改时间变化时解析，解析结果常驻内存，按元素名称O(1)查找；
+加载时为每条公式预先算出按出现顺序去重的变量名及其驻留ID（variable_registry）
+"""
+
+import os
+import re
+import csv
+import threading
+
+from formula_compiler import compile_formula, FormulaError
+from variable_registry import get_registry
+
+# 默认公式CSV路径
+DEFAULT_CSV_PATH = '/home/super/linchen/250418-accountant-agent/填报说明115之后_公式两列.csv'
+
+# 匹配中括号变量，如 [货币资金]、[其他应收款-应收利息]
+BRACKET_VARIABLE_PATTERN = re.compile(r'\[([^\[\]]+)\]')
+
+class FormulaEntry:
+    """公式目录中的一条记录"""
+
+    __slots__ = ("name", "formula", "variables", "variable_ids", "line_no", "compiled")
+
+    def __init__(self, name, formula, line_no):
+        self.name = name
+        self.formula = formula
+        self.line_no = line_no
+        # 预解析：按出现顺序去重后的中括号变量名
+        self.variables = tuple(dict.fromkeys(BRACKET_VARIABLE_PATTERN.findall(formula)))
+        # 与 variables 一一对应的驻留ID，求值时按ID从扁平数组取值
+        self.variable_ids = get_registry().intern_all(self.variables)
+        # 预编译：无法解析的公式（如纯文字说明）为None，交由LLM处理
+        try:
+            self.compiled = compile_formula(formula)
+        except FormulaError:
+            self.compiled = None
+
+    def __repr__(self):
+        return f"FormulaEntry({self.name!r}, {self.formula!r})"
+
+class FormulaCatalog:
+    """按元素名称索引的公式目录"""
+
+    def __init__(self, csv_path, mtime=None):
+        self.csv_path = csv_path
+        self.mtime = mtime
+        self.entries = {}
+        # 同名公式只保留第一条，其余记录在这里以便排查
+        self.duplicates = {}
+
+    @classmethod
+    def load(cls, csv_path=DEFAULT_CSV_PATH):
+        """
+        解析公式CSV
+        参数:
+            csv_path: CSV文件路径（两列：元素名称, 公式）
+        返回:
+            FormulaCatalog实例
+        """
+        catalog = cls(csv_path, os.stat(csv_path).st_mtime_ns)
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            for line_no, row in enumerate(csv.reader(f), 1):
+                if len(row) < 2:
+                    continue
+                name = row[0].strip()
+                formula = row[1].strip()
+                if not name or not formula:
+                    continue
+                if name in catalog.entries:
+                    catalog.duplicates.setdefault(name, []).append(formula)
+                    continue
+                catalog.entries[name] = FormulaEntry(name, formula, line_no)
+        return catalog
+
+    def get(self, name):
+        """按元素名称查找公式记录，不存在时返回None"""
+        return self.entries.get(name)
+
+    def get_formula(self, name, default=None):
+        """按元素名称查找公式字符串"""
+        entry = self.entries.get(name)
+        return entry.formula if entry is not None else default
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+# 已加载的目录缓存：csv_path -> FormulaCatalog
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(csv_path=DEFAULT_CSV_PATH):
+    """
+    获取公式目录，仅在首次调用或CSV修改时间变化时重新解析
+    参数:
+        csv_path: CSV文件路径
+    返回:
+        FormulaCatalog实例
+    """
+    mtime = os.stat(csv_path).st_mtime_ns
+    catalog = _catalogs.get(csv_path)
+    if catalog is not None and catalog.mtime == mtime:
+        return catalog
+
+    with _catalogs_lock:
+        catalog = _catalogs.get(csv_path)
+        if catalog is None or catalog.mtime != mtime:
+            catalog = FormulaCatalog.load(csv_path)
+            _catalogs[csv_path] = catalog
+            print(f"公式目录：已从 {csv_path} 加载 {len(catalog)} 条公式")
+    return catalog
@@ -0,0 +1,739 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+公式编译器：把 [变量] 公式语言（[名称]、数字、+ - * /、括号）解析为AST，
+再编译为嵌套闭包。编译结果按公式文本缓存在LRU中，求值只是一次函数调用，
+不再需要逐个 str.replace 替换变量和 eval。
+金额计算默认使用十进制（Decimal）后端：常量在编译时转换，十进制上下文每次求值只切换一次，
+变量值的转换结果跨公式缓存，结果按十进制精确计算后再转为float，避免 173436.69999999998 这类二进制浮点误差。
+变量名在编译时驻留为整数ID（variable_registry），同一份数据计算多个公式时可先转为按ID索引的扁平数组（values_array），
+各公式按ID取值（compute_array）。
+缺失值回退用 coalesce(a, b, ...) 表示：取第一个不缺失的参数。
+公式末尾的 "(若无T-1数据，T-1年取T年值)" 在解析时改写为 coalesce([X_T-1], [X])，而不是直接丢弃
+"""
+
+import re
+from functools import lru_cache
+from decimal import (Decimal, Context, InvalidOperation, DivisionByZero, Overflow,
+                     ROUND_HALF_EVEN, localcontext, getcontext, setcontext)
+
+from variable_registry import get_registry
+
+# 编译缓存容量（按公式文本）
+COMPILE_CACHE_SIZE = 4096
+
+# 算术后端：float 二进制浮点（最快）；decimal 十进制精确计算
+ARITHMETIC_BACKENDS = ("float", "decimal")
+
+# 算术配置，可用 configure_arithmetic 修改
+ARITHMETIC_CONFIG = {
+    "backend": "decimal",         # evaluate/compute 默认使用的后端
+    "precision": 28,              # 十进制有效位数
+    "rounding": ROUND_HALF_EVEN,  # 十进制舍入方式（decimal模块的 ROUND_* 常量）
+    "places": None                # 结果保留的小数位数，None表示不舍入
+}
+
+# 公式末尾的说明文字，如 "(若无T-1数据，T-1年取T年值)"
+ANNOTATION_PATTERN = re.compile(r'\s*[(（]\s*(若无[^()（）]*)[)）]\s*$')
+
+# 上期变量后缀
+PRIOR_SUFFIX = "_T-1"
+
+# 说明文字中的上期回退规则：缺少上期值时取本期值
+PRIOR_FALLBACK_PATTERN = re.compile(r'若无T-1.*取T年?值')
+
+# 公式中可用的函数：coalesce(a, b, ...) 取第一个不缺失的参数
+FORMULA_FUNCTIONS = ("coalesce",)
+
+# 词法规则：中括号变量、数字、运算符与括号、不带括号的变量名
+TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+        \[(?P<var>[^\[\]()+*/^]+)\]
+      | (?P<num>\d+(?:\.\d+)?(?![^\s\[\]()（）+\-*/,，]))
+      | (?P<op>[-+*/()（）,，])
+      | (?P<name>[^\s\[\]()（）+\-*/,，]+)
+    )''', re.VERBOSE)
+
+class FormulaError(ValueError):
+    """公式解析或求值错误"""
+
+class FormulaSyntaxError(FormulaError):
+    """公式无法解析"""
+
+class MissingVariableError(FormulaError):
+    """求值时缺少变量"""
+
+    def __init__(self, names):
+        self.names = list(names)
+        super().__init__(f"缺少变量: {', '.join(self.names)}")
+
+def strip_annotations(formula):
+    """
+    去除公式末尾的说明文字
+    参数:
+        formula: 原始公式
+    返回:
+        (清理后的公式, 说明文字或None)
+    """
+    match = ANNOTATION_PATTERN.search(formula)
+    if match is None:
+        return formula, None
+    return formula[:match.start()], match.group(1)
+
+def tokenize(formula):
+    """
+    将公式切分为词法单元
+    参数:
+        formula: 公式字符串
+    返回:
+        [(类型, 值)] 列表，类型为 var / num / op / func
+    """
+    tokens = []
+    pos = 0
+    length = len(formula)
+    while pos < length:
+        match = TOKEN_PATTERN.match(formula, pos)
+        if match is None or match.end() == pos:
+            if formula[pos:].strip() == '':
+                break
+            raise FormulaSyntaxError(f"无法识别的字符: {formula[pos:pos + 10]!r} (位置 {pos})")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'num':
+            tokens.append(('num', float(value)))
+        elif kind == 'op':
+            tokens.append(('op', {'（': '(', '）': ')', '，': ','}.get(value, value)))
+        elif (kind == 'name' and value.lower() in FORMULA_FUNCTIONS
+              and formula[pos:pos + 1] in ('(', '（')):
+            tokens.append(('func', value.lower()))
+        else:
+            tokens.append(('var', value.strip()))
+    return tokens
+
+class _Parser:
+    """递归下降语法分析器，生成元组形式的AST"""
+
+    def __init__(self, tokens, formula):
+        self.tokens = tokens
+        self.formula = formula
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def advance(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise FormulaSyntaxError(f"空公式: {self.formula!r}")
+        node = self.parse_expr()
+        if self.pos != len(self.tokens):
+            raise FormulaSyntaxError(f"公式中存在多余内容: {self.formula!r}")
+        return node
+
+    def parse_expr(self):
+        node = self.parse_term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.advance()[1]
+            node = ('add' if op == '+' else 'sub', node, self.parse_term())
+        return node
+
+    def parse_term(self):
+        node = self.parse_unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.advance()[1]
+            node = ('mul' if op == '*' else 'div', node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        token = self.peek()
+        if token == ('op', '-'):
+            self.advance()
+            return ('neg', self.parse_unary())
+        if token == ('op', '+'):
+            self.advance()
+            return self.parse_unary()
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.advance()
+        if kind == 'num':
+            return ('num', value)
+        if kind == 'var':
+            return ('var', value)
+        if kind == 'func':
+            return self.parse_call(value)
+        if (kind, value) == ('op', '('):
+            node = self.parse_expr()
+            if self.advance() != ('op', ')'):
+                raise FormulaSyntaxError(f"括号不匹配: {self.formula!r}")
+            return node
+        raise FormulaSyntaxError(f"公式语法错误: {self.formula!r}")
+
+    def parse_call(self, name):
+        """函数调用，如 coalesce([存货_T-1], [存货])，生成 (函数名, 参数1, 参数2, ...)"""
+        self.advance()
+        args = [self.parse_expr()]
+        while self.peek() == ('op', ','):
+            self.advance()
+            args.append(self.parse_expr())
+        if self.advance() != ('op', ')'):
+            raise FormulaSyntaxError(f"函数 {name} 的括号不匹配: {self.formula!r}")
+        return (name,) + tuple(args)
+
+def apply_prior_fallback(node):
+    """
+    上期回退：把 [X_T-1] 改写为 coalesce([X_T-1], [X])，缺少上期值时取本期值
+    参数:
+        node: AST
+    返回:
+        改写后的AST
+    """
+    kind = node[0]
+    if kind == 'var':
+        name = node[1]
+        if name.endswith(PRIOR_SUFFIX):
+            return ('coalesce', node, ('var', name[:-len(PRIOR_SUFFIX)]))
+        return node
+    if kind in ('num', 'coalesce'):
+        return node
+    return (kind,) + tuple(apply_prior_fallback(child) for child in node[1:])
+
+def parse(formula):
+    """
+    解析公式为AST
+    参数:
+        formula: 公式字符串（末尾说明文字会被去除；上期回退规则改写为 coalesce）
+    返回:
+        元组形式的AST，如 ('sub', ('var', '存货'), ('var', '存货_T-1'))
+    """
+    cleaned, annotation = strip_annotations(formula)
+    node = _Parser(tokenize(cleaned), formula).parse()
+    if annotation is not None and PRIOR_FALLBACK_PATTERN.search(annotation):
+        node = apply_prior_fallback(node)
+    return node
+
+def unresolved_variables(node, present):
+    """
+    求值所缺的变量：coalesce 只要有一个参数可求值就不缺变量，否则列出各参数所缺的变量
+    参数:
+        node: AST
+        present: 判断变量是否存在的函数，参数为变量名（或驻留ID）
+    返回:
+        缺少的变量列表（按出现顺序去重）
+    """
+    kind = node[0]
+    if kind == 'num':
+        return []
+    if kind == 'var':
+        return [] if present(node[1]) else [node[1]]
+    missing = {}
+    for child in node[1:]:
+        child_missing = unresolved_variables(child, present)
+        if kind == 'coalesce' and not child_missing:
+            return []
+        missing.update(dict.fromkeys(child_missing))
+    return list(missing)
+
+def ast_variables(node, out=None):
+    """按出现顺序收集AST中的变量名（去重）"""
+    if out is None:
+        out = {}
+    kind = node[0]
+    if kind == 'var':
+        out.setdefault(node[1], None)
+    elif kind != 'num':
+        for child in node[1:]:
+            ast_variables(child, out)
+    return tuple(out)
+
+def flatten_sum(node, sign, terms):
+    """把连续的加减链展开为 [(符号, 子节点)]，减少闭包嵌套层数"""
+    kind = node[0]
+    if kind == 'add':
+        flatten_sum(node[1], sign, terms)
+        flatten_sum(node[2], sign, terms)
+    elif kind == 'sub':
+        flatten_sum(node[1], sign, terms)
+        flatten_sum(node[2], -sign, terms)
+    else:
+        terms.append((sign, node))
+    return terms
+
+def _compile_node(node):
+    """把AST节点编译为 env -> 数值 的闭包"""
+    kind = node[0]
+    if kind == 'num':
+        value = node[1]
+        return lambda env: value
+    if kind == 'var':
+        name = node[1]
+        return lambda env: env[name]
+    if kind == 'neg':
+        operand = _compile_node(node[1])
+        return lambda env: -operand(env)
+    if kind == 'coalesce':
+        return _coalesce(tuple(_compile_node(child) for child in node[1:]))
+    if kind in ('add', 'sub'):
+        terms = flatten_sum(node, 1, [])
+        plus = tuple(_compile_node(child) for sign, child in terms if sign > 0)
+        minus = tuple(_compile_node(child) for sign, child in terms if sign < 0)
+        if not minus:
+            def add_terms(env):
+                total = plus[0](env)
+                for fn in plus[1:]:
+                    total += fn(env)
+                return total
+            return add_terms
+
+        def add_sub_terms(env):
+            total = plus[0](env) if plus else 0.0
+            for fn in plus[1:]:
+                total += fn(env)
+            for fn in minus:
+                total -= fn(env)
+            return total
+        return add_sub_terms
+    left = _compile_node(node[1])
+    right = _compile_node(node[2])
+    if kind == 'mul':
+        return lambda env: left(env) * right(env)
+    if kind == 'div':
+        def divide(env):
+            denominator = right(env)
+            if denominator == 0:
+                raise FormulaError("除数不能为零")
+            return left(env) / denominator
+        return divide
+    raise FormulaSyntaxError(f"未知的AST节点: {kind}")
+
+def _coalesce(alternatives):
+    """
+    coalesce 闭包：依次求值各参数，跳过缺失的参数
+    缺失表现为字典取值的KeyError，或扁平数组中的None（参与运算时TypeError、超出数组长度时IndexError）
+    """
+    first, last = alternatives[:-1], alternatives[-1]
+
+    def coalesce(env):
+        for fn in first:
+            try:
+                value = fn(env)
+            except (KeyError, TypeError, IndexError):
+                continue
+            if value is not None:
+                return value
+        return last(env)
+    return coalesce
+
+def _make_decimal_context():
+    return Context(prec=ARITHMETIC_CONFIG["precision"], rounding=ARITHMETIC_CONFIG["rounding"],
+                   traps=[InvalidOperation, DivisionByZero, Overflow])
+
+def _make_quantum():
+    places = ARITHMETIC_CONFIG["places"]
+    return None if places is None else Decimal(1).scaleb(-places)
+
+_decimal_context = _make_decimal_context()
+_decimal_quantum = _make_quantum()
+
+# float到Decimal转换结果的缓存容量
+FLOAT_DECIMAL_CACHE_SIZE = 262144
+_float_decimals = {}
+_INF = float("inf")
+
+def configure_arithmetic(**options):
+    """
+    修改算术配置
+    参数:
+        options: ARITHMETIC_CONFIG 中的配置项（backend、precision、rounding、places）
+    """
+    global _decimal_context, _decimal_quantum
+    unknown = set(options) - set(ARITHMETIC_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的算术配置项: {', '.join(sorted(unknown))}")
+    if options.get("backend", ARITHMETIC_CONFIG["backend"]) not in ARITHMETIC_BACKENDS:
+        raise ValueError(f"未知的算术后端: {options['backend']}")
+    ARITHMETIC_CONFIG.update(options)
+    _decimal_context = _make_decimal_context()
+    _decimal_quantum = _make_quantum()
+
+def decimal_context():
+    """返回按当前配置设置十进制精度与舍入方式的上下文管理器"""
+    return localcontext(_decimal_context)
+
+def decimal_to_float(result):
+    """
+    按配置的小数位数舍入十进制结果并转为float（与 compute 的十进制后端输出一致）
+    参数:
+        result: Decimal
+    返回:
+        float，舍入出错时抛出FormulaError
+    """
+    if _decimal_quantum is not None:
+        try:
+            with localcontext(_decimal_context):
+                result = result.quantize(_decimal_quantum)
+        except ArithmeticError as e:
+            raise FormulaError(f"十进制计算出错: {type(e).__name__}") from e
+    return float(result)
+
+def to_decimal(value):
+    """
+    把数值或千分位字符串转换为Decimal
+    参数:
+        value: 数值或字符串，如 11821688582.1 或 "11,821,688,582.10"
+    返回:
+        Decimal；无法转换时抛出 ValueError
+    """
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"不是数值: {value!r}")
+    if isinstance(value, int):
+        return Decimal(value)
+    # float 按其最短十进制表示转换，0.1 即 Decimal('0.1') 而不是 0.1000000000000000055...
+    text = repr(value) if isinstance(value, float) else str(value).strip().replace(',', '')
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"不是数值: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"不是有限数值: {value!r}")
+    return number
+
+def _float_to_decimal(value):
+    """float按最短十进制表示转换；同一批数据中的数值会在多个公式间重复，转换结果缓存复用"""
+    if value != value or value in (_INF, -_INF):
+        raise ValueError(f"不是有限数值: {value!r}")
+    if len(_float_decimals) >= FLOAT_DECIMAL_CACHE_SIZE:
+        _float_decimals.clear()
+    number = _float_decimals[value] = Decimal(repr(value))
+    return number
+
+def _decimal_env_value(value):
+    """变量值转换为Decimal（float的转换结果跨公式缓存），无效数值抛出FormulaError"""
+    try:
+        if type(value) is float:
+            number = _float_decimals.get(value)
+            return number if number is not None else _float_to_decimal(value)
+        return to_decimal(value)
+    except ValueError as e:
+        raise FormulaError(str(e)) from e
+
+def _run_decimal(fn, decimal_env):
+    """
+    在预先建好的十进制上下文中求值并按配置舍入
+    （直接切换上下文，不像 localcontext 那样每次复制，求值后恢复）；
+    溢出、舍入超出精度等十进制运算错误转换为FormulaError，缺少变量时的KeyError原样抛出
+    """
+    saved = getcontext()
+    setcontext(_decimal_context)
+    try:
+        result = fn(decimal_env)
+        if _decimal_quantum is not None:
+            result = result.quantize(_decimal_quantum)
+        return result
+    except ArithmeticError as e:
+        raise FormulaError(f"十进制计算出错: {type(e).__name__}") from e
+    finally:
+        setcontext(saved)
+
+def _check_finite(result):
+    """float结果为inf或NaN（输入含inf等）时抛出FormulaError"""
+    if result != result or result in (_INF, -_INF):
+        raise FormulaError(f"计算结果不是有限数值: {result!r}")
+    return result
+
+def _compile_decimal_node(node):
+    """把AST节点编译为 env -> Decimal 的闭包（env中的值已是Decimal，运算使用当前十进制上下文）"""
+    kind = node[0]
+    if kind == 'num':
+        value = to_decimal(node[1])
+        return lambda env: value
+    if kind == 'var':
+        name = node[1]
+        return lambda env: env[name]
+    if kind == 'neg':
+        operand = _compile_decimal_node(node[1])
+        return lambda env: -operand(env)
+    if kind == 'coalesce':
+        return _coalesce(tuple(_compile_decimal_node(child) for child in node[1:]))
+    if kind in ('add', 'sub'):
+        terms = flatten_sum(node, 1, [])
+        plus = tuple(_compile_decimal_node(child) for sign, child in terms if sign > 0)
+        minus = tuple(_compile_decimal_node(child) for sign, child in terms if sign < 0)
+
+        def add_sub_terms(env):
+            total = plus[0](env) if plus else Decimal(0)
+            for fn in plus[1:]:
+                total += fn(env)
+            for fn in minus:
+                total -= fn(env)
+            return total
+        return add_sub_terms
+    left = _compile_decimal_node(node[1])
+    right = _compile_decimal_node(node[2])
+    if kind == 'mul':
+        return lambda env: left(env) * right(env)
+    if kind == 'div':
+        def divide(env):
+            denominator = right(env)
+            if denominator == 0:
+                raise FormulaError("除数不能为零")
+            return left(env) / denominator
+        return divide
+    raise FormulaSyntaxError(f"未知的AST节点: {kind}")
+
+def intern_ast(node, registry):
+    """把AST中的变量名替换为驻留ID，编译后的闭包即按 values[ID] 取值"""
+    kind = node[0]
+    if kind == 'var':
+        return ('var', registry.intern(node[1]))
+    if kind == 'num':
+        return node
+    return (kind,) + tuple(intern_ast(child, registry) for child in node[1:])
+
+def strip_key(key):
+    """
+    变量键去掉首尾空白和外层中括号，如 "[应收账款]" → "应收账款"
+    参数:
+        key: 变量键，可带中括号
+    返回:
+        变量名
+    """
+    name = str(key).strip()
+    if name.startswith('[') and name.endswith(']'):
+        name = name[1:-1]
+    return name
+
+def values_array(variables, exact=False):
+    """
+    把变量字典转换为按变量ID索引的扁平数组，供多个公式的 compute_array 共用
+    参数:
+        variables: 原始变量字典，键可以是 "[存货]" 或 "存货"，值可为千分位字符串
+        exact: True 时值转换为Decimal（字符串不经过float）
+    返回:
+        列表，长度为当前驻留表大小，缺失的变量为None；没有任何已编译公式用到的变量直接忽略
+    """
+    registry = get_registry()
+    values = [None] * len(registry)
+    ids = registry.ids
+    for key, value in variables.items():
+        var_id = ids.get(strip_key(key))
+        if var_id is None or var_id >= len(values):
+            continue
+        if exact:
+            if value is None or (isinstance(value, str) and value.strip() == ''):
+                continue
+            values[var_id] = to_decimal(value)
+        else:
+            values[var_id] = to_number(value)
+    return values
+
+def to_number(value):
+    """
+    把变量值转换为数值，支持千分位字符串，如 "11,821,688,582.10"
+    参数:
+        value: 数值或字符串
+    返回:
+        float，空字符串/None 返回 None
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip().replace(',', '')
+    if text == '':
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"不是数值: {value!r}")
+
+def normalize_variables(variables, exact=False):
+    """
+    规范化变量字典：去掉键两侧的中括号，值转换为数值，空值视为缺失
+    参数:
+        variables: 原始变量字典，键可以是 "[存货]" 或 "存货"
+        exact: True 时值直接转换为Decimal（字符串不经过float）
+    返回:
+        {变量名: 数值}
+    """
+    env = {}
+    for key, value in variables.items():
+        name = strip_key(key)
+        if exact:
+            if value is None or (isinstance(value, str) and value.strip() == ''):
+                continue
+            env[name] = to_decimal(value)
+            continue
+        number = to_number(value)
+        if number is not None:
+            env[name] = number
+    return env
+
+class CompiledFormula:
+    """编译后的公式，调用时传入 {变量名: 数值}"""
+
+    __slots__ = ("text", "ast", "variables", "variable_ids", "annotation", "_fn", "_decimal_fn",
+                 "_array_fn", "_array_decimal_fn")
+
+    def __init__(self, text):
+        self.text = text
+        self.annotation = strip_annotations(text)[1]
+        self.ast = parse(text)
+        self.variables = ast_variables(self.ast)
+        # 与 variables 一一对应的驻留ID
+        self.variable_ids = get_registry().intern_all(self.variables)
+        self._fn = _compile_node(self.ast)
+        self._decimal_fn = None
+        self._array_fn = None
+        self._array_decimal_fn = None
+
+    def __call__(self, env):
+        """
+        按float求值（最快路径）
+        参数:
+            env: {变量名: 数值}，变量名不带中括号
+        返回:
+            计算结果
+        """
+        try:
+            return self._fn(env)
+        except KeyError:
+            raise MissingVariableError(self.missing_variables(env))
+
+    def decimal(self, env):
+        """
+        按十进制精确求值
+        参数:
+            env: {变量名: 数值}，变量名不带中括号，值可以是float、int、Decimal或数字字符串
+        返回:
+            Decimal结果（配置了 places 时按舍入方式保留相应小数位）
+        """
+        fn = self._decimal_fn
+        if fn is None:
+            fn = self._decimal_fn = _compile_decimal_node(self.ast)
+        # 每个变量只转换一次；float的转换结果跨公式缓存
+        decimal_env = {}
+        for name in self.variables:
+            value = env.get(name)
+            if value is not None:
+                decimal_env[name] = _decimal_env_value(value)
+        try:
+            return _run_decimal(fn, decimal_env)
+        except KeyError:
+            raise MissingVariableError(self.missing_variables(decimal_env))
+
+    def compute(self, env, backend=None):
+        """
+        按指定算术后端求值
+        参数:
+            env: {变量名: 数值}，变量名不带中括号
+            backend: "float" 或 "decimal"，省略时使用 ARITHMETIC_CONFIG["backend"]
+        返回:
+            计算结果（float）
+        """
+        backend = backend or ARITHMETIC_CONFIG["backend"]
+        if backend == "decimal":
+            return _check_finite(float(self.decimal(env)))
+        if backend == "float":
+            return _check_finite(self(env))
+        raise ValueError(f"未知的算术后端: {backend}")
+
+    def compute_array(self, values, backend=None):
+        """
+        按变量ID从扁平数组中取值求值
+        参数:
+            values: values_array 得到的数组（按驻留ID索引，缺失为None）
+            backend: "float" 或 "decimal"，省略时使用 ARITHMETIC_CONFIG["backend"]
+        返回:
+            计算结果（float）
+        """
+        backend = backend or ARITHMETIC_CONFIG["backend"]
+        if backend == "float":
+            fn = self._array_fn
+            if fn is None:
+                fn = self._array_fn = _compile_node(intern_ast(self.ast, get_registry()))
+            try:
+                result = fn(values)
+            except (TypeError, IndexError):
+                # 缺失值为None（参与运算时TypeError），或数组在公式编译之前创建（IndexError）
+                raise MissingVariableError(self._missing_ids(values))
+            if result is None:
+                # 公式只有一个变量且该变量缺失
+                raise MissingVariableError(self._missing_ids(values))
+            return _check_finite(result)
+        if backend != "decimal":
+            raise ValueError(f"未知的算术后端: {backend}")
+        fn = self._array_decimal_fn
+        if fn is None:
+            fn = self._array_decimal_fn = _compile_decimal_node(intern_ast(self.ast, get_registry()))
+        # 按ID取值转换为Decimal；值为None与ID超出数组长度（数组在公式编译之前创建）都视为缺失，
+        # 缺失的ID不放入decimal_env，由 coalesce 跳过或在求值时引发KeyError
+        decimal_env = {}
+        size = len(values)
+        for var_id in self.variable_ids:
+            if var_id < size:
+                value = values[var_id]
+                if value is not None:
+                    decimal_env[var_id] = _decimal_env_value(value)
+        try:
+            return _check_finite(float(_run_decimal(fn, decimal_env)))
+        except KeyError:
+            raise MissingVariableError(self._missing_ids(values))
+
+    def _missing_ids(self, values):
+        size = len(values)
+        ids = dict(zip(self.variable_ids, self.variables))
+        missing = unresolved_variables(intern_ast(self.ast, get_registry()),
+                                       lambda var_id: var_id < size and values[var_id] is not None)
+        return [ids[var_id] for var_id in missing]
+
+    def evaluate(self, variables, backend=None):
+        """对原始变量字典（可含中括号键、字符串数值）求值，非数值输入或结果不是有限数值时抛出FormulaError"""
+        backend = backend or ARITHMETIC_CONFIG["backend"]
+        try:
+            env = normalize_variables(variables, exact=backend == "decimal")
+        except FormulaError:
+            raise
+        except (TypeError, ValueError) as e:
+            raise FormulaError(str(e)) from e
+        return self.compute(env, backend)
+
+    def missing_variables(self, env):
+        """返回求值所缺的变量名列表（coalesce 中有可用参数时，其余参数缺失不计入）"""
+        return unresolved_variables(self.ast, env.__contains__)
+
+    def __repr__(self):
+        return f"CompiledFormula({self.text!r})"
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_formula(formula):
+    """
+    编译公式（按公式文本LRU缓存）
+    参数:
+        formula: 公式字符串
+    返回:
+        CompiledFormula实例，语法错误时抛出FormulaSyntaxError
+    """
+    return CompiledFormula(formula)
+
+def evaluate_formula(formula, variables, backend=None):
+    """
+    编译并求值公式
+    参数:
+        formula: 公式字符串
+        variables: 变量字典
+        backend: 算术后端，省略时使用 ARITHMETIC_CONFIG["backend"]
+    返回:
+        计算结果
+    """
+    return compile_formula(formula).evaluate(variables, backend)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+formula.csv 的流式读取：每行为 预期值, 公式, 变量JSON。
+变量JSON单元格中有千分位数值（"11,821,688,582.10" 或未加引号的 -135,979,786.86）、
+CSV转义后残留的成对双引号、跨多行的单元格；预期值可能带千分位或百分号。
+逐条产出规范化的 (预期值, 公式, 变量) 记录，内存占用与文件大小无关，
+可作为大规模回归测试和基准测试的数据集
+"""
+
+import re
+import csv
+import json
+import time
+import argparse
+from collections import namedtuple
+from decimal import Decimal
+
+from formula_compiler import to_number, to_decimal, compile_formula, FormulaError
+
+# 默认数据文件
+DEFAULT_FORMULA_CSV_PATH = "/home/super/linchen/250418-accountant-agent/formula.csv"
+
+# 数值类型
+NUMBER_TYPES = ("float", "decimal")
+
+# 未加引号的千分位数值，如 "利息支出": -135,979,786.86
+UNQUOTED_THOUSANDS_PATTERN = re.compile(r'(:\s*)(-?\d{1,3}(?:,\d{3})+(?:\.\d+)?)(?=\s*[,}\n])')
+
+# 一条记录：预期值、公式、{变量名: 数值}、记录起始行号
+FormulaRecord = namedtuple("FormulaRecord", ["expected", "formula", "variables", "line_no"])
+
+def parse_variables_cell(text):
+    """
+    解析变量JSON单元格，依次尝试修复已知的格式问题
+    参数:
+        text: CSV解析后的单元格文本
+    返回:
+        变量字典；无法修复时抛出 ValueError
+    """
+    candidate = text.strip()
+    if not candidate:
+        return {}
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        pass
+    # CSV中写了四个引号，转义后仍是成对的 ""键""
+    if '""' in candidate:
+        candidate = candidate.replace('""', '"')
+    candidate = UNQUOTED_THOUSANDS_PATTERN.sub(r'\1"\2"', candidate)
+    try:
+        variables = json.loads(candidate)
+    except ValueError as e:
+        raise ValueError(f"变量JSON无法解析: {str(e)}")
+    if not isinstance(variables, dict):
+        raise ValueError("变量JSON不是对象")
+    return variables
+
+def parse_expected(text, numbers="float"):
+    """
+    解析预期值，支持千分位和百分号（"29.53%" 即 0.2953）
+    参数:
+        text: 预期值文本
+        numbers: "float" 或 "decimal"
+    返回:
+        数值，空文本返回None
+    """
+    text = text.strip()
+    if not text:
+        return None
+    percent = text.endswith('%')
+    if percent:
+        text = text[:-1]
+    if numbers == "decimal":
+        value = to_decimal(text)
+        return value / 100 if percent else value
+    value = to_number(text)
+    return value / 100 if percent else value
+
+def _convert_values(variables, numbers):
+    """把变量值统一转换为数值类型，空值记为None"""
+    convert = to_decimal if numbers == "decimal" else to_number
+    converted = {}
+    for key, value in variables.items():
+        if value is None or (isinstance(value, str) and value.strip() == ''):
+            converted[key] = None
+        else:
+            converted[key] = convert(value)
+    return converted
+
+class FormulaCsvReader:
+    """流式读取 formula.csv，迭代产出 FormulaRecord"""
+
+    def __init__(self, path=DEFAULT_FORMULA_CSV_PATH, numbers="float", errors="skip"):
+        """
+        参数:
+            path: CSV文件路径
+            numbers: 数值类型，"float" 或 "decimal"
+            errors: 遇到无法解析的行时 "skip" 跳过并计数，"raise" 抛出 ValueError
+        """
+        if numbers not in NUMBER_TYPES:
+            raise ValueError(f"未知的数值类型: {numbers}")
+        self.path = path
+        self.numbers = numbers
+        self.errors = errors
+        self.rows = 0
+        self.skipped = []
+
+    def __iter__(self):
+        # utf-8-sig 去掉文件开头的BOM；newline='' 让csv模块处理单元格内的换行
+        with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            line_no = 1
+            for row in reader:
+                start_line = line_no
+                line_no = reader.line_num + 1
+                if not row or not any(cell.strip() for cell in row):
+                    continue
+                try:
+                    if len(row) < 3:
+                        raise ValueError(f"列数不足: {len(row)}")
+                    record = FormulaRecord(
+                        parse_expected(row[0], self.numbers),
+                        row[1].strip(),
+                        _convert_values(parse_variables_cell(row[2]), self.numbers),
+                        start_line
+                    )
+                except ValueError as e:
+                    if self.errors == "raise":
+                        raise ValueError(f"{self.path} 第{start_line}行: {str(e)}")
+                    self.skipped.append((start_line, str(e)))
+                    continue
+                self.rows += 1
+                yield record
+
+def iter_records(path=DEFAULT_FORMULA_CSV_PATH, numbers="float", errors="skip"):
+    """
+    逐条读取 formula.csv
+    参数:
+        path: CSV文件路径
+        numbers: 数值类型，"float" 或 "decimal"
+        errors: "skip" 或 "raise"
+    返回:
+        FormulaRecord 迭代器
+    """
+    return iter(FormulaCsvReader(path, numbers, errors))
+
+def iter_batches(records, batch_size=10000):
+    """
+    把记录按批分组，每批再按公式归类，供 formula_vectorized.evaluate_records 逐公式批量求值
+    参数:
+        records: FormulaRecord 迭代器
+        batch_size: 每批记录数
+    返回:
+        {公式: [FormulaRecord]} 迭代器
+    """
+    batch = {}
+    count = 0
+    for record in records:
+        batch.setdefault(record.formula, []).append(record)
+        count += 1
+        if count >= batch_size:
+            yield batch
+            batch = {}
+            count = 0
+    if batch:
+        yield batch
+
+def _decimal_places(value):
+    """预期值的小数位数（Decimal的指数），用于按预期值的精度比较"""
+    exponent = value.as_tuple().exponent
+    return -exponent if isinstance(exponent, int) and exponent < 0 else 0
+
+def check_record(record):
+    """
+    用本地公式引擎计算记录并与预期值比较（按预期值的小数位数四舍五入）
+    参数:
+        record: FormulaRecord（numbers="decimal"）
+    返回:
+        (状态, 计算结果)，状态为 "match"/"mismatch"/"missing"/"error"
+    """
+    try:
+        compiled = compile_formula(record.formula)
+        env = {name: value for name, value in record.variables.items() if value is not None}
+        missing = compiled.missing_variables(env)
+        if missing:
+            return "missing", None
+        result = compiled.decimal(env)
+    except FormulaError:
+        return "error", None
+    if record.expected is None:
+        return "mismatch", result
+    quantum = Decimal(1).scaleb(-_decimal_places(record.expected))
+    if result.quantize(quantum) == record.expected.quantize(quantum):
+        return "match", result
+    return "mismatch", result
+
+def main():
+    """把 formula.csv 作为回归数据集：逐行计算并统计与预期值的一致情况"""
+    parser = argparse.ArgumentParser(description="流式读取formula.csv并用本地公式引擎校验")
+    parser.add_argument("path", nargs="?", default=DEFAULT_FORMULA_CSV_PATH, help="formula.csv路径")
+    parser.add_argument("--show", type=int, default=0, help="打印前N条不一致的记录")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="按float读取，分批按公式归类后用NumPy向量化求值（只统计耗时与有效行数）")
+    parser.add_argument("--batch-size", type=int, default=10000, help="向量化模式的每批记录数")
+    args = parser.parse_args()
+
+    if args.vectorized:
+        from formula_vectorized import evaluate_records
+
+        reader = FormulaCsvReader(args.path, numbers="float")
+        valid = 0
+        started = time.perf_counter()
+        for batch in iter_batches(reader, args.batch_size):
+            for formula, records in batch.items():
+                try:
+                    result = evaluate_records(formula, [record.variables for record in records])
+                except (FormulaError, ValueError):
+                    continue
+                valid += int(result.valid.sum())
+        elapsed = time.perf_counter() - started
+        print(f"记录数: {reader.rows}, 跳过: {len(reader.skipped)}, 有效计算结果: {valid}")
+        print(f"耗时: {elapsed:.3f} 秒, {reader.rows / elapsed if elapsed else 0:,.0f} 行/秒")
+        return
+
+    reader = FormulaCsvReader(args.path, numbers="decimal")
+    counts = {"match": 0, "mismatch": 0, "missing": 0, "error": 0}
+    shown = 0
+    started = time.perf_counter()
+    for record in reader:
+        status, result = check_record(record)
+        counts[status] += 1
+        if status != "match" and shown < args.show:
+            shown += 1
+            print(f"第{record.line_no}行 [{status}] {record.formula} 预期 {record.expected} 计算 {result}")
+    elapsed = time.perf_counter() - started
+
+    print(f"记录数: {reader.rows}, 跳过: {len(reader.skipped)}")
+    for line_no, reason in reader.skipped:
+        print(f"  第{line_no}行: {reason}")
+    print(f"一致: {counts['match']}, 不一致: {counts['mismatch']}, "
+          f"变量不匹配: {counts['missing']}, 公式错误: {counts['error']}")
+    print(f"耗时: {elapsed:.3f} 秒, {reader.rows / elapsed if elapsed else 0:,.0f} 行/秒")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+公式DAG：把公式目录中的所有公式合并为一张有向无环图。
+结构相同的子表达式（如资产总计中重复的流动资产合计求和）只保留一个节点，
+引用其他目录条目的变量（如 [流动资产合计]）直接连到该条目的根节点。
+填报一份报告时按节点编号顺序求值一遍，每个小计只计算一次。
+算术后端与公式编译器相同（ARITHMETIC_CONFIG["backend"]，默认十进制），同一条目两条路径的结果一致
+"""
+
+import argparse
+
+from formula_catalog import get_catalog, DEFAULT_CSV_PATH
+from formula_compiler import (strip_key, to_number, to_decimal, decimal_to_float, decimal_context,
+                              FormulaError, ARITHMETIC_CONFIG, ARITHMETIC_BACKENDS)
+
+def is_exact(backend=None):
+    """
+    算术后端是否为十进制
+    参数:
+        backend: "float" 或 "decimal"，省略时使用 ARITHMETIC_CONFIG["backend"]
+    """
+    backend = backend or ARITHMETIC_CONFIG["backend"]
+    if backend not in ARITHMETIC_BACKENDS:
+        raise ValueError(f"未知的算术后端: {backend}")
+    return backend == "decimal"
+
+def input_value(value, exact=False):
+    """输入值转换为float（exact时为Decimal），空值或非数值视为缺失返回None"""
+    try:
+        if exact:
+            if value is None or (isinstance(value, str) and value.strip() == ''):
+                return None
+            return to_decimal(value)
+        return to_number(value)
+    except (TypeError, ValueError):
+        return None
+
+def output_value(value):
+    """节点值转换为结果：十进制值按配置舍入后转为float，舍入出错时为None"""
+    if value is None or isinstance(value, float):
+        return value
+    try:
+        return decimal_to_float(value)
+    except FormulaError:
+        return None
+
+def node_value(node, values, env, exact=False):
+    """
+    计算一个DAG节点的值（exact时在 decimal_context 中调用）
+    参数:
+        node: 节点元组
+        values: {节点编号: 值}，子节点已计算
+        env: {变量名: 数值}，缺失的变量为None或不出现
+        exact: 十进制计算，env中的值为Decimal
+    返回:
+        节点值，缺少变量、除数为零或运算溢出时为None
+    """
+    kind = node[0]
+    if kind == 'num':
+        return to_decimal(node[1]) if exact else node[1]
+    if kind == 'var':
+        return env.get(node[1])
+    if kind == 'ref':
+        value = env.get(node[1])
+        return values[node[2]] if value is None else value
+    if kind == 'neg':
+        operand = values[node[1]]
+        return None if operand is None else -operand
+    if kind == 'coalesce':
+        return next((values[child] for child in node[1:] if values[child] is not None), None)
+    left = values[node[1]]
+    right = values[node[2]]
+    if left is None or right is None:
+        return None
+    try:
+        if kind == 'add':
+            return left + right
+        if kind == 'sub':
+            return left - right
+        if kind == 'mul':
+            return left * right
+        return None if right == 0 else left / right
+    except ArithmeticError:
+        return None
+
+class FormulaDAG:
+    """
+    共享子表达式的公式图
+    节点按创建顺序编号，子节点编号总是小于父节点，编号顺序即拓扑顺序。
+    节点形式：
+        ('num', 值) / ('var', 变量名) / ('neg', 子节点)
+        ('add'|'sub'|'mul'|'div', 左子节点, 右子节点)
+        ('coalesce', 子节点1, 子节点2, ...)：取第一个不为None的子节点值
+        ('ref', 目录条目名, 条目根节点)：输入中提供了该条目的值时直接使用，否则取条目计算结果
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.roots = {}
+        self._index = {}
+        # 按目标集合缓存需要求值的节点列表
+        self._plans = {}
+
+    @classmethod
+    def from_catalog(cls, catalog=None, names=None):
+        """
+        由公式目录构建DAG
+        参数:
+            catalog: FormulaCatalog，省略时加载默认目录
+            names: 只加入这些条目（及其引用的条目），省略时加入全部可解析条目
+        返回:
+            FormulaDAG实例
+        """
+        if catalog is None:
+            catalog = get_catalog(DEFAULT_CSV_PATH)
+        dag = cls()
+        asts = {entry.name: entry.compiled.ast for entry in catalog if entry.compiled is not None}
+        for name in (names if names is not None else list(asts)):
+            if name in asts:
+                dag._add_entry(name, asts, [])
+        return dag
+
+    @classmethod
+    def from_formulas(cls, formulas):
+        """
+        由 {条目名: AST} 构建DAG
+        参数:
+            formulas: {条目名: 公式AST}，AST来自 formula_compiler.parse
+        返回:
+            FormulaDAG实例
+        """
+        dag = cls()
+        for name in formulas:
+            dag._add_entry(name, formulas, [])
+        return dag
+
+    def _intern(self, key):
+        """哈希合并：结构相同的节点只创建一次"""
+        node_id = self._index.get(key)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.nodes.append(key)
+            self._index[key] = node_id
+        return node_id
+
+    def _add_entry(self, name, asts, stack):
+        root = self.roots.get(name)
+        if root is not None:
+            return root
+        stack.append(name)
+        root = self._add_ast(asts[name], asts, stack)
+        stack.pop()
+        self.roots[name] = root
+        return root
+
+    def _add_ast(self, node, asts, stack):
+        kind = node[0]
+        if kind == 'num':
+            return self._intern(('num', node[1]))
+        if kind == 'var':
+            name = node[1]
+            # 引用其他目录条目（且不构成循环）时连到该条目的根节点
+            if name in asts and name not in stack:
+                entry_root = self._add_entry(name, asts, stack)
+                return self._intern(('ref', name, entry_root))
+            return self._intern(('var', name))
+        if kind == 'neg':
+            return self._intern(('neg', self._add_ast(node[1], asts, stack)))
+        children = tuple(self._add_ast(child, asts, stack) for child in node[1:])
+        return self._intern((kind,) + children)
+
+    def _plan(self, targets):
+        """计算目标条目需要的节点编号（升序即求值顺序）"""
+        key = frozenset(targets)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        needed = set()
+        pending = [self.roots[name] for name in targets]
+        while pending:
+            node_id = pending.pop()
+            if node_id in needed:
+                continue
+            needed.add(node_id)
+            node = self.nodes[node_id]
+            kind = node[0]
+            if kind == 'neg':
+                pending.append(node[1])
+            elif kind == 'ref':
+                pending.append(node[2])
+            elif kind not in ('num', 'var'):
+                pending.extend(node[1:])
+        plan = sorted(needed)
+        self._plans[key] = plan
+        return plan
+
+    def evaluate(self, inputs, targets=None, backend=None):
+        """
+        一次遍历计算报告中的多个条目
+        参数:
+            inputs: {变量名: 数值}，键可带中括号，值可为千分位字符串
+            targets: 需要计算的条目名列表，省略时计算全部条目
+            backend: 算术后端，省略时使用 ARITHMETIC_CONFIG["backend"]
+        返回:
+            {条目名: 结果}，缺少变量或除数为零的条目结果为None
+        """
+        if targets is None:
+            targets = list(self.roots)
+        exact = is_exact(backend)
+        env = {}
+        for key, value in inputs.items():
+            env[strip_key(key)] = input_value(value, exact)
+
+        values = {}
+        with decimal_context():
+            for node_id in self._plan(targets):
+                values[node_id] = node_value(self.nodes[node_id], values, env, exact)
+
+        return {name: output_value(values[self.roots[name]]) for name in targets}
+
+    def input_variables(self, targets=None):
+        """返回计算目标条目所需的原始输入变量名（不含目录条目引用）"""
+        if targets is None:
+            targets = list(self.roots)
+        names = []
+        for node_id in self._plan(targets):
+            node = self.nodes[node_id]
+            if node[0] == 'var':
+                names.append(node[1])
+        return names
+
+    def dependencies(self, name):
+        """返回条目直接引用的其他目录条目名"""
+        deps = []
+        seen = set()
+        pending = [self.roots[name]]
+        while pending:
+            node_id = pending.pop()
+            if node_id in seen:
+                continue
+            seen.add(node_id)
+            node = self.nodes[node_id]
+            kind = node[0]
+            if kind == 'ref':
+                # 遇到引用即停止，不再展开被引用条目的内部
+                if node[1] not in deps:
+                    deps.append(node[1])
+            elif kind == 'neg':
+                pending.append(node[1])
+            elif kind not in ('num', 'var'):
+                pending.extend(node[1:])
+        return deps
+
+    def stats(self):
+        """
+        统计共享效果
+        返回:
+            {"entries": 条目数, "tree_nodes": 各公式单独展开后的节点总数,
+             "dag_nodes": DAG节点数, "shared_nodes": 被多个父节点使用的节点数}
+        """
+        parents = [0] * len(self.nodes)
+        for node in self.nodes:
+            kind = node[0]
+            if kind == 'neg':
+                parents[node[1]] += 1
+            elif kind == 'ref':
+                parents[node[2]] += 1
+            elif kind not in ('num', 'var'):
+                for child in node[1:]:
+                    parents[child] += 1
+
+        sizes = {}
+
+        def tree_size(node_id):
+            size = sizes.get(node_id)
+            if size is None:
+                node = self.nodes[node_id]
+                kind = node[0]
+                if kind in ('num', 'var'):
+                    size = 1
+                elif kind == 'neg':
+                    size = 1 + tree_size(node[1])
+                elif kind == 'ref':
+                    size = 1 + tree_size(node[2])
+                else:
+                    size = 1 + sum(tree_size(child) for child in node[1:])
+                sizes[node_id] = size
+            return size
+
+        return {
+            "entries": len(self.roots),
+            "tree_nodes": sum(tree_size(root) for root in self.roots.values()),
+            "dag_nodes": len(self.nodes),
+            "shared_nodes": sum(1 for count in parents if count > 1)
+        }
+
+def main():
+    """打印公式目录构建DAG后的共享统计"""
+    parser = argparse.ArgumentParser(description="统计公式目录中的共享子表达式")
+    parser.add_argument("--csv", default=DEFAULT_CSV_PATH, help="公式目录CSV路径")
+    args = parser.parse_args()
+
+    dag = FormulaDAG.from_catalog(get_catalog(args.csv))
+    stats = dag.stats()
+    print(f"目录条目: {stats['entries']}")
+    print(f"逐个展开的节点总数: {stats['tree_nodes']}")
+    print(f"DAG节点数: {stats['dag_nodes']}")
+    print(f"共享节点数: {stats['shared_nodes']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+公式的NumPy向量化求值：同一个公式只编译一次，
+对按列组织的变量（每个变量一个数组，每个元素对应一家公司或一个期间）一次性计算。
+缺失值和除数为零不抛异常，而是通过掩码标记对应行无效；
+coalesce(a, b, ...) 按行取第一个不缺失的参数（上期回退规则在解析时已改写为 coalesce）
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from formula_compiler import parse, ast_variables, flatten_sum, to_number, strip_key, COMPILE_CACHE_SIZE
+
+# 向量化求值结果：
+#   values: 计算结果（无效行为NaN）
+#   valid: 有效行掩码
+#   missing: 因缺少变量而无效的行
+#   zero_division: 因除数为零而无效的行
+VectorResult = namedtuple("VectorResult", ["values", "valid", "missing", "zero_division"])
+
+def _compile_node(node):
+    """
+    把AST节点编译为 (columns, size) -> (数值数组, 缺失掩码, 除零掩码) 的函数
+    columns 中每个变量对应 (数值数组, 缺失掩码)
+    """
+    kind = node[0]
+    if kind == 'num':
+        value = node[1]
+
+        def constant(columns, size):
+            no_rows = np.zeros(size, dtype=bool)
+            return np.full(size, value, dtype=np.float64), no_rows, no_rows
+        return constant
+    if kind == 'var':
+        name = node[1]
+
+        def variable(columns, size):
+            column = columns.get(name)
+            if column is None:
+                return np.full(size, np.nan), np.ones(size, dtype=bool), np.zeros(size, dtype=bool)
+            values, missing = column
+            return values, missing, np.zeros(size, dtype=bool)
+        return variable
+    if kind == 'neg':
+        operand = _compile_node(node[1])
+
+        def negate(columns, size):
+            values, missing, zero_division = operand(columns, size)
+            return -values, missing, zero_division
+        return negate
+    if kind == 'coalesce':
+        alternatives = [_compile_node(child) for child in node[1:]]
+
+        def coalesce(columns, size):
+            values, missing, zero_division = alternatives[0](columns, size)
+            for fn in alternatives[1:]:
+                if not missing.any():
+                    break
+                alt_values, alt_missing, alt_zero = fn(columns, size)
+                # 只在当前缺失的行上采用下一个参数
+                values = np.where(missing, alt_values, values)
+                zero_division = np.where(missing, alt_zero, zero_division)
+                missing = missing & alt_missing
+            return values, missing, zero_division
+        return coalesce
+    if kind in ('add', 'sub'):
+        terms = [(sign, _compile_node(child)) for sign, child in flatten_sum(node, 1, [])]
+
+        def add_terms(columns, size):
+            total = np.zeros(size, dtype=np.float64)
+            missing = np.zeros(size, dtype=bool)
+            zero_division = np.zeros(size, dtype=bool)
+            for sign, fn in terms:
+                values, term_missing, term_zero = fn(columns, size)
+                if sign > 0:
+                    total += values
+                else:
+                    total -= values
+                missing |= term_missing
+                zero_division |= term_zero
+            return total, missing, zero_division
+        return add_terms
+
+    left = _compile_node(node[1])
+    right = _compile_node(node[2])
+    if kind == 'mul':
+        def multiply(columns, size):
+            left_values, left_missing, left_zero = left(columns, size)
+            right_values, right_missing, right_zero = right(columns, size)
+            return left_values * right_values, left_missing | right_missing, left_zero | right_zero
+        return multiply
+
+    def divide(columns, size):
+        left_values, left_missing, left_zero = left(columns, size)
+        right_values, right_missing, right_zero = right(columns, size)
+        zero = right_values == 0
+        out = np.full(size, np.nan)
+        np.divide(left_values, right_values, out=out, where=~zero)
+        return out, left_missing | right_missing, left_zero | right_zero | zero
+    return divide
+
+class VectorizedFormula:
+    """编译后的向量化公式"""
+
+    def __init__(self, text):
+        self.text = text
+        self.ast = parse(text)
+        self.variables = ast_variables(self.ast)
+        self._fn = _compile_node(self.ast)
+
+    def evaluate(self, columns, size=None):
+        """
+        对按列组织的变量求值
+        参数:
+            columns: {变量名: 数组或 (数组, 缺失掩码)}，数组中的NaN视为缺失
+            size: 行数，省略时取第一列的长度
+        返回:
+            VectorResult
+        """
+        prepared = {}
+        for name in self.variables:
+            column = columns.get(name)
+            if column is None:
+                continue
+            if isinstance(column, tuple):
+                values, missing = column
+                values = np.asarray(values, dtype=np.float64)
+                missing = np.asarray(missing, dtype=bool) | np.isnan(values)
+            else:
+                values = np.asarray(column, dtype=np.float64)
+                missing = np.isnan(values)
+            prepared[name] = (values, missing)
+            if size is None:
+                size = len(values)
+        if size is None:
+            raise ValueError(f"无法确定行数，公式 {self.text!r} 的变量均未提供")
+
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            values, missing, zero_division = self._fn(prepared, size)
+        valid = ~(missing | zero_division)
+        values = np.where(valid, values, np.nan)
+        return VectorResult(values, valid, missing, zero_division & ~missing)
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_vectorized(formula):
+    """
+    编译向量化公式（按公式文本LRU缓存）
+    参数:
+        formula: 公式字符串
+    返回:
+        VectorizedFormula实例
+    """
+    return VectorizedFormula(formula)
+
+def columns_from_records(records, variables):
+    """
+    把逐行的变量字典转换为列式数组
+    参数:
+        records: 变量字典列表，键可带中括号，值可为千分位字符串，缺失、空值或非数值记为NaN（该行计为缺失）
+        variables: 需要的变量名
+    返回:
+        ({变量名: float64数组}, 行数)
+    """
+    size = len(records)
+    columns = {name: np.full(size, np.nan) for name in variables}
+    for row, record in enumerate(records):
+        for key, value in record.items():
+            column = columns.get(strip_key(key))
+            if column is None:
+                continue
+            try:
+                number = to_number(value)
+            except (TypeError, ValueError):
+                # 非数值（如 "n/a"）只使本行无效，不影响整批
+                continue
+            if number is not None:
+                column[row] = number
+    return columns, size
+
+def evaluate_records(formula, records):
+    """
+    对多行变量字典一次性计算同一个公式
+    参数:
+        formula: 公式字符串
+        records: 变量字典列表（每个元素对应一家公司或一个期间）
+    返回:
+        VectorResult
+    """
+    compiled = compile_vectorized(formula)
+    columns, size = columns_from_records(records, compiled.variables)
+    return compiled.evaluate(columns, size)
+
+def evaluate_grouped(rows):
+    """
+    按公式分组后逐组向量化求值
+    参数:
+        rows: [(公式, 变量字典)] 列表，如 formula.csv 中的多行
+    返回:
+        与输入等长的列表，每项为计算结果，无效行为None
+    """
+    groups = {}
+    for index, (formula, variables) in enumerate(rows):
+        groups.setdefault(formula, []).append((index, variables))
+
+    results = [None] * len(rows)
+    for formula, members in groups.items():
+        result = evaluate_records(formula, [variables for _, variables in members])
+        for (index, _), value, valid in zip(members, result.values, result.valid):
+            if valid:
+                results[index] = float(value)
+    return results
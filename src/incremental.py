@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+增量重算：审核时通常只改动报告中的一两个原始数值（如 [应收账款]），
+不必对每个元素重新运行整条流程。本模块在公式DAG（formula_dag）上保留上一次的全部节点值，
+并建立 变量 → 节点 → 父节点 的反向索引；输入变化时只沿反向边重算受影响的节点，
+某个节点的值没有变化时不再向上传播，更新耗时与改动范围成正比，而不是与报告大小成正比。
+节点按配置的算术后端（默认十进制）计算，结果与逐个元素用公式编译器计算的一致
+"""
+
+import json
+import time
+import heapq
+import argparse
+
+from formula_catalog import get_catalog, DEFAULT_CSV_PATH
+from formula_compiler import strip_key, decimal_context
+from formula_dag import FormulaDAG, node_value, input_value, output_value, is_exact
+
+class IncrementalReport:
+    """保留上一次计算结果的报告，输入变化时只重算受影响的条目及其下游小计"""
+
+    def __init__(self, dag=None, catalog=None, names=None, backend=None):
+        """
+        参数:
+            dag: FormulaDAG，省略时由公式目录构建
+            catalog: FormulaCatalog，省略时加载默认目录
+            names: 报告包含的条目名（及其引用的条目），省略时包含目录中的全部条目
+            backend: 算术后端（float/decimal），省略时使用 ARITHMETIC_CONFIG["backend"]
+        """
+        self.exact = is_exact(backend)
+        if dag is None:
+            dag = FormulaDAG.from_catalog(catalog if catalog is not None else get_catalog(DEFAULT_CSV_PATH), names)
+        self.dag = dag
+        nodes = dag.nodes
+
+        # 反向索引：子节点 → 父节点；变量名 → 读取该变量的节点（var，以及可被输入覆盖的 ref）
+        self.parents = [[] for _ in nodes]
+        self.variable_nodes = {}
+        for node_id, node in enumerate(nodes):
+            kind = node[0]
+            if kind in ('var', 'ref'):
+                self.variable_nodes.setdefault(node[1], []).append(node_id)
+            if kind == 'ref':
+                self.parents[node[2]].append(node_id)
+            elif kind not in ('num', 'var'):
+                for child in node[1:]:
+                    self.parents[child].append(node_id)
+        # 根节点 → 条目名（结构相同的条目共用根节点）
+        self.root_entries = {}
+        for name, root in dag.roots.items():
+            self.root_entries.setdefault(root, []).append(name)
+
+        self.env = {}
+        self.values = [None] * len(nodes)
+        self.elements = {}
+        self.stats = {"updates": 0, "evaluated": 0, "last_evaluated": 0}
+
+    def load(self, inputs):
+        """
+        全量计算一次，作为之后增量更新的基准
+        参数:
+            inputs: {变量名: 数值}，键可带中括号，值可为千分位字符串
+        返回:
+            {条目名: 结果}，缺少变量或除数为零的条目为None
+        """
+        self.env = {}
+        for key, value in inputs.items():
+            number = input_value(value, self.exact)
+            if number is not None:
+                self.env[strip_key(key)] = number
+        values = self.values
+        with decimal_context():
+            for node_id, node in enumerate(self.dag.nodes):
+                values[node_id] = node_value(node, values, self.env, self.exact)
+        self.stats["evaluated"] += len(values)
+        self.stats["last_evaluated"] = len(values)
+        self._write_elements(self.dag.roots)
+        return self.results()
+
+    def results(self):
+        """当前全部条目的结果 {条目名: 结果}"""
+        return {name: output_value(self.values[root]) for name, root in self.dag.roots.items()}
+
+    def dependents(self, names):
+        """
+        变量变化时可能受影响的条目（不计算，只沿反向索引查找）
+        参数:
+            names: 变量名列表，可带中括号
+        返回:
+            条目名列表
+        """
+        seen = set()
+        pending = [node_id for name in names for node_id in self.variable_nodes.get(strip_key(name), ())]
+        entries = []
+        while pending:
+            node_id = pending.pop()
+            if node_id in seen:
+                continue
+            seen.add(node_id)
+            entries.extend(self.root_entries.get(node_id, ()))
+            pending.extend(self.parents[node_id])
+        return entries
+
+    def update(self, changes):
+        """
+        应用输入变化并增量重算
+        参数:
+            changes: {变量名: 新值}，键可带中括号，值为None或空字符串表示删除该变量
+        返回:
+            {条目名: 新结果}，只包含结果发生变化的条目
+        """
+        pending = []
+        for key, value in changes.items():
+            name = strip_key(key)
+            number = input_value(value, self.exact)
+            if self.env.get(name) == number:
+                continue
+            if number is None:
+                self.env.pop(name, None)
+            else:
+                self.env[name] = number
+            pending.extend(self.variable_nodes.get(name, ()))
+
+        # 按节点编号（拓扑顺序）依次出堆：父节点出堆时，它所有发生变化的子节点都已重算
+        heapq.heapify(pending)
+        queued = set(pending)
+        values = self.values
+        nodes = self.dag.nodes
+        changed = {}
+        evaluated = 0
+        with decimal_context():
+            while pending:
+                node_id = heapq.heappop(pending)
+                value = node_value(nodes[node_id], values, self.env, self.exact)
+                evaluated += 1
+                if value == values[node_id]:
+                    continue
+                values[node_id] = value
+                for name in self.root_entries.get(node_id, ()):
+                    changed[name] = output_value(value)
+                for parent in self.parents[node_id]:
+                    if parent not in queued:
+                        queued.add(parent)
+                        heapq.heappush(pending, parent)
+
+        self.stats["updates"] += 1
+        self.stats["evaluated"] += evaluated
+        self.stats["last_evaluated"] = evaluated
+        self._write_elements(changed)
+        return changed
+
+    def bind_elements(self, elements):
+        """
+        绑定报告元素：之后 load/update 会把条目结果写回对应元素的 element_final_value
+        参数:
+            elements: 元素字典列表（格式同input.json），按 element_info.element_content 对应目录条目
+        """
+        self.elements = {}
+        for data in elements:
+            name = data.get('element_info', {}).get('element_content', '')
+            if name in self.dag.roots:
+                self.elements.setdefault(name, []).append(data)
+        self._write_elements(self.dag.roots)
+
+    def _write_elements(self, names):
+        for name in names:
+            for data in self.elements.get(name, ()):
+                data['element_final_value'] = output_value(self.values[self.dag.roots[name]])
+
+def _parse_assignment(text):
+    name, sep, value = text.partition("=")
+    if not sep or not name.strip():
+        raise ValueError(f"无效的赋值: {text!r}，应为 变量名=数值")
+    return name.strip(), value.strip()
+
+def main():
+    """全量计算一份报告后应用输入修改，打印受影响的条目与重算的节点数"""
+    parser = argparse.ArgumentParser(description="输入变化时增量重算报告")
+    parser.add_argument("inputs", help="原始数据JSON文件，{变量名: 数值}")
+    parser.add_argument("--set", dest="changes", action="append", default=[],
+                        help="修改的输入，如 --set 应收账款=1,500,440,211.38（可多次指定，值为空表示删除）")
+    parser.add_argument("--csv", default=DEFAULT_CSV_PATH, help="公式目录CSV路径")
+    parser.add_argument("--names", nargs="*", default=None, help="报告包含的条目名，省略时为目录中的全部条目")
+    args = parser.parse_args()
+
+    with open(args.inputs, 'r', encoding='utf-8') as f:
+        inputs = json.load(f)
+    changes = dict(_parse_assignment(text) for text in args.changes)
+
+    report = IncrementalReport(catalog=get_catalog(args.csv), names=args.names)
+    started = time.perf_counter()
+    results = report.load(inputs)
+    full_time = time.perf_counter() - started
+    computed = sum(1 for value in results.values() if value is not None)
+    print(f"全量计算: {len(results)} 个条目（有结果 {computed} 个），"
+          f"{report.stats['last_evaluated']} 个节点，耗时 {full_time * 1000:.3f} 毫秒")
+    if not changes:
+        return
+
+    print(f"可能受影响的条目: {len(report.dependents(list(changes)))} 个")
+    started = time.perf_counter()
+    changed = report.update(changes)
+    update_time = time.perf_counter() - started
+    print(f"增量更新: 重算 {report.stats['last_evaluated']} 个节点，耗时 {update_time * 1000:.3f} 毫秒")
+    for name, value in changed.items():
+        print(f"  {name}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+LLM响应的磁盘缓存（SQLite）：
+以服务地址和 model、messages、tools、tool_choice 的哈希为键保存 /chat/completions 的响应，
+带过期时间（TTL）和按条目数限制的LRU淘汰。
+重复运行相同的公式与数据时直接返回缓存结果，不再请求LLM
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# 默认缓存文件
+DEFAULT_CACHE_PATH = "/home/super/linchen/250418-accountant-agent/exp/llm_cache.sqlite"
+# 默认过期秒数（7天）与最大条目数
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 100000
+
+# 参与缓存键计算的请求字段
+KEY_FIELDS = ("model", "messages", "tools", "tool_choice")
+
+def cache_key(payload, base_url=None):
+    """
+    计算请求的缓存键
+    参数:
+        payload: /chat/completions 请求体
+        base_url: 服务地址，不同服务（如本地模拟服务与正式服务）的响应互不复用
+    返回:
+        sha256十六进制字符串
+    """
+    material = {field: payload.get(field) for field in KEY_FIELDS}
+    material["base_url"] = base_url.rstrip('/') if base_url else None
+    text = json.dumps(material, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """基于SQLite的LLM响应缓存，可在多个线程间共享"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        参数:
+            path: SQLite文件路径（":memory:" 表示只在内存中缓存）
+            ttl: 过期秒数，None表示不过期
+            max_entries: 最大条目数，超出时淘汰最久未使用的条目
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, payload, base_url=None):
+        """
+        查询缓存
+        参数:
+            payload: 请求体
+            base_url: 服务地址
+        返回:
+            缓存的响应字典，未命中或已过期时返回None
+        """
+        key = cache_key(payload, base_url)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(response)
+
+    def put(self, payload, response, base_url=None):
+        """
+        写入缓存，超出最大条目数时按最近访问时间淘汰
+        参数:
+            payload: 请求体
+            response: 响应字典
+            base_url: 服务地址
+        """
+        key = cache_key(payload, base_url)
+        now = time.time()
+        text = json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, text, now, now)
+            )
+            if self.max_entries:
+                count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+
+    def purge_expired(self):
+        """删除全部过期条目，返回删除的条目数"""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+            return cursor.rowcount
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def main():
+    """查看或清理缓存"""
+    parser = argparse.ArgumentParser(description="LLM响应缓存管理")
+    parser.add_argument("--path", default=DEFAULT_CACHE_PATH, help="缓存文件路径")
+    parser.add_argument("--clear", action="store_true", help="清空缓存")
+    parser.add_argument("--purge", action="store_true", help="删除过期条目")
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.path)
+    if args.clear:
+        cache.clear()
+        print("缓存已清空")
+    elif args.purge:
+        print(f"已删除过期条目: {cache.purge_expired()}")
+    print(f"缓存条目数: {len(cache)}")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,729 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+公共LLM客户端：b_computer_step2、llm_function_call 和 adk_calculator 的
+/chat/completions 调用都经过这里。按主机复用带连接池的 httpx 客户端，
+开启HTTP keep-alive，服务端支持时使用HTTP/2，并可按主机配置连接数上限，
+批量运行时不必为每个公式重新建立TCP/TLS连接。
+所有请求还要经过并发上限（同时在途的请求数）和令牌桶（每秒请求数、每分钟token数）限流，
+吞吐量可以逼近服务商配额而不触发429。
+相同请求（model、messages、tools、tool_choice）的响应保存在磁盘缓存中，重复运行时不再请求。
+超时、连接错误、429和5xx按带抖动的指数退避重试（遵守Retry-After）；
+可选的对冲模式在请求耗时超过近期延迟分位数时再发一个相同请求，取先返回的结果
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import httpx
+
+import llm_cache
+
+# API密钥文件
+API_KEYS_PATH = "/home/super/linchen/000000-api-keys/api_keys.json"
+DEFAULT_PROVIDER = "volcano_engine"
+DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+DEFAULT_MODEL = "deepseek-v3-250324"
+
+# 覆盖服务地址与API密钥的环境变量（如指向 mock_llm_server）
+BASE_URL_ENV = "LLM_BASE_URL"
+API_KEY_ENV = "LLM_API_KEY"
+_endpoint_override = {"base_url": None, "api_key": None}
+
+# 连接池默认配置，可用 configure_pool 修改（全局或按主机）
+POOL_CONFIG = {
+    "max_connections": 64,            # 每个主机的最大连接数
+    "max_keepalive_connections": 32,  # 每个主机保留的空闲keep-alive连接数
+    "keepalive_expiry": 60.0,         # 空闲连接保留秒数
+    "timeout": 60.0,                  # 单次请求超时秒数
+    "connect_timeout": 10.0,          # 建立连接超时秒数
+    "http2": True                     # 服务端支持时使用HTTP/2（需安装h2）
+}
+
+# 按主机覆盖的连接池配置：{主机: {配置项: 值}}
+HOST_POOL_CONFIG = {}
+
+# 限流默认配置，可用 configure_rate_limit 修改；None 表示不限制
+RATE_LIMIT_CONFIG = {
+    "max_in_flight": 16,         # 同时在途的最大请求数
+    "requests_per_second": None, # 每秒请求数
+    "tokens_per_minute": None    # 每分钟token数（按请求体估算，响应后按usage校正）
+}
+
+# 响应缓存配置，可用 configure_cache 修改
+CACHE_CONFIG = {
+    "enabled": True,
+    "path": llm_cache.DEFAULT_CACHE_PATH,
+    "ttl": llm_cache.DEFAULT_TTL,                # 过期秒数，None表示不过期
+    "max_entries": llm_cache.DEFAULT_MAX_ENTRIES # 最大条目数，超出时按LRU淘汰
+}
+
+_sync_clients = {}
+# {事件循环: {主机: 异步客户端}}，按循环对象（而不是 id）区分，
+# 新循环即使复用了旧循环的 id 也不会拿到绑定在已关闭循环上的客户端
+_async_clients = {}
+# 重试配置，可用 configure_retry 修改
+RETRY_CONFIG = {
+    "max_attempts": 4,                          # 含首次请求在内的最多尝试次数
+    "base_delay": 0.5,                          # 退避基数秒数，第n次重试最多等待 base_delay * 2**n
+    "max_delay": 20.0,                          # 单次等待上限秒数（Retry-After 同样受此限制）
+    "retry_statuses": (429, 500, 502, 503, 504) # 需要重试的HTTP状态码
+}
+
+# 对冲请求配置，可用 configure_hedging 修改
+HEDGE_CONFIG = {
+    "enabled": False,
+    "percentile": 95,    # 请求耗时超过近期该分位数时发出对冲请求
+    "min_samples": 20,   # 样本不足时不对冲
+    "window": 500,       # 统计最近多少次请求的耗时
+    "min_delay": 0.2     # 对冲等待时间下限秒数
+}
+
+_clients_lock = threading.Lock()
+_response_cache = None
+
+# 请求计数：HTTP请求数（含重试与对冲）、重试次数、对冲请求数、缓存命中数
+_request_stats = {"requests": 0, "retries": 0, "hedges": 0, "cache_hits": 0}
+_stats_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+def load_api_keys(api_keys_path=API_KEYS_PATH):
+    """加载API密钥配置"""
+    with open(api_keys_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+@lru_cache(maxsize=8)
+def _load_file_config(provider, api_keys_path):
+    config = load_api_keys(api_keys_path).get(provider, {})
+    return config.get("api_key", ""), config.get("base_url", DEFAULT_BASE_URL)
+
+def set_endpoint_override(base_url=None, api_key=None):
+    """
+    覆盖服务地址和API密钥（如指向本地模拟服务），传None取消覆盖
+    也可通过环境变量 LLM_BASE_URL、LLM_API_KEY 设置，函数设置的值优先
+    """
+    _endpoint_override["base_url"] = base_url
+    _endpoint_override["api_key"] = api_key
+
+def load_llm_config(provider=DEFAULT_PROVIDER, api_keys_path=API_KEYS_PATH):
+    """
+    读取LLM服务配置（成功读取后缓存，不再每次调用都读文件）
+    设置了地址覆盖（set_endpoint_override 或环境变量 LLM_BASE_URL/LLM_API_KEY）时优先使用覆盖值，
+    同时覆盖了地址和密钥时不再需要API密钥文件
+    参数:
+        provider: api_keys.json 中的服务名
+        api_keys_path: API密钥文件路径
+    返回:
+        (api_key, base_url)
+    """
+    override_url = _endpoint_override["base_url"] or os.environ.get(BASE_URL_ENV)
+    override_key = _endpoint_override["api_key"]
+    if override_key is None:
+        override_key = os.environ.get(API_KEY_ENV)
+    if override_url and override_key is not None:
+        return override_key, override_url
+    try:
+        api_key, base_url = _load_file_config(provider, api_keys_path)
+    except OSError:
+        if not override_url:
+            raise
+        return "", override_url
+    return (api_key if override_key is None else override_key), (override_url or base_url)
+
+def _host_of(base_url):
+    parts = urlsplit(base_url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def _pool_options(host):
+    options = dict(POOL_CONFIG)
+    options.update(HOST_POOL_CONFIG.get(host, {}))
+    return options
+
+@lru_cache(maxsize=1)
+def http2_available():
+    """是否安装了HTTP/2支持（h2包）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _client_kwargs(host):
+    options = _pool_options(host)
+    return {
+        "base_url": host,
+        "limits": httpx.Limits(
+            max_connections=options["max_connections"],
+            max_keepalive_connections=options["max_keepalive_connections"],
+            keepalive_expiry=options["keepalive_expiry"]
+        ),
+        "timeout": httpx.Timeout(options["timeout"], connect=options["connect_timeout"]),
+        "http2": bool(options["http2"]) and http2_available()
+    }
+
+def configure_pool(host=None, **options):
+    """
+    修改连接池配置，已创建的客户端会被关闭并在下次使用时按新配置重建
+    参数:
+        host: 只修改该主机（如 "https://ark.cn-beijing.volces.com"）的配置，省略时修改全局默认值
+        options: POOL_CONFIG 中的配置项
+    """
+    unknown = set(options) - set(POOL_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的连接池配置项: {', '.join(sorted(unknown))}")
+    if host is None:
+        POOL_CONFIG.update(options)
+    else:
+        HOST_POOL_CONFIG.setdefault(_host_of(host), {}).update(options)
+    close_clients()
+
+def get_client(base_url):
+    """获取（必要时创建）该主机共享的同步客户端"""
+    host = _host_of(base_url)
+    client = _sync_clients.get(host)
+    if client is None:
+        with _clients_lock:
+            client = _sync_clients.get(host)
+            if client is None:
+                client = httpx.Client(**_client_kwargs(host))
+                _sync_clients[host] = client
+    return client
+
+def prune_closed_loops(per_loop):
+    """
+    删除已关闭事件循环的条目（如每次 asyncio.run 结束后留下的客户端、信号量），避免随循环数增长
+    参数:
+        per_loop: {事件循环: 对象} 字典
+    """
+    for loop in [loop for loop in per_loop if loop.is_closed()]:
+        per_loop.pop(loop, None)
+
+def get_async_client(base_url):
+    """获取（必要时创建）该主机在当前事件循环中共享的异步客户端"""
+    host = _host_of(base_url)
+    # 异步客户端不能跨事件循环使用，按事件循环分别保存
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        prune_closed_loops(_async_clients)
+        clients = _async_clients[loop] = {}
+    client = clients.get(host)
+    if client is None or client.is_closed:
+        client = clients[host] = httpx.AsyncClient(**_client_kwargs(host))
+    return client
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：按固定速率补充令牌，容量即允许的突发量。
+    预约时允许令牌暂时为负，调用方按返回的秒数等待，保证长期速率不超过设定值
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        参数:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1.0):
+        """
+        预约令牌
+        参数:
+            amount: 需要的令牌数
+        返回:
+            需要等待的秒数（0表示立即可用）
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def adjust(self, amount):
+        """按实际消耗修正令牌（正数表示多扣，负数表示退还）"""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+class RateLimiter:
+    """并发上限 + 请求速率 + token速率的组合限流器，同时支持线程和协程"""
+
+    def __init__(self, max_in_flight=None, requests_per_second=None, tokens_per_minute=None):
+        self.max_in_flight = max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        # asyncio.Semaphore 绑定事件循环，按循环对象分别创建，已关闭循环的条目在新循环出现时删除
+        self._async_semaphores = {}
+        self.request_bucket = None
+        if requests_per_second:
+            self.request_bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.token_bucket = None
+        if tokens_per_minute:
+            self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+
+    def _reserve(self, tokens):
+        wait_seconds = 0.0
+        if self.request_bucket is not None:
+            wait_seconds = max(wait_seconds, self.request_bucket.reserve(1))
+        if self.token_bucket is not None and tokens:
+            wait_seconds = max(wait_seconds, self.token_bucket.reserve(tokens))
+        return wait_seconds
+
+    def record_usage(self, estimated, actual):
+        """请求完成后按响应中的实际token数校正令牌桶"""
+        if self.token_bucket is not None and actual is not None:
+            self.token_bucket.adjust(actual - estimated)
+
+    @contextmanager
+    def limit(self, tokens=0):
+        """同步限流：获取并发名额并等待令牌"""
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            wait_seconds = self._reserve(tokens)
+            if wait_seconds > 0:
+                time.sleep(wait_seconds)
+            yield
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    @asynccontextmanager
+    async def alimit(self, tokens=0):
+        """异步限流：获取并发名额并等待令牌"""
+        semaphore = None
+        if self.max_in_flight:
+            loop = asyncio.get_running_loop()
+            semaphore = self._async_semaphores.get(loop)
+            if semaphore is None:
+                prune_closed_loops(self._async_semaphores)
+                semaphore = asyncio.Semaphore(self.max_in_flight)
+                self._async_semaphores[loop] = semaphore
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            wait_seconds = self._reserve(tokens)
+            if wait_seconds > 0:
+                await asyncio.sleep(wait_seconds)
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+_rate_limiter = RateLimiter(**RATE_LIMIT_CONFIG)
+
+def configure_rate_limit(**options):
+    """
+    修改限流配置
+    参数:
+        options: RATE_LIMIT_CONFIG 中的配置项（max_in_flight、requests_per_second、tokens_per_minute）
+    """
+    global _rate_limiter
+    unknown = set(options) - set(RATE_LIMIT_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的限流配置项: {', '.join(sorted(unknown))}")
+    RATE_LIMIT_CONFIG.update(options)
+    _rate_limiter = RateLimiter(**RATE_LIMIT_CONFIG)
+
+def estimate_tokens(payload):
+    """
+    粗略估算一次请求消耗的token数：请求体字符数的一半加上 max_tokens 的一小部分
+    参数:
+        payload: 请求体
+    返回:
+        估算的token数
+    """
+    prompt = json.dumps([payload.get("messages"), payload.get("tools")], ensure_ascii=False)
+    return len(prompt) // 2 + min(payload.get("max_tokens") or 0, 256)
+
+def _usage_tokens(response_data):
+    usage = response_data.get("usage") if isinstance(response_data, dict) else None
+    if isinstance(usage, dict):
+        return usage.get("total_tokens")
+    return None
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略"""
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=20.0,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable(self, error):
+        """超时、连接错误和指定状态码的HTTP错误可以重试"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.retry_statuses
+        return isinstance(error, httpx.TransportError)
+
+    @staticmethod
+    def retry_after(error):
+        """解析响应中的Retry-After（秒数或HTTP日期），没有时返回None"""
+        if not isinstance(error, httpx.HTTPStatusError):
+            return None
+        value = error.response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, error):
+        """
+        计算第attempt次失败后的等待秒数
+        参数:
+            attempt: 已失败的次数（从0开始）
+            error: 本次失败的异常
+        返回:
+            等待秒数：服务端给出Retry-After时照做，否则在 [0, base_delay * 2**attempt] 内随机（full jitter）
+        """
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+class LatencyTracker:
+    """记录最近请求的耗时，用于计算对冲阈值"""
+
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent, min_samples=1):
+        """返回耗时的percent分位数，样本不足时返回None"""
+        with self.lock:
+            if len(self.samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+        return ordered[index]
+
+_retry_policy = RetryPolicy(**RETRY_CONFIG)
+_latency = LatencyTracker(HEDGE_CONFIG["window"])
+_hedge_executor = None
+_hedge_lock = threading.Lock()
+
+def configure_retry(**options):
+    """
+    修改重试配置
+    参数:
+        options: RETRY_CONFIG 中的配置项
+    """
+    global _retry_policy
+    unknown = set(options) - set(RETRY_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的重试配置项: {', '.join(sorted(unknown))}")
+    RETRY_CONFIG.update(options)
+    _retry_policy = RetryPolicy(**RETRY_CONFIG)
+
+def configure_hedging(**options):
+    """
+    修改对冲请求配置
+    参数:
+        options: HEDGE_CONFIG 中的配置项
+    """
+    global _latency
+    unknown = set(options) - set(HEDGE_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的对冲配置项: {', '.join(sorted(unknown))}")
+    HEDGE_CONFIG.update(options)
+    if "window" in options:
+        _latency = LatencyTracker(HEDGE_CONFIG["window"])
+
+def hedge_delay():
+    """当前的对冲等待秒数，未开启对冲或样本不足时返回None"""
+    if not HEDGE_CONFIG["enabled"]:
+        return None
+    threshold = _latency.percentile(HEDGE_CONFIG["percentile"], HEDGE_CONFIG["min_samples"])
+    if threshold is None:
+        return None
+    return max(HEDGE_CONFIG["min_delay"], threshold)
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=max(4, (RATE_LIMIT_CONFIG["max_in_flight"] or 16) * 2),
+                    thread_name_prefix="llm-hedge"
+                )
+    return _hedge_executor
+
+def get_response_cache():
+    """获取（必要时打开）响应缓存，缓存关闭或无法打开时返回None"""
+    global _response_cache
+    if not CACHE_CONFIG["enabled"]:
+        return None
+    if _response_cache is None:
+        with _cache_lock:
+            if _response_cache is None and CACHE_CONFIG["enabled"]:
+                try:
+                    _response_cache = llm_cache.ResponseCache(
+                        CACHE_CONFIG["path"], CACHE_CONFIG["ttl"], CACHE_CONFIG["max_entries"]
+                    )
+                except Exception as e:
+                    print(f"无法打开LLM响应缓存 {CACHE_CONFIG['path']}: {str(e)}，本次运行不使用缓存")
+                    CACHE_CONFIG["enabled"] = False
+    return _response_cache
+
+def configure_cache(**options):
+    """
+    修改响应缓存配置，已打开的缓存会被关闭并在下次使用时按新配置打开
+    参数:
+        options: CACHE_CONFIG 中的配置项（enabled、path、ttl、max_entries）
+    """
+    global _response_cache
+    unknown = set(options) - set(CACHE_CONFIG)
+    if unknown:
+        raise ValueError(f"未知的缓存配置项: {', '.join(sorted(unknown))}")
+    with _cache_lock:
+        CACHE_CONFIG.update(options)
+        if _response_cache is not None:
+            _response_cache.close()
+            _response_cache = None
+
+def _cacheable(response_data):
+    return isinstance(response_data, dict) and bool(response_data.get("choices"))
+
+def _request_args(base_url, api_key):
+    if base_url is None or api_key is None:
+        config_key, config_url = load_llm_config()
+        base_url = base_url or config_url
+        api_key = api_key if api_key is not None else config_key
+    url = f"{base_url.rstrip('/')}/chat/completions"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    return base_url, url, headers
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _request_stats[name] += amount
+
+def get_request_stats():
+    """返回请求计数的副本：requests、retries、hedges、cache_hits"""
+    with _stats_lock:
+        return dict(_request_stats)
+
+def reset_request_stats():
+    """清零请求计数"""
+    with _stats_lock:
+        for name in _request_stats:
+            _request_stats[name] = 0
+
+def _describe_error(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    return type(error).__name__
+
+def _send_once(base_url, url, kwargs, tokens, admitted=None):
+    """经过限流发送一次同步请求；admitted（threading.Event）在通过限流器、开始发送时置位"""
+    _count("requests")
+    try:
+        with _rate_limiter.limit(tokens):
+            if admitted is not None:
+                admitted.set()
+            started = time.perf_counter()
+            response = get_client(base_url).post(url, **kwargs)
+            _latency.record(time.perf_counter() - started)
+    finally:
+        if admitted is not None:
+            admitted.set()
+    response.raise_for_status()
+    return response.json()
+
+async def _asend_once(base_url, url, kwargs, tokens, admitted=None):
+    """经过限流发送一次异步请求；admitted（asyncio.Event）在通过限流器、开始发送时置位"""
+    _count("requests")
+    try:
+        async with _rate_limiter.alimit(tokens):
+            if admitted is not None:
+                admitted.set()
+            started = time.perf_counter()
+            response = await get_async_client(base_url).post(url, **kwargs)
+            _latency.record(time.perf_counter() - started)
+    finally:
+        if admitted is not None:
+            admitted.set()
+    response.raise_for_status()
+    return response.json()
+
+def _send_hedged(base_url, url, kwargs, tokens):
+    """同步发送；超过对冲阈值仍未返回时再发一个相同请求，取先成功的结果"""
+    delay = hedge_delay()
+    if delay is None:
+        return _send_once(base_url, url, kwargs, tokens)
+    executor = _get_hedge_executor()
+    admitted = threading.Event()
+    pending = {executor.submit(_send_once, base_url, url, kwargs, tokens, admitted)}
+    # 阈值只统计通过限流器之后的耗时，在限流器中排队的时间不计入，排队的请求不对冲
+    admitted.wait()
+    done, pending = wait_futures(pending, timeout=delay)
+    if not done:
+        _count("hedges")
+        pending.add(executor.submit(_send_once, base_url, url, kwargs, tokens))
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                # 同步请求无法中断，落后的请求在后台完成后被丢弃
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+
+def _start_task(coro):
+    task = asyncio.ensure_future(coro)
+    # 落败的对冲请求的异常无人读取，在此取走以免事件循环报警
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+async def _asend_hedged(base_url, url, kwargs, tokens):
+    """异步发送；超过对冲阈值仍未返回时再发一个相同请求，取先成功的结果并取消另一个"""
+    delay = hedge_delay()
+    if delay is None:
+        return await _asend_once(base_url, url, kwargs, tokens)
+    admitted = asyncio.Event()
+    pending = {_start_task(_asend_once(base_url, url, kwargs, tokens, admitted))}
+    error = None
+    try:
+        # 阈值只统计通过限流器之后的耗时，在限流器中排队的时间不计入，排队的请求不对冲
+        await admitted.wait()
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            _count("hedges")
+            pending.add(_start_task(_asend_once(base_url, url, kwargs, tokens)))
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+def chat_completion(payload, base_url=None, api_key=None, timeout=None, use_cache=True):
+    """
+    同步调用 /chat/completions，失败时按重试策略重试
+    参数:
+        payload: 请求体（model、messages、tools 等）
+        base_url: 服务地址，省略时读取API密钥文件
+        api_key: API密钥，省略时读取API密钥文件
+        timeout: 本次请求的超时秒数，省略时使用连接池配置
+        use_cache: 是否使用响应缓存
+    返回:
+        响应JSON字典，重试用尽后抛出最后一次的异常（如 httpx.HTTPStatusError）
+    """
+    # 先解析服务地址：缓存按地址区分，模拟服务的响应不会返回给正式服务的请求
+    base_url, url, headers = _request_args(base_url, api_key)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(payload, base_url)
+        if cached is not None:
+            _count("cache_hits")
+            return cached
+    kwargs = {"headers": headers, "json": payload}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    tokens = estimate_tokens(payload)
+    policy = _retry_policy
+    attempt = 0
+    while True:
+        try:
+            response_data = _send_hedged(base_url, url, kwargs, tokens)
+            break
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not policy.is_retryable(e):
+                raise
+            delay = policy.delay(attempt, e)
+            print(f"LLM请求失败（{_describe_error(e)}），{delay:.1f}秒后第{attempt + 2}次尝试")
+            _count("retries")
+            time.sleep(delay)
+            attempt += 1
+    _rate_limiter.record_usage(tokens, _usage_tokens(response_data))
+    if cache is not None and _cacheable(response_data):
+        cache.put(payload, response_data, base_url)
+    return response_data
+
+async def achat_completion(payload, base_url=None, api_key=None, timeout=None, use_cache=True):
+    """
+    异步调用 /chat/completions，参数与 chat_completion 相同
+    """
+    # 先解析服务地址：缓存按地址区分，模拟服务的响应不会返回给正式服务的请求
+    base_url, url, headers = _request_args(base_url, api_key)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(payload, base_url)
+        if cached is not None:
+            _count("cache_hits")
+            return cached
+    kwargs = {"headers": headers, "json": payload}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    tokens = estimate_tokens(payload)
+    policy = _retry_policy
+    attempt = 0
+    while True:
+        try:
+            response_data = await _asend_hedged(base_url, url, kwargs, tokens)
+            break
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not policy.is_retryable(e):
+                raise
+            delay = policy.delay(attempt, e)
+            print(f"LLM请求失败（{_describe_error(e)}），{delay:.1f}秒后第{attempt + 2}次尝试")
+            _count("retries")
+            await asyncio.sleep(delay)
+            attempt += 1
+    _rate_limiter.record_usage(tokens, _usage_tokens(response_data))
+    if cache is not None and _cacheable(response_data):
+        cache.put(payload, response_data, base_url)
+    return response_data
+
+def close_clients():
+    """关闭全部同步客户端（异步客户端在各自事件循环中用 aclose_clients 关闭）"""
+    with _clients_lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+async def aclose_clients():
+    """关闭当前事件循环中的异步客户端"""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
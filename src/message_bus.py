@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A计算机与B计算机之间的元素消息总线，替代经由 exp/ 目录JSON文件的交接：
+同一进程内通过队列直接传递元素字典（不做序列化），
+A、B分处不同进程或机器时通过本地套接字（TCP）或Unix域套接字传递，
+消息按 wire_codec 编码：每个元素的静态部分只发送一次，之后只发送变化字段（msgpack或紧凑JSON）。
+写入 exp/input.json、b1.json、a2.json、b2.json 变为可选的审计输出（AuditSink）
+
+消息阶段：
+    input  A → B  原始元素
+    b1     B → A  填入计算公式后的元素
+    a2     A → B  注入变量数据后的元素
+    b2     B → A  写入计算结果后的元素
+编解码器按 element_uuid 缓存各元素的上一条消息：b2 之后两端各自删除该元素的缓存；
+A端不再发送 a2（存在空值变量或出错）时发送一条 release 控制帧，通知B端删除
+"""
+
+import os
+import json
+import queue
+import threading
+from collections import namedtuple
+from multiprocessing.connection import Listener, Client
+
+from wire_codec import ElementCodec
+
+from b_computer_step1 import fill_formula
+from a_computer_step2 import inject_variables
+from b_computer_step2 import compute_result, EVALUATION_MODE
+
+# 审计输出目录
+DEFAULT_AUDIT_DIR = "/home/super/linchen/250418-accountant-agent/exp"
+
+# 消息阶段及其接收方
+STAGES = ("input", "b1", "a2", "b2")
+STAGE_RECEIVERS = {"input": "B", "b1": "A", "a2": "B", "b2": "A"}
+
+# 控制帧：通知对端删除某个元素的编解码缓存，由 receive 内部处理，不作为消息返回
+RELEASE_STAGE = "release"
+
+# 传输方式：inproc 进程内队列；tcp 本地或远程套接字；unix Unix域套接字
+TRANSPORTS = ("inproc", "tcp", "unix")
+DEFAULT_TCP_ADDRESS = "127.0.0.1:18600"
+DEFAULT_UNIX_ADDRESS = "/tmp/accountant-agent-bus.sock"
+
+# 一条消息：阶段、元素字典、附加信息（如 {"empty_vars": [...]}）
+Message = namedtuple("Message", ["stage", "data", "meta"])
+
+# 队列中表示对端已关闭的标记
+_CLOSED = object()
+
+class AuditSink:
+    """把经过总线的消息写为 exp/<阶段>.json，格式与原先的交接文件相同，便于检查"""
+
+    def __init__(self, directory=DEFAULT_AUDIT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, stage):
+        return os.path.join(self.directory, f"{stage}.json")
+
+    def write(self, message):
+        text = json.dumps(message.data, ensure_ascii=False, indent=2)
+        with self._lock:
+            with open(self.path(message.stage), 'w', encoding='utf-8') as f:
+                f.write(text)
+
+class QueueEndpoint:
+    """进程内总线的一端：元素字典按引用传递，不做序列化"""
+
+    def __init__(self, outbox, inbox, audit=None):
+        self._outbox = outbox
+        self._inbox = inbox
+        self.audit = audit
+
+    def send(self, stage, data, meta=None):
+        message = Message(stage, data, meta or {})
+        if self.audit is not None:
+            self.audit.write(message)
+        self._outbox.put(message)
+
+    def receive(self, timeout=None):
+        """
+        接收一条消息
+        参数:
+            timeout: 等待秒数，None表示一直等待
+        返回:
+            Message；对端已关闭时返回None，超时抛出 TimeoutError
+        """
+        try:
+            message = self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"等待消息超时（{timeout}秒）")
+        if message is _CLOSED:
+            return None
+        return message
+
+    def forget(self, uuid):
+        """进程内传递不做编码，没有需要删除的缓存"""
+
+    def release(self, uuid):
+        """进程内传递不做编码，没有需要删除的缓存"""
+
+    def close(self):
+        self._outbox.put(_CLOSED)
+
+class ConnectionEndpoint:
+    """套接字总线的一端：消息经 ElementCodec 编码后按帧发送"""
+
+    def __init__(self, connection, audit=None, wire_format=None):
+        """
+        参数:
+            connection: multiprocessing.connection.Connection
+            audit: AuditSink
+            wire_format: 发送时的编码方式（msgpack/json），None表示安装了msgpack时用msgpack
+        """
+        self._connection = connection
+        self._send_lock = threading.Lock()
+        self.codec = ElementCodec(wire_format)
+        self.audit = audit
+
+    def send(self, stage, data, meta=None):
+        message = Message(stage, data, meta or {})
+        if self.audit is not None:
+            self.audit.write(message)
+        with self._send_lock:
+            self._connection.send_bytes(self.codec.encode(stage, data, message.meta))
+
+    def receive(self, timeout=None):
+        """
+        接收一条消息
+        参数:
+            timeout: 等待秒数，None表示一直等待
+        返回:
+            Message；对端已关闭时返回None，超时抛出 TimeoutError
+        """
+        try:
+            ready = timeout is None or self._connection.poll(timeout)
+        except (EOFError, OSError):
+            return None
+        if not ready:
+            raise TimeoutError(f"等待消息超时（{timeout}秒）")
+        try:
+            payload = self._connection.recv_bytes()
+        except (EOFError, OSError):
+            return None
+        message = Message(*self.codec.decode(payload))
+        if message.stage == RELEASE_STAGE:
+            self.codec.forget(message.meta.get("element_uuid"))
+            return self.receive(timeout)
+        return message
+
+    def forget(self, uuid):
+        """删除本端某个元素的编解码缓存（对端在同一时刻也删除时使用）"""
+        self.codec.forget(uuid)
+
+    def release(self, uuid):
+        """删除本端某个元素的编解码缓存，并通知对端删除"""
+        self.codec.forget(uuid)
+        try:
+            with self._send_lock:
+                self._connection.send_bytes(self.codec.encode(RELEASE_STAGE, None, {"element_uuid": uuid}))
+        except OSError:
+            # 对端已关闭，无需通知
+            pass
+
+    def close(self):
+        self._connection.close()
+
+def create_inproc_pair(audit=None):
+    """
+    创建进程内总线
+    参数:
+        audit: AuditSink，None表示不写审计文件
+    返回:
+        (A端, B端)
+    """
+    a_to_b = queue.Queue()
+    b_to_a = queue.Queue()
+    return QueueEndpoint(a_to_b, b_to_a, audit), QueueEndpoint(b_to_a, a_to_b, audit)
+
+def parse_address(transport, address=None):
+    """
+    解析套接字地址
+    参数:
+        transport: "tcp" 或 "unix"
+        address: tcp 为 "主机:端口"，unix 为套接字文件路径；None表示默认地址
+    返回:
+        (地址, multiprocessing.connection 的 family)
+    """
+    if transport == "tcp":
+        host, sep, port = (address or DEFAULT_TCP_ADDRESS).rpartition(":")
+        if not sep or not port.isdigit():
+            raise ValueError(f"无效的TCP地址: {address}")
+        return (host or "127.0.0.1", int(port)), "AF_INET"
+    if transport == "unix":
+        return address or DEFAULT_UNIX_ADDRESS, "AF_UNIX"
+    raise ValueError(f"未知的传输方式: {transport}")
+
+def listen(transport, address=None, authkey=None, audit=None, wire_format=None):
+    """
+    监听并等待对端连接（通常由B计算机调用）
+    参数:
+        transport: "tcp" 或 "unix"
+        address: 监听地址
+        authkey: 连接认证密钥（bytes），跨机器时建议设置
+        audit: AuditSink
+        wire_format: 发送时的编码方式（msgpack/json）
+    返回:
+        ConnectionEndpoint
+    """
+    address, family = parse_address(transport, address)
+    if family == "AF_UNIX" and os.path.exists(address):
+        os.remove(address)
+    with Listener(address, family, authkey=authkey) as listener:
+        print(f"消息总线：在 {address} 等待连接...")
+        connection = listener.accept()
+    return ConnectionEndpoint(connection, audit, wire_format)
+
+def connect(transport, address=None, authkey=None, audit=None, wire_format=None):
+    """
+    连接到对端（通常由A计算机调用）
+    参数:
+        transport: "tcp" 或 "unix"
+        address: 对端地址
+        authkey: 连接认证密钥（bytes）
+        audit: AuditSink
+        wire_format: 发送时的编码方式（msgpack/json）
+    返回:
+        ConnectionEndpoint
+    """
+    address, family = parse_address(transport, address)
+    return ConnectionEndpoint(Client(address, family, authkey=authkey), audit, wire_format)
+
+def create_socket_pair(transport, address=None, authkey=None, audit=None, wire_format=None):
+    """
+    在同一进程内建立一对经由套接字相连的端点（用于测试套接字传输的开销）
+    返回:
+        (A端, B端)
+    """
+    address, family = parse_address(transport, address)
+    if family == "AF_UNIX" and os.path.exists(address):
+        os.remove(address)
+    accepted = {}
+    with Listener(address, family, authkey=authkey) as listener:
+        thread = threading.Thread(target=lambda: accepted.setdefault("connection", listener.accept()))
+        thread.start()
+        client = Client(listener.address, family, authkey=authkey)
+        thread.join()
+    return (ConnectionEndpoint(client, audit, wire_format),
+            ConnectionEndpoint(accepted["connection"], audit, wire_format))
+
+def serve_b(endpoint, eval_mode=EVALUATION_MODE):
+    """
+    B计算机角色：处理 input（查找公式）与 a2（计算结果）消息，直到对端关闭
+    参数:
+        endpoint: B端
+        eval_mode: 公式计算模式（auto/local/llm）
+    返回:
+        处理的消息数
+    """
+    handled = 0
+    while True:
+        message = endpoint.receive()
+        if message is None:
+            return handled
+        reply = "b1" if message.stage == "input" else "b2"
+        try:
+            if message.stage == "input":
+                endpoint.send("b1", fill_formula(message.data))
+            elif message.stage == "a2":
+                endpoint.send("b2", compute_result(message.data, eval_mode))
+            else:
+                raise ValueError(f"B计算机收到未知阶段的消息: {message.stage}")
+        except Exception as e:
+            # 出错时回复原阶段的下一条消息并附带错误，A端不至于一直等待
+            endpoint.send(reply, message.data, {"error": str(e)})
+        if reply == "b2" and isinstance(message.data, dict):
+            # b2 是一个元素的最后一条消息，A端收到后同样删除
+            endpoint.forget(message.data.get("element_uuid"))
+        handled += 1
+
+def _expect(endpoint, stage, timeout):
+    return _check_reply(endpoint.receive(timeout), stage)
+
+def _check_reply(message, stage):
+    if message is None:
+        raise ConnectionError("消息总线对端已关闭")
+    if message.stage != stage:
+        raise ValueError(f"收到的消息阶段为 {message.stage}，应为 {stage}")
+    if message.meta.get("error"):
+        raise RuntimeError(f"B计算机处理出错: {message.meta['error']}")
+    return message.data
+
+def run_a(endpoint, data, timeout=None, on_stage=None):
+    """
+    A计算机角色：发送元素，取回公式后注入变量，再取回计算结果
+    参数:
+        endpoint: A端
+        data: 原始元素字典
+        timeout: 每次等待B计算机回复的秒数
+        on_stage: 回调 (阶段, 元素字典)，每个阶段完成后调用（用于快照与计时）
+    返回:
+        (最终元素字典, 空值变量列表)；存在空值变量时不再发送给B计算机，返回a2阶段的元素
+    """
+    notify = on_stage or (lambda stage, element: None)
+    uuid = data.get("element_uuid")
+    received_b2 = False
+    try:
+        notify("input", data)
+        endpoint.send("input", data)
+        data = _expect(endpoint, "b1", timeout)
+        notify("b1", data)
+
+        data, empty_vars = inject_variables(data)
+        notify("a2", data)
+        if empty_vars:
+            # 不发送给B计算机，但仍写出审计文件以便检查
+            if endpoint.audit is not None:
+                endpoint.audit.write(Message("a2", data, {"empty_vars": empty_vars}))
+            return data, empty_vars
+
+        endpoint.send("a2", data)
+        message = endpoint.receive(timeout)
+        # B端发出 b2 后已删除该元素的缓存（出错的 b2 回复也是如此）
+        received_b2 = message is not None and message.stage == "b2"
+        data = _check_reply(message, "b2")
+        notify("b2", data)
+        return data, []
+    finally:
+        if received_b2:
+            endpoint.forget(uuid)
+        else:
+            endpoint.release(uuid)
+
+def start_b_thread(endpoint, eval_mode=EVALUATION_MODE):
+    """在后台线程中运行B计算机角色（进程内总线使用）"""
+    thread = threading.Thread(target=serve_b, args=(endpoint, eval_mode), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的OpenAI兼容 /chat/completions 服务，用于离线压测：
+按请求中的工具和问题格式返回正确的 tool_calls（evaluate_expression、submit_plan、evaluate），
+收到工具结果后返回最终答案；可配置延迟分布、错误率、429限流比例和每秒请求上限，
+用于在单机上测试并发、连接池、重试与对冲请求的逻辑。
+
+使用方式：
+    python src/mock_llm_server.py --port 18080 --latency lognormal:-3,0.5 --rate-limit-rate 0.05
+    LLM_BASE_URL=http://127.0.0.1:18080/api/v3 LLM_API_KEY=mock python src/run_batch.py ...
+"""
+
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from llm_client import TokenBucket, estimate_tokens, DEFAULT_MODEL
+from formula_compiler import compile_formula, strip_key, to_decimal, unresolved_variables, FormulaError
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 18080
+
+# 延迟分布：none、fixed:秒、uniform:下限,上限、normal:均值,标准差、lognormal:mu,sigma、exponential:均值
+LATENCY_DISTRIBUTIONS = ("none", "fixed", "uniform", "normal", "lognormal", "exponential")
+
+# b_computer_step2 的用户消息："表达式: F\n变量: {...}\n请计算结果。"
+EXPRESSION_PATTERN = re.compile(r'表达式:\s*(?P<formula>.*?)\n变量:\s*(?P<variables>\{.*\})', re.S)
+# adk_calculator / llm_function_call 的问题："X是v，...为了计算出N，应该遵守"formula": "F"，请问N是多少？"
+QUESTION_PATTERN = re.compile(r'^(?P<variables>.*?)为了计算出.*?"formula":\s*"(?P<formula>.*)"，请问', re.S)
+
+def parse_latency(spec):
+    """
+    解析延迟分布
+    参数:
+        spec: 如 "fixed:0.05"、"uniform:0.01,0.2"、"lognormal:-3,0.5"，None或"none"表示无延迟
+    返回:
+        rng -> 秒数 的函数
+    """
+    if not spec or spec == "none":
+        return lambda rng: 0.0
+    name, _, args = spec.partition(":")
+    if name not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"未知的延迟分布: {name}")
+    try:
+        params = [float(value) for value in args.split(",")] if args else []
+    except ValueError:
+        raise ValueError(f"延迟分布参数无效: {spec}")
+    expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}[name]
+    if len(params) != expected:
+        raise ValueError(f"延迟分布 {name} 需要 {expected} 个参数: {spec}")
+    if name == "fixed":
+        return lambda rng: params[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    return lambda rng: rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+
+def format_number(value):
+    """把数值写成不带指数的十进制文本（公式词法不支持 1e+20 形式）"""
+    text = format(to_decimal(value).normalize(), 'f')
+    return text if text != "-0" else "0"
+
+def parse_question(text):
+    """
+    从自然语言问题中取出公式和变量
+    返回:
+        (公式, {变量名: 值})，格式不符时返回None
+    """
+    match = QUESTION_PATTERN.search(text)
+    if match is None:
+        return None
+    variables = {}
+    for item in match.group("variables").split("，"):
+        name, sep, value = item.rpartition("是")
+        if sep and name.strip():
+            variables[name.strip()] = value.strip()
+    return match.group("formula"), variables
+
+def _render(node, env):
+    """把AST代入变量值后写回算式文本（加括号保证运算顺序不变）"""
+    kind = node[0]
+    if kind == 'num':
+        return format_number(node[1])
+    if kind == 'var':
+        text = format_number(env[node[1]])
+        return f"({text})" if text.startswith("-") else text
+    if kind == 'neg':
+        return f"(-{_render(node[1], env)})"
+    if kind == 'coalesce':
+        # 代入第一个可求值的参数
+        for child in node[1:]:
+            if not unresolved_variables(child, env.__contains__):
+                return _render(child, env)
+        raise FormulaError("coalesce 的参数均缺少变量")
+    op = {'add': '+', 'sub': '-', 'mul': '*', 'div': '/'}[kind]
+    return f"({_render(node[1], env)}{op}{_render(node[2], env)})"
+
+def substitute(formula, variables):
+    """
+    把公式中的变量替换为数值，得到只含数字的算式
+    参数:
+        formula: 公式
+        variables: {变量名: 值}，键可带中括号
+    返回:
+        算式文本；缺少变量时抛出 FormulaError，数值无效时抛出 ValueError
+    """
+    compiled = compile_formula(formula)
+    env = {}
+    for key, value in variables.items():
+        if value is not None and str(value).strip() != '':
+            env[strip_key(key)] = value
+    missing = compiled.missing_variables(env)
+    if missing:
+        raise FormulaError(f"缺少变量: {', '.join(missing)}")
+    return _render(compiled.ast, env)
+
+def _tool_names(payload):
+    names = []
+    for tool in payload.get("tools") or []:
+        function = tool.get("function") if isinstance(tool, dict) else None
+        if isinstance(function, dict) and function.get("name"):
+            names.append(function["name"])
+    return names
+
+def _forced_tool(payload):
+    choice = payload.get("tool_choice")
+    if isinstance(choice, dict):
+        return (choice.get("function") or {}).get("name")
+    return None
+
+def _message_text(message):
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+def _tool_result_value(content):
+    """从工具结果消息中取出数值：{"status": "success", "result": x}、{"result": x} 或纯数字"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(data, dict):
+        data = data.get("result")
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        return data
+    return None
+
+def build_reply(payload):
+    """
+    按请求内容生成模型回复
+    参数:
+        payload: /chat/completions 请求体
+    返回:
+        (message字典, finish_reason)
+    """
+    messages = payload.get("messages") or []
+    tools = _tool_names(payload)
+
+    # 已经有工具结果：给出最终答案
+    if messages and messages[-1].get("role") == "tool":
+        value = _tool_result_value(messages[-1].get("content"))
+        text = f"计算结果是 {format_number(value)}" if value is not None else "无法得到计算结果"
+        return {"role": "assistant", "content": text}, "stop"
+
+    user_text = ""
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            user_text = _message_text(message)
+            break
+
+    parsed = None
+    match = EXPRESSION_PATTERN.search(user_text)
+    if match is not None:
+        try:
+            parsed = (match.group("formula").strip(), json.loads(match.group("variables")))
+        except ValueError:
+            parsed = None
+    if parsed is None:
+        parsed = parse_question(user_text)
+    if parsed is None:
+        return {"role": "assistant", "content": "无法识别的计算问题"}, "stop"
+    formula, variables = parsed
+
+    forced = _forced_tool(payload)
+    if forced == "evaluate_expression" or (forced is None and "evaluate_expression" in tools):
+        name, arguments = "evaluate_expression", {"expression": formula, "variables": variables}
+    elif forced == "submit_plan" or (forced is None and "submit_plan" in tools):
+        try:
+            name, arguments = "submit_plan", {"expression": substitute(formula, variables)}
+        except ValueError as e:
+            return {"role": "assistant", "content": f"无法制定计算计划: {str(e)}"}, "stop"
+    elif "evaluate" in tools:
+        name, arguments = "evaluate", {"expression": formula, "variables": variables}
+    else:
+        # 没有可用的整式工具：直接回答
+        try:
+            value = compile_formula(formula).evaluate(variables, "decimal")
+        except ValueError as e:
+            return {"role": "assistant", "content": f"无法计算: {str(e)}"}, "stop"
+        return {"role": "assistant", "content": f"计算结果是 {format_number(value)}"}, "stop"
+
+    tool_call = {
+        "id": f"call_{random.getrandbits(48):012x}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}
+    }
+    return {"role": "assistant", "content": None, "tool_calls": [tool_call]}, "tool_calls"
+
+class MockLLMServer:
+    """模拟LLM服务，可在测试或基准测试中嵌入运行"""
+
+    def __init__(self, host=DEFAULT_HOST, port=0, latency=None, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, max_rps=None, seed=None):
+        """
+        参数:
+            host: 监听地址
+            port: 端口，0表示自动分配
+            latency: 延迟分布（见 parse_latency）
+            error_rate: 返回500的比例
+            rate_limit_rate: 随机返回429的比例
+            retry_after: 429响应的 Retry-After 秒数
+            max_rps: 每秒请求上限，超出时返回429；None表示不限
+            seed: 随机数种子
+        """
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.bucket = TokenBucket(max_rps, max(1.0, max_rps)) if max_rps else None
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def _draw(self):
+        """抽取本次请求的延迟与结果类型"""
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = self.latency(self._rng)
+            roll = self._rng.random()
+        if self.bucket is not None:
+            wait = self.bucket.reserve(1.0)
+            if wait > 0:
+                self.bucket.adjust(-1.0)
+                return delay, 429, max(1, math.ceil(wait))
+        if roll < self.rate_limit_rate:
+            return delay, 429, self.retry_after
+        if roll < self.rate_limit_rate + self.error_rate:
+            return delay, 500, None
+        return delay, 200, None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"未知的路径: {self.path}"}})
+                    return
+                try:
+                    payload = json.loads(raw)
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "请求体不是有效的JSON"}})
+                    return
+
+                delay, status, retry_after = server._draw()
+                if delay > 0:
+                    time.sleep(delay)
+                if status == 429:
+                    with server._lock:
+                        server.stats["rate_limited"] += 1
+                    self._send_json(429, {"error": {"message": "请求过于频繁", "type": "rate_limit_exceeded"}},
+                                    {"Retry-After": format_number(retry_after)})
+                    return
+                if status != 200:
+                    with server._lock:
+                        server.stats["errors"] += 1
+                    self._send_json(status, {"error": {"message": "模拟的服务端错误", "type": "server_error"}})
+                    return
+
+                message, finish_reason = build_reply(payload)
+                prompt_tokens = estimate_tokens(dict(payload, max_tokens=0))
+                completion_tokens = len(json.dumps(message, ensure_ascii=False)) // 2
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{random.getrandbits(48):012x}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", DEFAULT_MODEL),
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    }
+                })
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """在后台线程中启动服务"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """停止服务并关闭监听端口"""
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容LLM服务（离线压测用）")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--latency", default="none",
+                        help="延迟分布：none、fixed:秒、uniform:a,b、normal:均值,标准差、lognormal:mu,sigma、exponential:均值")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="随机返回429的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429响应的Retry-After秒数")
+    parser.add_argument("--max-rps", type=float, default=None, help="每秒请求上限，超出时返回429")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.latency, args.error_rate, args.rate_limit_rate,
+                           args.retry_after, args.max_rps, args.seed)
+    print(f"模拟LLM服务已启动: {server.base_url}")
+    print(f"使用方式: LLM_BASE_URL={server.base_url} LLM_API_KEY=mock")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"请求数: {server.stats['requests']}, 500: {server.stats['errors']}, "
+              f"429: {server.stats['rate_limited']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+整份报告的依赖调度：
+根据公式目录建立报告中各元素之间的依赖关系（如资产总计、负债合计依赖的小计，
+以及 [X_T-1] 需要的上期值），按拓扑顺序执行，互不依赖的元素并发计算，
+已算出的结果直接作为下游公式的变量，每个条目在一份报告中只计算（或调用LLM）一次
+"""
+
+import json
+import argparse
+from graphlib import TopologicalSorter, CycleError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from formula_catalog import get_catalog, DEFAULT_CSV_PATH, BRACKET_VARIABLE_PATTERN
+from formula_compiler import compile_formula, strip_key, FormulaError
+from formula_dag import input_value
+from b_computer_step2 import evaluate_formula_value, EVALUATION_MODE, EVALUATION_MODES
+
+# 上期变量后缀
+PRIOR_SUFFIX = "_T-1"
+
+class ReportTask:
+    """调度中的一个计算任务：某个条目在本期(T)或上期(T-1)的值"""
+
+    __slots__ = ("key", "name", "prior", "formula", "variables", "deps")
+
+    def __init__(self, name, prior, formula, variables):
+        self.name = name
+        self.prior = prior
+        # 任务结果写回的变量名，上期任务即 "X_T-1"
+        self.key = name + PRIOR_SUFFIX if prior else name
+        self.formula = formula
+        self.variables = variables
+        self.deps = []
+
+class ReportScheduler:
+    """按依赖关系调度整份报告的公式计算"""
+
+    def __init__(self, catalog=None, max_workers=8, eval_mode=EVALUATION_MODE):
+        """
+        参数:
+            catalog: FormulaCatalog，省略时加载默认目录
+            max_workers: 并发计算的最大任务数
+            eval_mode: 公式计算模式（auto/local/llm），见 b_computer_step2.evaluate_formula_value
+        """
+        self.catalog = catalog if catalog is not None else get_catalog(DEFAULT_CSV_PATH)
+        self.max_workers = max_workers
+        self.eval_mode = eval_mode
+
+    @staticmethod
+    def _formula_variables(formula):
+        try:
+            return compile_formula(formula).variables
+        except FormulaError:
+            # 无法解析的公式只能交给LLM，依赖按中括号变量估计
+            return tuple(dict.fromkeys(BRACKET_VARIABLE_PATTERN.findall(formula)))
+
+    def build_tasks(self, formulas, inputs):
+        """
+        建立任务及其依赖
+        参数:
+            formulas: {条目名: 公式}，报告中需要计算的条目
+            inputs: {变量名: 数值}，已知的原始数据（含 _T-1 上期值）
+        返回:
+            {任务key: ReportTask}
+        """
+        tasks = {}
+        # 正在展开的任务链，用于发现循环引用
+        stack = []
+
+        def add_dep(task, name, prior):
+            key = name + PRIOR_SUFFIX if prior else name
+            if key in stack:
+                # 与 formula_dag 相同：构成循环的引用不再展开，该变量按原始数据处理
+                cycle = " -> ".join(stack[stack.index(key):] + [key])
+                print(f"公式目录存在循环引用: {cycle}，[{key}] 按原始数据处理")
+                return
+            task.deps.append(add_task(name, prior))
+
+        def add_task(name, prior, formula=None):
+            key = name + PRIOR_SUFFIX if prior else name
+            if key in tasks:
+                return key
+            if formula is None:
+                formula = self.catalog.get_formula(name)
+            task = ReportTask(name, prior, formula, self._formula_variables(formula))
+            tasks[key] = task
+            stack.append(key)
+
+            for var in task.variables:
+                if var == name:
+                    continue
+                if prior:
+                    # 上期任务：公式中的每个变量取其上期值
+                    if var.endswith(PRIOR_SUFFIX) or var + PRIOR_SUFFIX in inputs:
+                        continue
+                    if var in self.catalog:
+                        add_dep(task, var, True)
+                    continue
+                if var in inputs:
+                    continue
+                if var in self.catalog:
+                    add_dep(task, var, False)
+                elif var.endswith(PRIOR_SUFFIX) and var[:-len(PRIOR_SUFFIX)] in self.catalog:
+                    add_dep(task, var[:-len(PRIOR_SUFFIX)], True)
+            stack.pop()
+            return key
+
+        for name, formula in formulas.items():
+            add_task(name, False, formula)
+        return tasks
+
+    @staticmethod
+    def _task_variables(task, env):
+        """从原始数据与已完成任务的结果中取出任务需要的变量"""
+        if task.prior:
+            variables = {}
+            for var in task.variables:
+                value = env.get(var + PRIOR_SUFFIX)
+                if value is not None:
+                    variables[var] = value
+            return variables
+        return {var: env[var] for var in task.variables if env.get(var) is not None}
+
+    @staticmethod
+    def _resolvable(task, variables):
+        """依赖没有结果时，公式能否只用现有变量算出（如 coalesce 回退到本期值）"""
+        try:
+            return not compile_formula(task.formula).missing_variables(variables)
+        except FormulaError:
+            return False
+
+    def run(self, formulas, inputs):
+        """
+        按拓扑顺序计算报告中的全部条目
+        参数:
+            formulas: {条目名: 公式}
+            inputs: {变量名: 数值}，键可带中括号，值可为千分位字符串
+        返回:
+            ({任务key: 结果}, {任务key: 计算方式})，包括为满足依赖而额外计算的条目；
+            依赖没有结果且无法回退的任务不再计算，结果为None，计算方式为 "skipped"
+        """
+        # 与 formula_dag 相同：非数值的原始数据视为缺失，不影响整份报告
+        env = {}
+        for key, value in inputs.items():
+            number = input_value(value)
+            if number is not None:
+                env[strip_key(key)] = number
+        tasks = self.build_tasks(formulas, env)
+        sorter = TopologicalSorter({key: task.deps for key, task in tasks.items()})
+        try:
+            sorter.prepare()
+        except CycleError as e:
+            # build_tasks 已切断展开过程中发现的循环，这里只作为兜底
+            raise ValueError(f"公式目录存在循环引用: {' -> '.join(e.args[1])}")
+
+        results = {}
+        methods = {}
+
+        # env 只在调度线程中读写，工作线程只拿到各自任务的变量
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while sorter.is_active():
+                skipped = False
+                for key in sorter.get_ready():
+                    task = tasks[key]
+                    variables = self._task_variables(task, env)
+                    failed = [dep for dep in task.deps if results.get(dep) is None]
+                    if failed and not self._resolvable(task, variables):
+                        # 依赖已失败的任务不再计算，避免每个下游条目各调用一次注定失败的LLM
+                        print(f"[{key}] 依赖的 {', '.join(failed)} 没有结果，已跳过")
+                        results[key] = None
+                        methods[key] = "skipped"
+                        sorter.done(key)
+                        skipped = True
+                        continue
+                    future = executor.submit(evaluate_formula_value, task.formula, variables, self.eval_mode)
+                    running[future] = key
+                if not running:
+                    if skipped:
+                        continue
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    result, method = future.result()
+                    results[key] = result
+                    methods[key] = method
+                    # 计算结果作为下游公式的变量；原始数据中已有的值优先
+                    if result is not None and key not in env:
+                        env[key] = result
+                    sorter.done(key)
+
+        return results, methods
+
+def schedule_report(elements, inputs, catalog=None, max_workers=8, eval_mode=EVALUATION_MODE):
+    """
+    计算一份报告中的全部元素，并把结果写回元素字典
+    参数:
+        elements: 元素字典列表（格式同input.json）
+        inputs: {变量名: 数值}，报告的原始数据
+        catalog: FormulaCatalog
+        max_workers: 并发数
+        eval_mode: 公式计算模式
+    返回:
+        ({任务key: 结果}, {任务key: 计算方式})
+    """
+    scheduler = ReportScheduler(catalog, max_workers, eval_mode)
+    formulas = {}
+    for data in elements:
+        name = data.get('element_info', {}).get('element_content', '')
+        formula = scheduler.catalog.get_formula(name)
+        if formula is None:
+            formula = data.get('element_fill_source', {}).get('compute_formula', '')
+        if name and formula:
+            formulas[name] = formula
+
+    results, methods = scheduler.run(formulas, inputs)
+
+    for data in elements:
+        name = data.get('element_info', {}).get('element_content', '')
+        if name in formulas:
+            data.setdefault('element_fill_source', {})['compute_formula'] = formulas[name]
+            data['element_final_value'] = results.get(name)
+    return results, methods
+
+def main():
+    """主函数：对一组元素名称和一份原始数据计算整份报告"""
+    parser = argparse.ArgumentParser(description="按依赖关系计算整份报告")
+    parser.add_argument("inputs", help="原始数据JSON文件，{变量名: 数值}")
+    parser.add_argument("names", nargs="+", help="需要计算的元素名称")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="并发计算的最大任务数")
+    parser.add_argument("--eval-mode", choices=EVALUATION_MODES, default=EVALUATION_MODE,
+                        help="公式计算模式（auto/local/llm）")
+    args = parser.parse_args()
+
+    with open(args.inputs, 'r', encoding='utf-8') as f:
+        inputs = json.load(f)
+
+    scheduler = ReportScheduler(max_workers=args.concurrency, eval_mode=args.eval_mode)
+    formulas = {}
+    for name in args.names:
+        formula = scheduler.catalog.get_formula(name)
+        if formula is None:
+            print(f"公式目录中未找到 '{name}'，已跳过")
+            continue
+        formulas[name] = formula
+
+    results, methods = scheduler.run(formulas, inputs)
+    for key, value in results.items():
+        marker = "" if key in formulas else "（依赖）"
+        print(f"{key}{marker}: {value} [{methods[key]}]")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量运行数据计算管线：
+从JSONL或JSON数组文件中逐个读取元素记录（格式同input.json），
+在同一进程内以有限并发依次执行 b_step1 → a_step2 → b_step2，
+每个元素的结果写为输出JSONL中的一行。
+指定数据源（--data-source）时按块读取元素，每块的变量去重后批量查询一次数据源再并发计算
+"""
+
+import os
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+import llm_client
+from b_computer_step1 import fill_formula
+from a_computer_step2 import inject_variables, inject_variables_batch
+from data_sources import open_data_source, prior_period, DATA_SOURCE_TYPES, LOCATED_SOURCE_TYPES
+from b_computer_step2 import compute_result, EVALUATION_MODE, EVALUATION_MODES
+
+def iter_elements(input_path):
+    """
+    逐个读取元素记录
+    参数:
+        input_path: JSONL文件、JSON数组文件或单个元素的JSON文件（扩展名不限）
+    返回:
+        元素字典生成器
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        # 跳过开头的空行，按首个非空行判断格式
+        first_line = ''
+        while True:
+            position = f.tell()
+            first_line = f.readline()
+            if not first_line or first_line.strip():
+                break
+        if not first_line:
+            return
+
+        if first_line.lstrip().startswith('['):
+            # JSON数组需要整体解析
+            f.seek(position)
+            yield from json.load(f)
+            return
+        try:
+            first = json.loads(first_line)
+        except json.JSONDecodeError:
+            # 首行不是完整的JSON：整个文件是一个跨多行的元素（如格式化的input.json）
+            f.seek(position)
+            yield json.load(f)
+            return
+
+        # JSONL：逐行解析，不把整个文件读入内存
+        yield first
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def process_element(data, eval_mode=EVALUATION_MODE, empty_vars=None):
+    """
+    对单个元素执行 b_step1 → a_step2 → b_step2
+    参数:
+        data: 元素字典
+        eval_mode: B计算机第二步的计算模式（auto/local/llm）
+        empty_vars: 元素已批量注入数据时传入其空值变量列表，只执行 b_step2
+    返回:
+        结果记录字典
+    """
+    start = time.perf_counter()
+    record = {
+        "element_uuid": data.get('element_uuid', ''),
+        "element_content": data.get('element_info', {}).get('element_content', '')
+    }
+
+    try:
+        if empty_vars is None:
+            data = fill_formula(data)
+            data, empty_vars = inject_variables(data)
+
+        if empty_vars:
+            record["status"] = "missing_variables"
+            record["missing_variables"] = empty_vars
+        else:
+            data = compute_result(data, eval_mode)
+            record["status"] = "success" if data.get('element_final_value') is not None else "error"
+
+        record["compute_formula"] = data.get('element_fill_source', {}).get('compute_formula', '')
+        record["element_final_value"] = data.get('element_final_value')
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+
+    record["elapsed_time"] = time.perf_counter() - start
+    return record, data
+
+def _prepare_chunk(chunk, data_source, period):
+    """为一块元素查找公式并批量注入数据，返回 [(元素字典, 空值变量列表或异常)]"""
+    filled = []
+    prepared = []
+    for data in chunk:
+        try:
+            filled.append(fill_formula(data))
+        except Exception as e:
+            prepared.append((data, e))
+    try:
+        prepared.extend(inject_variables_batch(filled, data_source, period))
+    except Exception as e:
+        # 注入失败时本块元素记为失败，不中断整批
+        prepared.extend((data, e) for data in filled)
+    return prepared
+
+def _iter_chunks(elements, size):
+    chunk = []
+    for data in elements:
+        chunk.append(data)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def run_batch(input_path, output_path, concurrency=8, include_element=False,
+              eval_mode=EVALUATION_MODE, data_source=None, period=None, chunk_size=256):
+    """
+    以有限并发批量处理元素，按完成顺序写出结果
+    参数:
+        input_path: 输入文件路径（JSONL或JSON数组）
+        output_path: 输出JSONL文件路径
+        concurrency: 同时处理的最大元素数
+        include_element: 是否在结果行中附带完整的元素字典
+        eval_mode: B计算机第二步的计算模式
+        data_source: data_sources.DataSource，省略时注入测试数据
+        period: 报告期，省略时使用数据源的默认期间
+        chunk_size: 使用数据源时每次批量注入的元素数
+    返回:
+        统计信息字典
+    """
+    stats = {"total": 0, "success": 0, "missing_variables": 0, "error": 0}
+    start = time.perf_counter()
+
+    def write_result(out, future):
+        record, data = future.result()
+        if include_element:
+            record["element"] = data
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        stats["total"] += 1
+        stats[record["status"]] += 1
+
+    with open(output_path, 'w', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        if data_source is None:
+            jobs = ((data, None) for data in iter_elements(input_path))
+        else:
+            # 按块批量注入：一块元素的变量去重后只查询一次数据源
+            jobs = (job for chunk in _iter_chunks(iter_elements(input_path), chunk_size)
+                    for job in _prepare_chunk(chunk, data_source, period))
+        for data, empty_vars in jobs:
+            # 在途任务达到上限时，先等待至少一个完成，避免一次性读入全部元素
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write_result(out, future)
+            if isinstance(empty_vars, Exception):
+                record = {"element_uuid": data.get('element_uuid', ''), "status": "error",
+                          "error": str(empty_vars), "elapsed_time": 0.0}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["total"] += 1
+                stats["error"] += 1
+                continue
+            pending.add(executor.submit(process_element, data, eval_mode, empty_vars))
+
+        for future in as_completed(pending):
+            write_result(out, future)
+
+    stats["elapsed_time"] = time.perf_counter() - start
+    stats["elements_per_sec"] = stats["total"] / stats["elapsed_time"] if stats["elapsed_time"] > 0 else 0.0
+    return stats
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="批量运行A/B数据计算管线")
+    parser.add_argument("input", help="元素记录文件（JSONL或JSON数组）")
+    parser.add_argument("output", help="结果输出的JSONL文件")
+    parser.add_argument("-c", "--concurrency", type=int, default=8,
+                        help="同时处理的最大元素数（默认8）")
+    parser.add_argument("--include-element", action="store_true",
+                        help="在每行结果中附带处理后的完整元素")
+    parser.add_argument("--quiet", action="store_true",
+                        help="屏蔽各步骤的过程输出，只打印汇总")
+    parser.add_argument("--eval-mode", choices=EVALUATION_MODES, default=EVALUATION_MODE,
+                        help="公式计算模式：auto 本地优先、必要时调用LLM（默认）；local 只本地；llm 只调用LLM")
+    parser.add_argument("--data-source", default=None,
+                        help=f"变量数据源：{', '.join(DATA_SOURCE_TYPES)}，如 sqlite:/path/data.sqlite；省略时注入测试数据")
+    parser.add_argument("--company", default=None, help="数据源的默认公司（元素中没有entname时使用）")
+    parser.add_argument("--period", default=None, help="报告期（本期），如 2023-12-31")
+    parser.add_argument("--chunk-size", type=int, default=256, help="使用数据源时每次批量注入的元素数")
+    parser.add_argument("--hedge", action="store_true",
+                        help="LLM请求耗时超过近期p95时发出对冲请求，降低长尾延迟")
+    parser.add_argument("--requests-per-second", type=float, default=None,
+                        help="LLM请求速率上限（每秒请求数），省略时不限制")
+    parser.add_argument("--tokens-per-minute", type=float, default=None,
+                        help="LLM token速率上限（每分钟token数，按请求体估算），省略时不限制")
+    args = parser.parse_args()
+
+    if args.hedge:
+        llm_client.configure_hedging(enabled=True)
+    if args.requests_per_second or args.tokens_per_minute:
+        llm_client.configure_rate_limit(requests_per_second=args.requests_per_second,
+                                        tokens_per_minute=args.tokens_per_minute)
+
+    # 在打开输出文件之前检查期间，避免处理到一半才因参数错误失败；
+    # 缺少公司（元素没有entname且未指定 --company）时只有这些元素记为失败
+    kind = args.data_source.partition(":")[0] if args.data_source else None
+    if kind in LOCATED_SOURCE_TYPES and args.period is None:
+        parser.error(f"{kind} 数据源需要用 --period 指定报告期")
+    if args.period is not None:
+        try:
+            prior_period(args.period)
+        except ValueError as e:
+            parser.error(f"--period 无效: {str(e)}")
+
+    data_source = None
+    if args.data_source:
+        data_source = open_data_source(args.data_source, args.company, args.period)
+
+    try:
+        if args.quiet:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                stats = run_batch(args.input, args.output, args.concurrency,
+                                  args.include_element, args.eval_mode, data_source, args.period, args.chunk_size)
+        else:
+            stats = run_batch(args.input, args.output, args.concurrency,
+                              args.include_element, args.eval_mode, data_source, args.period, args.chunk_size)
+    finally:
+        if data_source is not None:
+            data_source.close()
+
+    print("======================================================")
+    print(f"批量处理完成: 共 {stats['total']} 个元素, 成功 {stats['success']}, "
+          f"缺少变量 {stats['missing_variables']}, 失败 {stats['error']}")
+    print(f"总耗时: {stats['elapsed_time']:.2f} 秒, 吞吐量: {stats['elements_per_sec']:.2f} 元素/秒")
+    print(f"结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
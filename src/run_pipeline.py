@@ -4,16 +4,27 @@
 """
 管理数据计算管线的运行脚本，替代原有的shell脚本
 增加了检查A2.json中变量值是否为空的逻辑
+默认在同一进程内运行A、B两个角色，通过消息总线（message_bus）直接交换元素字典，
+exp/ 目录下的JSON文件只在指定 --audit 时写出；
+A、B分处不同进程或机器时用 --role a/b 配合 --transport tcp/unix 运行；
+使用 --subprocess 可回退到逐个启动子进程、经由JSON文件交接的旧模式
 """
 
 import os
 import sys
 import json
 import time
+import argparse
 import subprocess
 import venv
 import platform
 
+import message_bus
+from message_bus import AuditSink, TRANSPORTS
+from wire_codec import WIRE_FORMATS
+from a_computer_step1 import load_element
+from b_computer_step2 import EVALUATION_MODE, EVALUATION_MODES
+
 # 项目根目录
 PROJECT_ROOT = "/home/super/linchen/250418-accountant-agent"
 
@@ -42,7 +53,7 @@ def setup_virtual_environment():
         else:
             pip_path = os.path.join(venv_dir, 'bin', 'pip')
         
-        subprocess.run([pip_path, 'install', 'requests'])
+        subprocess.run([pip_path, 'install', 'httpx'])
         print("虚拟环境创建完成，已安装依赖包")
     else:
         print("使用已存在的虚拟环境")
@@ -66,7 +77,6 @@ def run_a_step1(python_path):
     # 运行A计算机第一步
     script_path = os.path.join(PROJECT_ROOT, "src", "a_computer_step1.py")
     subprocess.run([python_path, script_path])
-    time.sleep(1)
     
     return os.path.join(PROJECT_ROOT, "exp", "input.json")
 
@@ -77,7 +87,6 @@ def run_b_step1(python_path):
     # 运行B计算机第一步
     script_path = os.path.join(PROJECT_ROOT, "src", "b_computer_step1.py")
     subprocess.run([python_path, script_path])
-    time.sleep(1)
     
     return os.path.join(PROJECT_ROOT, "exp", "b1.json")
 
@@ -113,7 +122,6 @@ def run_a_step2(python_path):
     # 运行A计算机第二步
     script_path = os.path.join(PROJECT_ROOT, "src", "a_computer_step2.py")
     subprocess.run([python_path, script_path])
-    time.sleep(1)
     
     # 检查A2.json中的变量值
     a2_json_path = os.path.join(PROJECT_ROOT, "exp", "a2.json")
@@ -133,7 +141,6 @@ def run_b_step2(python_path):
     # 运行B计算机第二步
     script_path = os.path.join(PROJECT_ROOT, "src", "b_computer_step2.py")
     subprocess.run([python_path, script_path])
-    time.sleep(5)  # 给LLM API调用多一点时间
     
     return os.path.join(PROJECT_ROOT, "exp", "b2.json")
 
@@ -173,8 +180,141 @@ def print_results():
     print("======================================================")
     print("管线执行完毕!")
 
-def main():
-    """主函数"""
+def run_in_process(collect_snapshots=True, eval_mode=EVALUATION_MODE, transport="inproc",
+                   address=None, authkey=None, audit=False, wire_format=None):
+    """
+    在当前进程内运行完整管线：A计算机在主线程，B计算机在后台线程，
+    两者通过消息总线交换元素（默认进程内队列，不经过 exp/ 目录的JSON文件）
+    参数:
+        collect_snapshots: 是否记录每个步骤后的JSON快照用于打印
+        eval_mode: B计算机第二步的计算模式（auto/local/llm）
+        transport: 消息总线的传输方式（inproc/tcp/unix）
+        address: tcp/unix 传输的地址
+        authkey: 套接字连接的认证密钥
+        audit: 是否把各阶段消息写入 exp/ 目录（input.json、b1.json、a2.json、b2.json）
+        wire_format: tcp/unix 传输的消息编码方式（msgpack/json）
+    返回:
+        (dict, list, list): 最终元素字典（变量为空时为None）、
+        各步骤耗时列表[(步骤名, 秒)]、各步骤快照列表[(标题, JSON文本)]
+    """
+    timings = []
+    snapshots = []
+    sink = AuditSink() if audit else None
+    
+    print("开始运行数据计算管线（进程内模式）...")
+    print("======================================================")
+    
+    if transport == "inproc":
+        a_end, b_end = message_bus.create_inproc_pair(sink)
+    else:
+        a_end, b_end = message_bus.create_socket_pair(transport, address, authkey, sink, wire_format)
+    b_thread = message_bus.start_b_thread(b_end, eval_mode)
+    
+    try:
+        # 步骤1：A计算机读取原始JSON
+        print_separator(f"步骤1：A计算机初始化JSON，从{PROJECT_ROOT}/input.json读取")
+        start = time.perf_counter()
+        data = load_element(os.path.join(PROJECT_ROOT, "input.json"))
+        data, empty_vars = run_a_role(a_end, data, timings, snapshots if collect_snapshots else None, start)
+    finally:
+        a_end.close()
+        b_thread.join(timeout=5)
+        b_end.close()
+    
+    if empty_vars:
+        empty_vars_str = ", ".join([f"'{var}'" for var in empty_vars])
+        print(f"\n缺少{{ {empty_vars_str} }}无法计算结果")
+        return None, timings, snapshots
+    
+    return data, timings, snapshots
+
+def run_a_role(endpoint, data, timings, snapshots=None, start=None):
+    """
+    通过消息总线运行A计算机角色，并记录各步骤耗时与快照
+    参数:
+        endpoint: 消息总线的A端
+        data: 原始元素字典
+        timings: 耗时列表，追加 (步骤名, 秒)
+        snapshots: 快照列表，None表示不记录
+        start: 步骤1开始的时间（perf_counter）
+    返回:
+        (最终元素字典, 空值变量列表)
+    """
+    titles = {
+        "input": ("a_step1", "初始JSON (input.json):", "步骤2：B计算机查找公式"),
+        "b1": ("b_step1", "B计算机添加公式后 (b1.json):", "步骤3：A计算机解析公式并注入数据"),
+        "a2": ("a_step2", "A计算机添加变量数据后 (a2.json):", "步骤4：B计算机调用LLM API计算公式结果"),
+        "b2": ("b_step2", "B计算机计算结果后 (b2.json):", None)
+    }
+    last = [start if start is not None else time.perf_counter()]
+    
+    def on_stage(stage, element):
+        now = time.perf_counter()
+        name, title, next_step = titles[stage]
+        timings.append((name, now - last[0]))
+        if snapshots is not None:
+            snapshots.append((title, json.dumps(element, ensure_ascii=False, indent=2)))
+        if next_step:
+            print_separator(next_step)
+        last[0] = time.perf_counter()
+    
+    return message_bus.run_a(endpoint, data, on_stage=on_stage)
+
+def run_remote_role(role, transport, address=None, authkey=None, eval_mode=EVALUATION_MODE,
+                    collect_snapshots=True, audit=False, wire_format=None):
+    """
+    A、B计算机分处不同进程或机器时运行其中一个角色：
+    B计算机监听并处理消息直到A计算机断开；A计算机连接B计算机并处理input.json
+    返回:
+        与 run_in_process 相同；B角色返回 (None, [], [])
+    """
+    sink = AuditSink() if audit else None
+    if role == "b":
+        endpoint = message_bus.listen(transport, address, authkey, sink, wire_format)
+        try:
+            handled = message_bus.serve_b(endpoint, eval_mode)
+        finally:
+            endpoint.close()
+        print(f"B计算机：共处理 {handled} 条消息，连接已关闭")
+        return None, [], []
+    
+    endpoint = message_bus.connect(transport, address, authkey, sink, wire_format)
+    timings = []
+    snapshots = []
+    try:
+        print_separator(f"步骤1：A计算机初始化JSON，从{PROJECT_ROOT}/input.json读取")
+        start = time.perf_counter()
+        data = load_element(os.path.join(PROJECT_ROOT, "input.json"))
+        data, empty_vars = run_a_role(endpoint, data, timings, snapshots if collect_snapshots else None, start)
+    finally:
+        endpoint.close()
+    if empty_vars:
+        empty_vars_str = ", ".join([f"'{var}'" for var in empty_vars])
+        print(f"\n缺少{{ {empty_vars_str} }}无法计算结果")
+        return None, timings, snapshots
+    return data, timings, snapshots
+
+def print_snapshots(snapshots):
+    """打印进程内模式记录的各步骤快照"""
+    print("\n======================================================")
+    print("数据计算管线运行完成，结果如下：")
+    for title, text in snapshots:
+        print_separator(title)
+        print(text)
+    print("======================================================")
+    print("管线执行完毕!")
+
+def print_timings(timings):
+    """打印各步骤耗时"""
+    print_separator("各步骤耗时:")
+    total = 0.0
+    for stage, elapsed in timings:
+        total += elapsed
+        print(f"{stage:<10} {elapsed * 1000:10.3f} ms")
+    print(f"{'total':<10} {total * 1000:10.3f} ms")
+
+def run_subprocess_pipeline():
+    """以子进程方式逐个运行四个步骤脚本（旧模式）"""
     # 设置虚拟环境
     python_path = setup_virtual_environment()
     
@@ -199,5 +339,54 @@ def main():
     # 打印处理结果
     print_results()
 
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="运行A/B数据计算管线")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="以子进程方式逐个运行步骤脚本（旧模式）")
+    parser.add_argument("--timings", action="store_true",
+                        help="输出每个步骤的耗时（仅进程内模式）")
+    parser.add_argument("--quiet", action="store_true",
+                        help="不打印各步骤的JSON快照")
+    parser.add_argument("--eval-mode", choices=EVALUATION_MODES, default=EVALUATION_MODE,
+                        help="公式计算模式：auto 本地优先、必要时调用LLM（默认）；local 只本地；llm 只调用LLM")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="inproc",
+                        help="A/B之间的消息传输方式：inproc 进程内队列（默认）；tcp 套接字；unix Unix域套接字")
+    parser.add_argument("--role", choices=("both", "a", "b"), default="both",
+                        help="运行的角色：both 同一进程内运行A和B（默认）；a/b 只运行一方，需配合tcp/unix传输")
+    parser.add_argument("--address", default=None,
+                        help="tcp 传输为 主机:端口，unix 传输为套接字文件路径")
+    parser.add_argument("--authkey", default=None, help="套接字连接的认证密钥")
+    parser.add_argument("--wire-format", choices=WIRE_FORMATS, default=None,
+                        help="tcp/unix 传输的消息编码：msgpack（安装了msgpack时默认）或 json")
+    parser.add_argument("--audit", action="store_true",
+                        help="把各阶段消息写入exp目录（input.json、b1.json、a2.json、b2.json）")
+    args = parser.parse_args()
+    
+    if args.subprocess:
+        run_subprocess_pipeline()
+        return
+    
+    authkey = args.authkey.encode('utf-8') if args.authkey else None
+    if args.role != "both":
+        if args.transport == "inproc":
+            parser.error("--role a/b 需要 --transport tcp 或 unix")
+        data, timings, snapshots = run_remote_role(args.role, args.transport, args.address, authkey,
+                                                   args.eval_mode, not args.quiet, args.audit, args.wire_format)
+        if args.role == "b":
+            return
+    else:
+        data, timings, snapshots = run_in_process(not args.quiet, args.eval_mode, args.transport,
+                                                  args.address, authkey, args.audit, args.wire_format)
+    
+    if data is None:
+        print_separator()
+        print("程序已终止运行")
+    elif not args.quiet:
+        print_snapshots(snapshots)
+    
+    if args.timings:
+        print_timings(timings)
+
 if __name__ == "__main__":
     main()
@@ -15,7 +15,7 @@ if [ ! -d "$VENV_DIR" ]; then
     
     # 激活虚拟环境并安装依赖
     source $VENV_DIR/bin/activate
-    pip install requests
+    pip install httpx
     echo "虚拟环境创建完成，已安装依赖包"
 else
     echo "使用已存在的虚拟环境"
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+财务报表列式存储：每个科目一列，每行对应一个 (公司, 期间)，数值矩阵保存为按列连续（Fortran顺序）的 .npy 文件，
+打开时以只读内存映射方式加载。取某个科目的整列是零拷贝切片，多个工作进程打开同一目录时共享同一份页缓存，
+不需要解析JSON。[X_T-1] 通过上一期（年份减一）所在的行解析。
+目录结构（每次生成一个新版本，写完后原子地切换 CURRENT，读取方不会把新矩阵与旧索引混用）:
+    CURRENT               当前版本的子目录名
+    <版本>/meta.json      科目列表、公司列表、期间列表和每行的 (公司序号, 期间序号)
+    <版本>/values.npy     float64 矩阵，形状为 (行数, 科目数)，缺失值为NaN
+"""
+
+import os
+import csv
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+
+import numpy as np
+
+from data_sources import DataSource, prior_period, split_prior, DEFAULT_TABLE
+from formula_compiler import to_number, strip_key
+
+# 默认的存储目录
+DEFAULT_STORE_DIR = "/home/super/linchen/250418-accountant-agent/exp/statement_store"
+
+CURRENT_FILE = "CURRENT"
+META_FILE = "meta.json"
+VALUES_FILE = "values.npy"
+# 切换版本后保留的旧版本数（正在打开旧版本的读取方不会遇到文件被删除）
+KEEP_VERSIONS = 1
+
+def current_version_dir(directory):
+    """
+    存储当前版本所在的目录
+    参数:
+        directory: 存储目录
+    返回:
+        版本子目录路径；没有 CURRENT 时返回存储目录本身（不分版本的旧布局）
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return directory
+    return os.path.join(directory, version)
+
+def _remove_old_versions(directory, current):
+    versions = sorted(name for name in os.listdir(directory)
+                      if name.startswith("v") and name != current
+                      and os.path.isdir(os.path.join(directory, name)))
+    for name in versions[:max(0, len(versions) - KEEP_VERSIONS)]:
+        # 已映射旧文件的读取方不受影响（删除后映射仍然有效）
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+def build_store(directory, rows):
+    """
+    由科目记录生成列式存储（覆盖目录中已有的存储）
+    参数:
+        directory: 存储目录
+        rows: (company, period, item, value) 迭代器，值可为千分位字符串，空值视为缺失
+    返回:
+        (行数, 科目数)
+    """
+    records = {}
+    items = {}
+    for company, period, item, value in rows:
+        number = to_number(value)
+        if number is None:
+            continue
+        item = strip_key(item)
+        items.setdefault(item, len(items))
+        records.setdefault((str(company), str(period)), {})[item] = float(number)
+
+    keys = sorted(records)
+    companies = sorted({company for company, _ in keys})
+    periods = sorted({period for _, period in keys})
+    company_index = {company: index for index, company in enumerate(companies)}
+    period_index = {period: index for index, period in enumerate(periods)}
+
+    # 矩阵与索引写入新的版本目录，全部写完后再切换 CURRENT
+    version = f"v{time.time_ns()}"
+    version_dir = os.path.join(directory, version)
+    os.makedirs(version_dir)
+    # 按列连续存放，取一个科目的全部行时是连续内存
+    matrix = np.lib.format.open_memmap(os.path.join(version_dir, VALUES_FILE), mode='w+', dtype=np.float64,
+                                       shape=(len(keys), len(items)), fortran_order=True)
+    matrix[:] = np.nan
+    for row, key in enumerate(keys):
+        for item, number in records[key].items():
+            matrix[row, items[item]] = number
+    matrix.flush()
+    del matrix
+
+    meta = {
+        "items": list(items),
+        "companies": companies,
+        "periods": periods,
+        "rows": [[company_index[company], period_index[period]] for company, period in keys]
+    }
+    with open(os.path.join(version_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    current_path = os.path.join(directory, CURRENT_FILE)
+    with open(current_path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(current_path + ".tmp", current_path)
+    _remove_old_versions(directory, version)
+    return len(keys), len(items)
+
+class StatementStore:
+    """只读的列式报表存储"""
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        """
+        参数:
+            directory: build_store 生成的存储目录
+        """
+        # 先确定版本，索引与矩阵都从同一个版本目录读取
+        version_dir = current_version_dir(directory)
+        meta_path = os.path.join(version_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            raise ValueError(f"报表存储不存在: {directory}")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.directory = directory
+        self.items = meta["items"]
+        self.companies = meta["companies"]
+        self.periods = meta["periods"]
+        self.item_index = {item: index for index, item in enumerate(self.items)}
+        self.row_index = {(self.companies[company], self.periods[period]): row
+                          for row, (company, period) in enumerate(meta["rows"])}
+        self.matrix = np.load(os.path.join(version_dir, VALUES_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.row_index)
+
+    def row(self, company, period):
+        """(公司, 期间) 所在的行号，不存在时返回None"""
+        return self.row_index.get((str(company), str(period)))
+
+    def column(self, item):
+        """
+        科目的整列（只读内存映射视图，不复制数据）
+        参数:
+            item: 科目名，可带中括号
+        返回:
+            float64数组，按行号排列，缺失值为NaN；科目不存在时返回None
+        """
+        index = self.item_index.get(strip_key(item))
+        if index is None:
+            return None
+        return self.matrix[:, index]
+
+    def rows_for(self, keys, prior=False):
+        """
+        一组 (公司, 期间) 对应的行号数组
+        参数:
+            keys: (公司, 期间) 列表
+            prior: 为True时取上一期的行
+        返回:
+            int64数组，不存在的行为-1
+        """
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        for position, (company, period) in enumerate(keys):
+            if prior:
+                period = prior_period(period)
+            row = self.row_index.get((str(company), str(period)))
+            if row is not None:
+                rows[position] = row
+        return rows
+
+    def gather(self, names, keys):
+        """
+        按变量名取一组 (公司, 期间) 的列，供 formula_vectorized 向量化求值
+        参数:
+            names: 变量名，可带中括号，带 _T-1 后缀的取上一期
+            keys: (公司, 期间) 列表
+        返回:
+            {变量名(不带中括号): float64数组}，缺失值为NaN
+        """
+        rows = {}
+        columns = {}
+        for key in names:
+            name = strip_key(key)
+            item, prior = split_prior(name)
+            column = self.column(item)
+            if column is None:
+                columns[name] = np.full(len(keys), np.nan)
+                continue
+            if prior not in rows:
+                rows[prior] = self.rows_for(keys, prior)
+            selected = rows[prior]
+            values = column[np.maximum(selected, 0)]
+            values[selected < 0] = np.nan
+            columns[name] = values
+        return columns
+
+    def lookup(self, company, period, items, with_prior=False):
+        """
+        取一个公司一个期间的多个科目值
+        参数:
+            company: 公司
+            period: 本期期间
+            items: 科目名列表（不带后缀）
+            with_prior: 同时取上一期
+        返回:
+            {(科目名, 是否上期): float}，缺失值不出现在结果中
+        """
+        periods = [(str(period), False)]
+        if with_prior:
+            periods.append((prior_period(period), True))
+        result = {}
+        for row_period, prior in periods:
+            row = self.row_index.get((str(company), row_period))
+            if row is None:
+                continue
+            values = self.matrix[row]
+            for item in items:
+                index = self.item_index.get(item)
+                if index is None:
+                    continue
+                value = values[index]
+                if not np.isnan(value):
+                    result[(item, prior)] = float(value)
+        return result
+
+    def evaluate(self, formula, keys):
+        """
+        对一组 (公司, 期间) 一次性计算同一个公式
+        参数:
+            formula: 公式字符串
+            keys: (公司, 期间) 列表
+        返回:
+            formula_vectorized.VectorResult
+        """
+        from formula_vectorized import compile_vectorized
+
+        compiled = compile_vectorized(formula)
+        return compiled.evaluate(self.gather(compiled.variables, keys), len(keys))
+
+class StatementDataSource(DataSource):
+    """以列式报表存储为后端的数据源"""
+
+    name = "statement_store"
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, company=None, period=None):
+        super().__init__(company, period)
+        self.store = StatementStore(directory)
+
+    def _query(self, company, period, items, with_prior):
+        if company is None or period is None:
+            raise ValueError("报表存储数据源需要指定公司和期间")
+        return self.store.lookup(company, period, items, with_prior)
+
+def _sqlite_rows(path, table=DEFAULT_TABLE):
+    conn = sqlite3.connect(path)
+    try:
+        yield from conn.execute(f"SELECT company, period, item, value FROM {table}")
+    finally:
+        conn.close()
+
+def _csv_rows(path):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 4:
+                yield row[:4]
+
+def main():
+    """由SQLite数据源或CSV生成列式存储，或查询科目值"""
+    parser = argparse.ArgumentParser(description="财务报表列式存储（内存映射）")
+    parser.add_argument("--dir", default=DEFAULT_STORE_DIR, help="存储目录")
+    parser.add_argument("--from-sqlite", default=None, help="从SQLite数据源（line_items表）生成存储")
+    parser.add_argument("--from-csv", default=None, help="从CSV（列: company, period, item, value，首行为表头）生成存储")
+    parser.add_argument("--company", default=None, help="查询的公司")
+    parser.add_argument("--period", default=None, help="查询的期间（本期）")
+    parser.add_argument("items", nargs="*", help="查询的科目，上期写作 X_T-1")
+    args = parser.parse_args()
+
+    if args.from_sqlite or args.from_csv:
+        rows = _sqlite_rows(args.from_sqlite) if args.from_sqlite else _csv_rows(args.from_csv)
+        count, width = build_store(args.dir, rows)
+        print(f"已生成报表存储 {args.dir}: {count} 行 × {width} 个科目")
+    if args.items:
+        source = StatementDataSource(args.dir, args.company, args.period)
+        for name, value in source.fetch(args.items).items():
+            print(f"{name}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试十进制算术后端：与float后端在 formula.csv 上的结果一致、没有二进制舍入误差、
+溢出与非数值输入在两个后端上都抛出 FormulaError
+"""
+
+import csv
+import json
+import sys
+
+from formula_compiler import compile_formula, evaluate_formula, FormulaError
+
+FORMULA_CSV_PATH = '/home/super/linchen/250418-accountant-agent/formula.csv'
+
+def _csv_cases(path=FORMULA_CSV_PATH):
+    """formula.csv 中可以直接解析变量JSON的行：(公式, 变量字典)"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                variables = json.loads(row[2])
+            except ValueError:
+                continue
+            if isinstance(variables, dict):
+                yield row[1].strip(), variables
+
+def check_backends_agree():
+    """
+    float与decimal后端对可计算的记录结果一致（相对误差1e-9以内）
+    返回:
+        bool: 是否通过
+    """
+    compared = 0
+    different = []
+    for formula, variables in _csv_cases():
+        try:
+            compiled = compile_formula(formula)
+            float_result = compiled.evaluate(variables, "float")
+            decimal_result = compiled.evaluate(variables, "decimal")
+        except FormulaError:
+            continue
+        compared += 1
+        if abs(float_result - decimal_result) > 1e-9 * max(1.0, abs(decimal_result)):
+            different.append((formula, float_result, decimal_result))
+    print(f"比较 {compared} 条记录，不一致 {len(different)} 条")
+    for formula, float_result, decimal_result in different[:5]:
+        print(f"  {formula}: float {float_result!r} decimal {decimal_result!r}")
+    return compared > 0 and not different
+
+def check_exact():
+    """
+    十进制后端没有二进制浮点误差
+    返回:
+        bool: 是否通过
+    """
+    cases = [
+        ("[a]+[b]", {"a": "0.1", "b": "0.2"}, 0.3),
+        ("[a]-[b]", {"a": "11,821,688,582.10", "b": "1,706,837,549.64"}, 10114851032.46)
+    ]
+    passed = True
+    for formula, variables, expected in cases:
+        exact = evaluate_formula(formula, variables, "decimal")
+        inexact = evaluate_formula(formula, variables, "float")
+        print(f"{formula} {variables}: decimal {exact!r}, float {inexact!r}")
+        passed = passed and exact == expected
+    return passed
+
+def check_errors():
+    """
+    结果溢出为inf、输入不是数值时两个后端都抛出 FormulaError
+    返回:
+        bool: 是否通过
+    """
+    passed = True
+    for variables in ({"a": "1e400", "b": "2"}, {"a": "n/a", "b": "1"}, {"a": float("inf"), "b": "1"}):
+        for backend in ("float", "decimal"):
+            try:
+                result = evaluate_formula("[a]*[b]", variables, backend)
+                print(f"{variables} [{backend}] 未报错: {result!r}")
+                passed = False
+            except FormulaError as e:
+                print(f"{variables} [{backend}] FormulaError: {e}")
+    return passed
+
+def main():
+    """主函数"""
+    checks = [
+        ("float/decimal后端一致", check_backends_agree),
+        ("十进制精确计算", check_exact),
+        ("溢出与非数值输入", check_errors)
+    ]
+    failed = []
+    for title, check in checks:
+        print(f"\n--- {title} ---")
+        if not check():
+            failed.append(title)
+
+    if failed:
+        print(f"\n❌ 测试失败: {', '.join(failed)}")
+        return False
+    print("\n✅ 测试通过: 十进制后端各项检查均通过")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
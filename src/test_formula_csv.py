@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试 formula.csv 流式读取：全部行都能解析、跨行单元格与千分位数值的处理、
+作为回归数据集时的统计结果与基准一致
+"""
+
+import os
+import sys
+import tempfile
+from decimal import Decimal
+
+from formula_csv import FormulaCsvReader, check_record, DEFAULT_FORMULA_CSV_PATH
+
+# formula.csv 当前的校验结果（公式或数据改动后需同步更新）
+EXPECTED_COUNTS = {"match": 17, "mismatch": 31, "missing": 12, "error": 3}
+
+# BOM、跨行单元格、残留的双重引号、带引号与不带引号的千分位数值、百分数预期值
+SAMPLE_CSV = (
+    '\ufeff2.4,[a]/[b],"{""a"":""11,821,688,582.10"", ""b"":""4,923,018,641.30""}\n'
+    '"\n'
+    '1.68,[a]/[b],"{\n'
+    '""""a"""":1000.5,\n'
+    '""""b"""": 500\n'
+    '}\n'
+    '"\n'
+    '3,[a]-[b],"{""a"": 1,000.5, ""b"": 500}"\n'
+    '12.5%,[a]/[b],"{""a"": 1, ""b"": 8}"\n'
+    'x,[a],"not json"\n'
+)
+
+def check_regression(path=DEFAULT_FORMULA_CSV_PATH):
+    """
+    逐行读取并计算 formula.csv，统计结果与基准一致
+    返回:
+        bool: 是否通过
+    """
+    reader = FormulaCsvReader(path, numbers="decimal")
+    counts = {status: 0 for status in EXPECTED_COUNTS}
+    for record in reader:
+        status, _ = check_record(record)
+        counts[status] += 1
+    print(f"记录数 {reader.rows}, 跳过 {len(reader.skipped)}, 统计 {counts}")
+    return not reader.skipped and counts == EXPECTED_COUNTS
+
+def check_sample():
+    """
+    特殊格式的样例：可解析的行逐条产出，无法解析的行跳过并记录行号
+    返回:
+        bool: 是否通过
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+        f.write(SAMPLE_CSV)
+        path = f.name
+    try:
+        reader = FormulaCsvReader(path, numbers="decimal")
+        records = list(reader)
+    finally:
+        os.remove(path)
+    for record in records:
+        print(f"第{record.line_no}行: 预期 {record.expected}, 变量 {record.variables}")
+    print(f"跳过: {reader.skipped}")
+    return ([record.line_no for record in records] == [1, 3, 8, 9]
+            and records[0].variables == {"a": Decimal("11821688582.10"), "b": Decimal("4923018641.30")}
+            and records[1].variables == {"a": Decimal("1000.5"), "b": Decimal("500")}
+            and records[2].variables == {"a": Decimal("1000.5"), "b": Decimal("500")}
+            and records[3].expected == Decimal("0.125")
+            and [line_no for line_no, _ in reader.skipped] == [10])
+
+def main():
+    """主函数"""
+    checks = [
+        ("formula.csv回归统计", check_regression),
+        ("特殊格式样例", check_sample)
+    ]
+    failed = []
+    for title, check in checks:
+        print(f"\n--- {title} ---")
+        if not check():
+            failed.append(title)
+
+    if failed:
+        print(f"\n❌ 测试失败: {', '.join(failed)}")
+        return False
+    print("\n✅ 测试通过: formula.csv读取各项检查均通过")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试公式编译器：formula.csv 中的公式能否解析编译、编译结果按公式文本缓存、
+闭包求值结果与原先替换变量后 eval 的结果一致
+"""
+
+import csv
+import sys
+
+from formula_compiler import compile_formula, FormulaSyntaxError, MissingVariableError
+
+FORMULA_CSV_PATH = '/home/super/linchen/250418-accountant-agent/formula.csv'
+
+# formula.csv 当前的解析结果（公式改动后需同步更新）：共63条，3条公式括号不匹配
+EXPECTED_COMPILED = 60
+EXPECTED_SYNTAX_ERRORS = 3
+
+# (公式, 变量, 替换变量后 eval 的结果)
+EVAL_CASES = [
+    ("[流动资产合计]/[流动负债合计]", {"流动资产合计": 300.0, "流动负债合计": 120.0}, 300.0 / 120.0),
+    ("([流动资产合计]-[存货]-[预付款项])/[流动负债合计]",
+     {"流动资产合计": 300.0, "存货": 50.0, "预付款项": 10.0, "流动负债合计": 120.0}, (300.0 - 50.0 - 10.0) / 120.0),
+    ("-[a]*2+[b]/4", {"a": 3.0, "b": 10.0}, -3.0 * 2 + 10.0 / 4),
+    ("（[a]+[b]）*[c]", {"a": 1.5, "b": 2.5, "c": 4.0}, (1.5 + 2.5) * 4.0)
+]
+
+def check_compile(path=FORMULA_CSV_PATH):
+    """
+    逐条编译 formula.csv 中的公式，统计可编译与语法错误的条数
+    返回:
+        bool: 是否通过
+    """
+    compiled = 0
+    errors = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for index, row in enumerate(csv.reader(f), 1):
+            if len(row) < 2 or not row[1].strip():
+                continue
+            try:
+                compile_formula(row[1].strip())
+                compiled += 1
+            except FormulaSyntaxError as e:
+                errors.append((index, str(e)))
+    print(f"formula.csv: 可编译 {compiled} 条, 语法错误 {len(errors)} 条")
+    for index, message in errors[:3]:
+        print(f"  第{index}条: {message}")
+    return compiled == EXPECTED_COMPILED and len(errors) == EXPECTED_SYNTAX_ERRORS
+
+def check_cache():
+    """
+    同一公式文本只编译一次
+    返回:
+        bool: 是否通过
+    """
+    formula = EVAL_CASES[0][0]
+    same = compile_formula(formula) is compile_formula(formula)
+    print(f"编译缓存: 同一公式返回同一对象 {same}")
+    return same
+
+def check_eval_equivalence():
+    """
+    闭包按float求值与替换变量后 eval 的结果一致，缺少变量时抛出 MissingVariableError
+    返回:
+        bool: 是否通过
+    """
+    passed = True
+    for formula, variables, expected in EVAL_CASES:
+        result = compile_formula(formula)(variables)
+        print(f"{formula} = {result!r}（eval: {expected!r}）")
+        passed = passed and result == expected
+    try:
+        compile_formula(EVAL_CASES[1][0])({"流动资产合计": 300.0})
+        passed = False
+    except MissingVariableError as e:
+        print(f"缺少变量: {e.names}")
+        passed = passed and e.names == ["存货", "预付款项", "流动负债合计"]
+    return passed
+
+def main():
+    """主函数"""
+    checks = [
+        ("formula.csv公式编译", check_compile),
+        ("编译缓存", check_cache),
+        ("与eval结果一致", check_eval_equivalence)
+    ]
+    failed = []
+    for title, check in checks:
+        print(f"\n--- {title} ---")
+        if not check():
+            failed.append(title)
+
+    if failed:
+        print(f"\n❌ 测试失败: {', '.join(failed)}")
+        return False
+    print("\n✅ 测试通过: 公式编译器各项检查均通过")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
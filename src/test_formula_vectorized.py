@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试向量化求值：缺失变量、非数值与除数为零分别给出掩码，有效行的结果与逐个求值一致
+"""
+
+import sys
+
+from formula_compiler import compile_formula
+from formula_vectorized import evaluate_records
+
+def check_masks():
+    """
+    缺失变量与除数为零的掩码；非数值只使本行无效，不影响整批
+    返回:
+        bool: 是否通过
+    """
+    records = [
+        {"[a]": "1,000", "[b]": "4"},
+        {"[a]": "1"},
+        {"[a]": "1", "[b]": "0"},
+        {"[a]": "n/a", "[b]": "1"}
+    ]
+    result = evaluate_records("[a]/[b]", records)
+    print(f"valid {result.valid.tolist()}, missing {result.missing.tolist()}, "
+          f"zero_division {result.zero_division.tolist()}, values {result.values.tolist()}")
+    return (result.valid.tolist() == [True, False, False, False]
+            and result.missing.tolist() == [False, True, False, True]
+            and result.zero_division.tolist() == [False, False, True, False]
+            and result.values[0] == 250.0)
+
+def check_matches_scalar():
+    """
+    有效行的向量化结果与逐个按float求值的结果相同
+    返回:
+        bool: 是否通过
+    """
+    formula = "([流动资产合计]-[存货]-[预付款项])/[流动负债合计]"
+    records = [
+        {"流动资产合计": 1000.0 + row * 7.5, "存货": row * 1.25, "预付款项": 3.0, "流动负债合计": 10.0 + row}
+        for row in range(100)
+    ]
+    result = evaluate_records(formula, records)
+    compiled = compile_formula(formula)
+    expected = [compiled.compute(record, "float") for record in records]
+    same = bool(result.valid.all()) and result.values.tolist() == expected
+    print(f"{len(records)} 行与逐个求值{'一致' if same else '不一致'}")
+    return same
+
+def main():
+    """主函数"""
+    checks = [
+        ("缺失变量与除数为零", check_masks),
+        ("与逐个求值一致", check_matches_scalar)
+    ]
+    failed = []
+    for title, check in checks:
+        print(f"\n--- {title} ---")
+        if not check():
+            failed.append(title)
+
+    if failed:
+        print(f"\n❌ 测试失败: {', '.join(failed)}")
+        return False
+    print("\n✅ 测试通过: 向量化求值各项检查均通过")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
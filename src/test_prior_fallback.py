@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试上期(T-1)回退规则：公式末尾的 "(若无T-1…取T年值)" 改写为 coalesce([X_T-1], [X])，
+有T-1值时使用T-1值，缺少T-1值时取本期值，两者都缺时报告缺少的变量；
+A计算机只把无法回退的空值变量报告为缺失
+"""
+
+import sys
+
+from formula_compiler import compile_formula, parse
+from a_computer_step2 import required_empty_variables
+
+PRIOR_FALLBACK_FORMULA = "[存货]-[存货_T-1]（若无T-1期数据，取T年值）"
+
+def check_rewrite():
+    """
+    带回退说明的公式改写为 coalesce，不带说明的公式保持不变
+    返回:
+        bool: 是否通过
+    """
+    with_rule = parse(PRIOR_FALLBACK_FORMULA)
+    without_rule = parse("[存货]-[存货_T-1]")
+    print(f"改写后: {with_rule}")
+    print(f"无说明: {without_rule}")
+    return (with_rule == ('sub', ('var', '存货'), ('coalesce', ('var', '存货_T-1'), ('var', '存货')))
+            and without_rule == ('sub', ('var', '存货'), ('var', '存货_T-1')))
+
+def check_evaluate():
+    """
+    有T-1值时使用T-1值，缺少时取本期值，两者都缺时报告缺少的变量
+    返回:
+        bool: 是否通过
+    """
+    compiled = compile_formula(PRIOR_FALLBACK_FORMULA)
+    with_prior = compiled.evaluate({"[存货]": "1,000", "[存货_T-1]": "800"})
+    without_prior = compiled.evaluate({"[存货]": "1,000", "[存货_T-1]": ""})
+    missing = compiled.missing_variables({})
+    print(f"有T-1: {with_prior!r}, 无T-1: {without_prior!r}, 都缺时缺少: {missing}")
+    return with_prior == 200.0 and without_prior == 0.0 and missing == ["存货", "存货_T-1"]
+
+def check_required_empty():
+    """
+    可由回退规则替代的空值不算缺失
+    返回:
+        bool: 是否通过
+    """
+    fallback = required_empty_variables(PRIOR_FALLBACK_FORMULA, {"[存货]": "1,000", "[存货_T-1]": ""}, ["[存货_T-1]"])
+    both = required_empty_variables(PRIOR_FALLBACK_FORMULA, {"[存货]": "", "[存货_T-1]": ""},
+                                    ["[存货]", "[存货_T-1]"])
+    print(f"只缺T-1: {fallback}, 都缺: {both}")
+    return fallback == [] and both == ["[存货]", "[存货_T-1]"]
+
+def main():
+    """主函数"""
+    checks = [
+        ("回退规则改写", check_rewrite),
+        ("回退求值", check_evaluate),
+        ("空值变量检查", check_required_empty)
+    ]
+    failed = []
+    for title, check in checks:
+        print(f"\n--- {title} ---")
+        if not check():
+            failed.append(title)
+
+    if failed:
+        print(f"\n❌ 测试失败: {', '.join(failed)}")
+        return False
+    print("\n✅ 测试通过: 上期回退各项检查均通过")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试A↔B消息编解码：元素经编码、解码后与原文档相同；
+同一元素再次发送时只发送变化字段，发送方原地修改字段后仍能正确还原；
+A↔B 交换结束后两端都不再保留该元素的缓存
+"""
+
+import copy
+import json
+import sys
+
+import message_bus
+from wire_codec import ElementCodec, WIRE_FORMATS, msgpack_available
+
+INPUT_JSON_PATH = '/home/super/linchen/250418-accountant-agent/input.json'
+
+def check_round_trip(wire_format, element):
+    """
+    一个元素按 b1 → a2 → b2 的顺序往返，每条消息解码后都与发送的文档相同
+    参数:
+        wire_format: "msgpack" 或 "json"
+        element: 元素字典
+    返回:
+        bool: 是否通过
+    """
+    sender = ElementCodec(wire_format)
+    receiver = ElementCodec(wire_format)
+    data = copy.deepcopy(element)
+    _, first, _ = receiver.decode(sender.encode("b1", data))
+    ok = first == element
+
+    # 原地修改字段后再次发送：只发送变化字段，接收方还原出修改后的文档
+    data['element_final_value'] = "1,234.56"
+    sources = data.get('element_fill_source', {}).get('data_source_list')
+    if sources and isinstance(sources[0].get('content'), dict):
+        sources[0]['content']['[测试变量]'] = "0.01"
+    _, second, _ = receiver.decode(sender.encode("a2", data))
+    ok = ok and second == data
+
+    # 接收方原地修改还原出的文档，不影响之后的还原
+    second['element_final_value'] = "已改动"
+    data['element_final_value'] = "2,000"
+    _, third, _ = receiver.decode(sender.encode("b2", data))
+    ok = ok and third == data and sender.stats["full"] == 1 and sender.stats["delta"] == 2
+
+    print(f"{wire_format}: 整份 {sender.stats['full']} 条, 增量 {sender.stats['delta']} 条, "
+          f"{sender.stats['bytes']} 字节, {'一致' if ok else '不一致'}")
+    return ok
+
+def check_states_released(element, count=5):
+    """
+    经本地socket交换多个元素后，A、B两端的编解码缓存都为空
+    参数:
+        element: 元素字典
+        count: 交换的元素个数
+    返回:
+        bool: 是否通过
+    """
+    a_end, b_end = message_bus.create_socket_pair("tcp", "127.0.0.1:0", wire_format="json")
+    thread = message_bus.start_b_thread(b_end, "local")
+    try:
+        for i in range(count):
+            data = copy.deepcopy(element)
+            data['element_uuid'] = f"{element.get('element_uuid')}-{i}"
+            message_bus.run_a(a_end, data, timeout=30)
+    finally:
+        a_end.close()
+        thread.join(5)
+    print(f"交换 {count} 个元素后缓存: A端 {len(a_end.codec.states)} 个, B端 {len(b_end.codec.states)} 个")
+    return not a_end.codec.states and not b_end.codec.states
+
+def main():
+    """主函数"""
+    with open(INPUT_JSON_PATH, 'r', encoding='utf-8') as f:
+        element = json.load(f)
+
+    failed = []
+    for wire_format in WIRE_FORMATS:
+        print(f"\n--- {wire_format}编码往返 ---")
+        if wire_format == "msgpack" and not msgpack_available():
+            print("未安装msgpack，跳过")
+            continue
+        if not check_round_trip(wire_format, element):
+            failed.append(wire_format)
+
+    print("\n--- 交换结束后释放缓存 ---")
+    if not check_states_released(element):
+        failed.append("缓存释放")
+
+    if failed:
+        print(f"\n❌ 测试失败: {', '.join(failed)}")
+        return False
+    print("\n✅ 测试通过: 消息编解码各项检查均通过")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
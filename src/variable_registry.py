@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+变量名驻留表：把公式中的变量名（不带中括号）映射为进程内唯一的整数ID。
+公式编译时一次性记录变量ID，求值时按ID从扁平数组中取值，
+不必对每个元素重新切分公式或按字符串查字典
+"""
+
+import threading
+
+class VariableRegistry:
+    """变量名 ↔ 整数ID，ID从0开始连续分配，只增不减"""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, name):
+        """
+        取变量名的ID，首次出现时分配新ID
+        参数:
+            name: 变量名（不带中括号）
+        返回:
+            整数ID
+        """
+        var_id = self.ids.get(name)
+        if var_id is not None:
+            return var_id
+        with self._lock:
+            var_id = self.ids.get(name)
+            if var_id is None:
+                var_id = len(self.names)
+                self.names.append(name)
+                self.ids[name] = var_id
+        return var_id
+
+    def intern_all(self, names):
+        """按顺序驻留一组变量名，返回ID元组"""
+        return tuple(self.intern(name) for name in names)
+
+    def get(self, name, default=None):
+        """查找变量名的ID，不分配新ID"""
+        return self.ids.get(name, default)
+
+    def name_of(self, var_id):
+        return self.names[var_id]
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __len__(self):
+        return len(self.names)
+
+# 进程内共享的驻留表：公式编译、公式目录与求值使用同一套ID
+_registry = VariableRegistry()
+
+def get_registry():
+    """获取进程内共享的变量驻留表"""
+    return _registry
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A↔B元素消息的紧凑编码：
+元素文档中 element_info（table_info、level_info、header_structure 等）是体积最大、各步骤都不变的静态部分，
+只有 compute_formula、data_source_list[0].content 与 element_final_value 会变化。
+同一连接上，每个 element_uuid 的静态部分只发送一次，之后只发送与上一条消息相比有变化的字段（delta），
+接收方用缓存的静态部分和上一次的字段值还原完整文档。帧体用 msgpack 编码（未安装时退回紧凑JSON），
+帧首字节标明编码方式，收发双方的编码方式不必一致。
+
+注意：还原出的文档与缓存共享静态部分的嵌套对象，调用方不应原地修改 element_info 等静态字段；
+变化字段在缓存中保存的是副本，调用方原地修改 content 等字段后再发送，仍能正确算出delta
+"""
+
+import copy
+import json
+import time
+import argparse
+from functools import lru_cache
+
+# 帧编码方式及其帧首字节
+WIRE_FORMATS = ("msgpack", "json")
+_FORMAT_TAGS = {"msgpack": b"M", "json": b"J"}
+
+# 变化字段在delta中的键：v 为 element_final_value，f 为 compute_formula，c 为 data_source_list[0].content
+_VALUE, _FORMULA, _CONTENT = "v", "f", "c"
+
+@lru_cache(maxsize=1)
+def msgpack_available():
+    """是否安装了msgpack"""
+    try:
+        import msgpack  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def default_wire_format():
+    """安装了msgpack时使用msgpack，否则使用JSON"""
+    return "msgpack" if msgpack_available() else "json"
+
+def split_element(data):
+    """
+    把元素文档拆分为静态部分和变化字段
+    参数:
+        data: 元素字典
+    返回:
+        (静态部分, delta字典)；静态部分中变化字段的值置为None，保留原有的键顺序
+    """
+    static = dict(data)
+    delta = {}
+    if "element_final_value" in data:
+        delta[_VALUE] = data["element_final_value"]
+        static["element_final_value"] = None
+    fill_source = data.get("element_fill_source")
+    if isinstance(fill_source, dict):
+        fill_source = static["element_fill_source"] = dict(fill_source)
+        if "compute_formula" in fill_source:
+            delta[_FORMULA] = fill_source["compute_formula"]
+            fill_source["compute_formula"] = None
+        sources = fill_source.get("data_source_list")
+        if isinstance(sources, list) and sources and isinstance(sources[0], dict) and "content" in sources[0]:
+            first = dict(sources[0])
+            delta[_CONTENT] = first["content"]
+            first["content"] = None
+            fill_source["data_source_list"] = [first] + sources[1:]
+    return static, delta
+
+def merge_element(static, delta):
+    """
+    用静态部分和变化字段还原元素文档（只复制被修改的那几层字典）
+    参数:
+        static: split_element 得到的静态部分
+        delta: 变化字段
+    返回:
+        元素字典
+    """
+    data = dict(static)
+    if _VALUE in delta:
+        data["element_final_value"] = delta[_VALUE]
+    if _FORMULA in delta or _CONTENT in delta:
+        fill_source = data["element_fill_source"] = dict(data["element_fill_source"])
+        if _FORMULA in delta:
+            fill_source["compute_formula"] = delta[_FORMULA]
+        if _CONTENT in delta:
+            sources = fill_source["data_source_list"]
+            first = dict(sources[0])
+            first["content"] = delta[_CONTENT]
+            fill_source["data_source_list"] = [first] + sources[1:]
+    return data
+
+class ElementCodec:
+    """
+    一个连接上的元素消息编解码器，收发两个方向共用缓存：
+    对端发来过、或本端发出过的 element_uuid，静态部分未变化时只发送与上一条消息相比变化了的字段。
+    同一元素的消息在A、B之间一问一答，两端的缓存因此保持一致
+    """
+
+    def __init__(self, wire_format=None):
+        """
+        参数:
+            wire_format: "msgpack" 或 "json"，None表示安装了msgpack时用msgpack
+        """
+        wire_format = wire_format or default_wire_format()
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"未知的编码方式: {wire_format}")
+        if wire_format == "msgpack" and not msgpack_available():
+            raise ValueError("使用msgpack编码需要安装msgpack")
+        self.wire_format = wire_format
+        # {element_uuid: [静态部分, 上一次的变化字段]}
+        self.states = {}
+        self.stats = {"full": 0, "delta": 0, "bytes": 0}
+
+    def encode(self, stage, data, meta=None):
+        """
+        编码一条消息
+        参数:
+            stage: 消息阶段
+            data: 元素字典
+            meta: 附加信息
+        返回:
+            帧字节串
+        """
+        uuid = data.get("element_uuid") if isinstance(data, dict) else None
+        if uuid is None:
+            # 没有 element_uuid 的文档无法引用，整份发送
+            frame = [stage, None, data, None, meta or {}]
+            self.stats["full"] += 1
+        else:
+            static, fields = split_element(data)
+            state = self.states.get(uuid)
+            if state is not None and state[1].keys() == fields.keys() and state[0] == static:
+                last = state[1]
+                delta = {key: value for key, value in fields.items() if last[key] != value}
+                # 保存副本：调用方之后原地修改字段对象时，缓存中的上一次值不随之改变
+                state[1] = copy.deepcopy(fields)
+                frame = [stage, uuid, None, delta, meta or {}]
+                self.stats["delta"] += 1
+            else:
+                self.states[uuid] = [static, copy.deepcopy(fields)]
+                frame = [stage, uuid, static, fields, meta or {}]
+                self.stats["full"] += 1
+        payload = _FORMAT_TAGS[self.wire_format] + _pack(self.wire_format, frame)
+        self.stats["bytes"] += len(payload)
+        return payload
+
+    def decode(self, payload):
+        """
+        解码一条消息
+        参数:
+            payload: 帧字节串
+        返回:
+            (阶段, 元素字典, 附加信息)
+        """
+        tag, body = payload[:1], payload[1:]
+        if tag == b"M":
+            stage, uuid, static, delta, meta = _unpack("msgpack", body)
+        elif tag == b"J":
+            stage, uuid, static, delta, meta = _unpack("json", body)
+        else:
+            raise ValueError(f"未知的帧类型: {tag!r}")
+        if uuid is None:
+            return stage, static, meta
+        if static is None:
+            state = self.states.get(uuid)
+            if state is None:
+                raise ValueError(f"元素 {uuid} 的静态部分尚未收到")
+            static = state[0]
+            fields = dict(state[1])
+            fields.update(delta)
+        else:
+            fields = delta
+            self.states[uuid] = state = [static, None]
+        # 缓存保存副本，接收方原地修改还原出的文档不会改动缓存
+        state[1] = copy.deepcopy(fields)
+        return stage, merge_element(static, fields), meta
+
+    def forget(self, uuid):
+        """删除一个元素的缓存（双方都调用后，下次重新整份发送）"""
+        self.states.pop(uuid, None)
+
+def _pack(wire_format, frame):
+    if wire_format == "msgpack":
+        import msgpack
+        return msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _unpack(wire_format, body):
+    if wire_format == "msgpack":
+        import msgpack
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return json.loads(body.decode('utf-8'))
+
+def main():
+    """比较整份紧凑JSON与静态部分只发一次的编码：消息大小与编解码耗时"""
+    parser = argparse.ArgumentParser(description="A↔B消息编码的大小与速度对比")
+    parser.add_argument("path", nargs="?", default="/home/super/linchen/250418-accountant-agent/input.json",
+                        help="元素JSON文件")
+    parser.add_argument("--elements", type=int, default=1000, help="模拟的元素数（复制并改写element_uuid）")
+    args = parser.parse_args()
+
+    with open(args.path, 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    elements = []
+    for index in range(args.elements):
+        element = json.loads(json.dumps(template))
+        element["element_uuid"] = f"{template.get('element_uuid', 'element')}_{index}"
+        elements.append(element)
+
+    def run(label, a_side, b_side):
+        # 每个元素经过 input、b1、a2、b2 四次传递（A、B交替发送），只有变化字段不同
+        started = time.perf_counter()
+        size = 0
+        for stage in ("input", "b1", "a2", "b2"):
+            sender, receiver = (a_side, b_side) if stage in ("input", "a2") else (b_side, a_side)
+            for index, element in enumerate(elements):
+                if stage == "a2":
+                    element["element_fill_source"]["data_source_list"][0]["content"] = {"[货币资金]": index}
+                elif stage == "b2":
+                    element["element_final_value"] = float(index)
+                payload = sender[0](stage, element)
+                size += len(payload)
+                receiver[1](payload)
+        elapsed = time.perf_counter() - started
+        messages = 4 * len(elements)
+        print(f"{label:<16} 平均 {size / messages:8.1f} 字节/条, {elapsed / messages * 1e6:8.2f} 微秒/条（编码+解码）")
+
+    def json_encode(stage, element):
+        return json.dumps([stage, element, {}], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def json_decode(payload):
+        return json.loads(payload.decode('utf-8'))
+
+    run("json 整份", (json_encode, json_decode), (json_encode, json_decode))
+    formats = ["json"] + (["msgpack"] if msgpack_available() else [])
+    for wire_format in formats:
+        a_codec, b_codec = ElementCodec(wire_format), ElementCodec(wire_format)
+        run(f"{wire_format} 增量", (a_codec.encode, a_codec.decode), (b_codec.encode, b_codec.decode))
+
+if __name__ == "__main__":
+    main()
@@ -7,27 +7,31 @@
 
 import json
 import os
+import sys
 import glob
 import re
 
+# 公式编译器等公共模块位于 src/ 目录
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from formula_compiler import compile_formula, FormulaError
+import calculator_tools
+
 # 定义四个基础运算函数
 def add(a, b):
-    """加法运算"""
-    return float(a) + float(b)
+    """加法运算（十进制精确计算）"""
+    return calculator_tools.add(a, b)
 
 def subtract(a, b):
-    """减法运算"""
-    return float(a) - float(b)
+    """减法运算（十进制精确计算）"""
+    return calculator_tools.subtract(a, b)
 
 def multiply(a, b):
-    """乘法运算"""
-    return float(a) * float(b)
+    """乘法运算（十进制精确计算）"""
+    return calculator_tools.multiply(a, b)
 
 def divide(a, b):
-    """除法运算"""
-    if float(b) == 0:
-        raise ValueError("除数不能为零")
-    return float(a) / float(b)
+    """除法运算（十进制精确计算）"""
+    return calculator_tools.divide(a, b)
 
 # 模拟LLM function call的函数
 def function_call_handler(function_name, args):
@@ -73,14 +77,13 @@ def evaluate_expression(expr):
     返回:
         计算结果
     """
-    # 使用正则表达式确保表达式只包含数字、运算符和括号
-    if not re.match(r'^[\d\s\+\-\*\/\(\)\.]+$', expr):
-        raise ValueError(f"不安全的表达式: {expr}")
-    
-    # 安全地计算表达式
+    # 使用公式编译器解析表达式（只接受数字、运算符和括号，不再经过eval）
     try:
-        return eval(expr, {"__builtins__": {}})
-    except Exception as e:
+        compiled = compile_formula(expr)
+        if compiled.variables:
+            raise ValueError(f"不安全的表达式: {expr}")
+        return compiled({})
+    except FormulaError as e:
         raise ValueError(f"表达式计算错误: {expr}, 错误: {str(e)}")
 
 def parse_formula(formula, variables):